@@ -1,4 +1,11 @@
-from importlib import metadata
+"""Sequana package
+
+Public classes and functions (e.g. :class:`~sequana.fastq.FastQ`) are
+exported lazily (PEP 562): the module that defines them is imported the first
+time they are accessed, so that ``import sequana`` stays cheap. Heavy
+third-party libraries are imported lazily through :mod:`sequana.lazy`.
+"""
+from importlib import import_module, metadata
 
 
 def get_package_version(package_name):
@@ -12,83 +19,119 @@ def get_package_version(package_name):
 version = get_package_version("sequana")
 
 
-from easydev.logging_tools import Logging
-
-try:
-    # new version of easydev logger
-    logger = Logging("sequana", "WARNING", text_color="green")
-except Exception:
-    logger = Logging("sequana", "WARNING")
-
-# To keep the inheritance/propagation of levels. Logging from easydev will do
-# the formatting only.
+# Logger formatted as with easydev.logging_tools.Logging, without importing
+# easydev (slow to import). Loggers of the sub-modules inherit/propagate
+# levels from this logger.
 import colorlog
 
-logger = colorlog.getLogger(logger.name)
-
-from easydev import CustomConfig
-
-configuration = CustomConfig("sequana", verbose=False)
-sequana_config_path = configuration.user_config_dir
-
-# The standalone app
-from . import scripts
-from .assembly import *
-from .bamtools import BAM, CRAM, SAM, SAMFlags
-from .bed import BED
-from .bedtools import SequanaCoverage
-from .cigar import Cigar
-
-# This must be import before all other modules (sequana_data function)
-from .codon import Codon
-
-# contig import is after fasta due to cycling imports
-from .contigs import Contigs
-from .coverage import Coverage
-from .datatools import sequana_data
-from .enrichment.gsea import GSEA
-from .enrichment.kegg import KEGGPathwayEnrichment
-
-# enrichment
-from .enrichment.mart import Mart
-from .enrichment.panther import PantherEnrichment
-from .fasta import FastA
-from .fastq import FastQ, FastQC, Identifier
-from .featurecounts import FeatureCount
-from .freebayes_vcf_filter import VCF_freebayes
-from .gff3 import GFF3
-from .homer import Homer
-from .idr import IDR
-from .itol import ITOL
-from .kraken.analysis import KrakenAnalysis, KrakenDB, KrakenPipeline, KrakenResults
-from .kraken.consensus import KrakenConsensus
-from .kraken.downloads import KrakenDownload
-from .kraken.multikraken import MultiKrakenResults, MultiKrakenResults2
-from .kraken.sequential import KrakenSequential
-from .krona import KronaMerger
-from .macs3 import MACS3Reader, PeakConsensus
-from .modules_report.summary import SequanaReport
-from .pacbio import PacbioSubreads
-from .phred import Quality
-from .repeats import (
-    HDNA,
-    TRF,
-    ZDNA,
-    APhasedRepeats,
-    Cruciforms,
-    DirectRepeats,
-    G4Hunter,
-    G4HunterReader,
-    GQuadruplex,
-    IMotif,
-    MirrorRepeats,
-    Palindromes,
-    Repeats,
-    ShortTandemRepeats,
+logger = colorlog.getLogger("sequana")
+_handler = colorlog.StreamHandler()
+_handler.setFormatter(
+    colorlog.ColoredFormatter(
+        "%(log_color)s%(levelname)-8s[%(name)s:%(lineno)d]: %(reset)s %(green)s%(message)s",
+        reset=True,
+        log_colors={"DEBUG": "cyan", "INFO": "green", "WARNING": "yellow", "ERROR": "red", "CRITICAL": "bold_red"},
+    )
 )
-from .rnadiff import RNADiffResults
-from .running_median import RunningMedian
-from .sequence import DNA, RNA, Sequence
-from .snpeff import SnpEff
-from .tools import reverse_complement
-from .variants import VariantFile
+logger.addHandler(_handler)
+logger.setLevel("WARNING")
+
+
+# public name -> module where it is defined (relative to sequana)
+_LAZY_EXPORTS = {
+    "BUSCO": ".assembly",
+    "BAM": ".bamtools",
+    "CRAM": ".bamtools",
+    "SAM": ".bamtools",
+    "SAMFlags": ".bamtools",
+    "BED": ".bed",
+    "SequanaCoverage": ".bedtools",
+    "Cigar": ".cigar",
+    "Codon": ".codon",
+    "Contigs": ".contigs",
+    "Coverage": ".coverage",
+    "sequana_data": ".datatools",
+    "GSEA": ".enrichment.gsea",
+    "KEGGPathwayEnrichment": ".enrichment.kegg",
+    "Mart": ".enrichment.mart",
+    "PantherEnrichment": ".enrichment.panther",
+    "FastA": ".fasta",
+    "FastQ": ".fastq",
+    "FastQC": ".fastq",
+    "Identifier": ".fastq",
+    "FeatureCount": ".featurecounts",
+    "VCF_freebayes": ".freebayes_vcf_filter",
+    "GFF3": ".gff3",
+    "Homer": ".homer",
+    "IDR": ".idr",
+    "ITOL": ".itol",
+    "KrakenAnalysis": ".kraken.analysis",
+    "KrakenDB": ".kraken.analysis",
+    "KrakenPipeline": ".kraken.analysis",
+    "KrakenResults": ".kraken.analysis",
+    "KrakenConsensus": ".kraken.consensus",
+    "KrakenDownload": ".kraken.downloads",
+    "MultiKrakenResults": ".kraken.multikraken",
+    "MultiKrakenResults2": ".kraken.multikraken",
+    "KrakenSequential": ".kraken.sequential",
+    "KronaMerger": ".krona",
+    "MACS3Reader": ".macs3",
+    "PeakConsensus": ".macs3",
+    "SequanaReport": ".modules_report.summary",
+    "PacbioSubreads": ".pacbio",
+    "Quality": ".phred",
+    "HDNA": ".repeats",
+    "TRF": ".repeats",
+    "ZDNA": ".repeats",
+    "APhasedRepeats": ".repeats",
+    "Cruciforms": ".repeats",
+    "DirectRepeats": ".repeats",
+    "G4Hunter": ".repeats",
+    "G4HunterReader": ".repeats",
+    "GQuadruplex": ".repeats",
+    "IMotif": ".repeats",
+    "MirrorRepeats": ".repeats",
+    "Palindromes": ".repeats",
+    "Repeats": ".repeats",
+    "ShortTandemRepeats": ".repeats",
+    "RNADiffResults": ".rnadiff",
+    "RunningMedian": ".running_median",
+    "DNA": ".sequence",
+    "RNA": ".sequence",
+    "Sequence": ".sequence",
+    "SnpEff": ".snpeff",
+    "reverse_complement": ".tools",
+    "VariantFile": ".variants",
+}
+
+__all__ = ["version", "logger", "configuration", "sequana_config_path"] + list(_LAZY_EXPORTS)
+
+
+def _get_configuration():
+    from easydev import CustomConfig
+
+    return CustomConfig("sequana", verbose=False)
+
+
+def __getattr__(name):
+    if name in _LAZY_EXPORTS:
+        value = getattr(import_module(_LAZY_EXPORTS[name], __name__), name)
+    elif name == "configuration":
+        value = _get_configuration()
+    elif name == "sequana_config_path":
+        value = __getattr__("configuration").user_config_dir
+    else:
+        # sub-packages and modules (e.g. sequana.scripts)
+        try:
+            value = import_module(f".{name}", __name__)
+        except ModuleNotFoundError as err:
+            if err.name != f"{__name__}.{name}":
+                raise
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    # next accesses do not go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -21,15 +21,19 @@
     SAM
     SAMFlags
     SAMBAMbase
+    BAMStatsCollector
 
 .. note:: BAM being the compressed version of SAM files, we do not
     implement any functionalities related to SAM files. We strongly encourage
     developers to convert their SAM to BAM.
 
 """
+import array
 import json
 import math
 from collections import Counter, OrderedDict, defaultdict
+from itertools import islice
+from operator import attrgetter
 
 import colorlog
 from bx.bitset import BinnedBitSet
@@ -57,7 +61,7 @@ Interesting commands::
 """
 
 # SAMBAMbase is for the doc
-__all__ = ["BAM", "Alignment", "SAMFlags", "CS", "SAM", "CRAM", "SAMBAMbase"]
+__all__ = ["BAM", "Alignment", "SAMFlags", "CS", "SAM", "CRAM", "SAMBAMbase", "BAMStatsCollector"]
 
 
 # simple decorator to rewind the BAM file
@@ -77,6 +81,26 @@ def _reset(f):
     return wrapper
 
 
+def _get_reference_end(alignment):
+    end = alignment.reference_end
+    return -1 if end is None else end
+
+
+# columns available in SAMBAMbase.get_df: array typecode (None for strings),
+# dtype and getter. rname is stored as reference id and converted into a
+# categorical column.
+ALIGNMENT_FIELDS = {
+    "flag": ("H", "uint16", attrgetter("flag")),
+    "rstart": ("i", "int32", attrgetter("reference_start")),
+    "rend": ("i", "int32", _get_reference_end),
+    "mapqs": ("B", "uint8", attrgetter("mapping_quality")),
+    "rname": ("i", "int32", attrgetter("reference_id")),
+    "qname": (None, "object", attrgetter("query_name")),
+    "qlen": ("i", "int32", attrgetter("query_length")),
+    "qalen": ("i", "int32", attrgetter("query_alignment_length")),
+    "cigar": (None, "object", attrgetter("cigarstring")),
+}
+
 # There are lots of trouble with inheriting from pysam.AlignmentFile
 # First, you cannot use super(). indeed, it works for py27 but not
 # with py35 probably a missing __init__  or __new__ in
@@ -159,6 +183,7 @@ class SAMBAMbase:
         self._kwargs = kwargs
         self._summary = None
         self._sorted = None
+        self._stats = None
 
         # Save the length so that second time we need it, it is already
         # computed.
@@ -245,78 +270,125 @@ class SAMBAMbase:
         data = [abs(x) for x in data if x >= lower_bound and x <= upper_bound]
         return pylab.mean([abs(x) for x in data])
 
-    @_reset
-    def get_df(self, max_align=-1, progress=True, include_cigar=False):
+    def _iter_columns(self, fields, chunksize=100000, max_align=-1, progress=False, region=None):
+        """Yield dictionaries of NumPy arrays (one per field) by chunks
+
+        Reference names are returned as reference identifiers (-1 if none).
+        If *region* is a tuple (contig, start, end), only alignments overlapping
+        the region are read (requires an index).
+        """
+        for field in fields:
+            if field not in ALIGNMENT_FIELDS:
+                raise ValueError(f"field must be in {list(ALIGNMENT_FIELDS)}. Got {field}")
+
+        self.reset()
+        alignments = self._data if region is None else self._data.fetch(*region)
+        alignments = alignments if max_align == -1 else islice(alignments, max_align)
+        alignments = iter(tqdm(alignments, leave=False, disable=not progress))
+
+        while True:
+            columns = {f: array.array(ALIGNMENT_FIELDS[f][0]) if ALIGNMENT_FIELDS[f][0] else [] for f in fields}
+            getters = [(columns[f].append, ALIGNMENT_FIELDS[f][2]) for f in fields]
+            count = 0
+            for aln in islice(alignments, chunksize):
+                for append, getter in getters:
+                    append(getter(aln))
+                count += 1
+            if count == 0:
+                break
+            yield {f: np.asarray(columns[f], dtype=ALIGNMENT_FIELDS[f][1]) for f in fields}
+            if count < chunksize:
+                break
+
+    def _columns_to_df(self, columns):
+        df = pd.DataFrame(columns)
+        if "rname" in df.columns:
+            references = list(self._data.references)
+            df["rname"] = pd.Categorical.from_codes(columns["rname"], categories=references)
+        return df
+
+    def iter_df(self, fields=None, chunksize=100000, max_align=-1, progress=False):
+        """Yield dataframes of *chunksize* alignments (see :meth:`get_df`)"""
+        fields = fields or [f for f in ALIGNMENT_FIELDS if f != "cigar"]
+        for columns in self._iter_columns(fields, chunksize, max_align, progress):
+            yield self._columns_to_df(columns)
+
+    def get_df(self, max_align=-1, progress=True, include_cigar=False, fields=None, chunksize=None):
         """Build a :class:`pandas.DataFrame` with one row per alignment.
 
-        Columns include ``flags``, ``mapq``, ``start``, ``end``, ``rname``
-        (reference name), ``qname`` (query/read name), ``query_length``,
-        ``query_aln_length``, and CIGAR-derived counts ``I`` (insertions),
-        ``D`` (deletions), and ``M`` (matches), plus the number of mismatches
-        (``NM`` tag) and ``mismatch`` (NM normalised by alignment length).
+        Columns include ``flag``, ``rstart``, ``rend`` (reference start and end;
+        -1 if not available), ``mapqs``, ``rname`` (reference name as a
+        categorical; NaN for unplaced reads), ``qname`` (query/read name),
+        ``qlen`` (query length) and ``qalen`` (query alignment length).
+        Numerical columns are stored as int32 (uint16 for flags and uint8 for
+        mapping qualities).
 
         :param int max_align: maximum number of alignments to include.  ``-1``
             means no limit.
         :param bool progress: show a tqdm progress bar.  Defaults to ``True``.
         :param bool include_cigar: include the raw CIGAR string in the
             returned dataframe.  Defaults to ``False``.
+        :param list fields: columns to extract (see
+            :data:`ALIGNMENT_FIELDS`). Default to all columns but cigar.
+            Avoid *qname* on large files.
+        :param int chunksize: if set, returns a generator of dataframes of
+            *chunksize* alignments instead of a single dataframe.
         :return: DataFrame with one row per alignment.
         :rtype: pandas.DataFrame
-        """
-        flags = []
-        starts = []
-        ends = []
-        mapqs = []
-        refnames = []
-        querynames = []
-        querylengths = []
-        query_aln_lengths = []
-        cigar = []
-        for i, a in tqdm(enumerate(self._data), leave=False, disable=not progress):
-            flags.append(a.flag)
-            starts.append(a.reference_start)
-            ends.append(a.reference_end)
-            mapqs.append(a.mapq)
-            cigar.append(a.cigarstring)
-            try:
-                refnames.append(a.reference_name)
-            except:
-                refnames.append(-1)
-            querynames.append(a.query_name)
-            querylengths.append(a.query_length)
-            query_aln_lengths.append(a.query_alignment_length)
-            if max_align != -1 and i > max_align:
-                break
 
-        if include_cigar:
-            df = pd.DataFrame(
-                {
-                    "flag": flags,
-                    "rstart": starts,
-                    "rend": ends,
-                    "mapqs": mapqs,
-                    "rname": refnames,
-                    "qname": querynames,
-                    "qlen": querylengths,
-                    "qalen": query_aln_lengths,
-                    "cigar": cigar,
-                }
-            )
+        ::
 
-        else:
-            df = pd.DataFrame(
-                {
-                    "flag": flags,
-                    "rstart": starts,
-                    "rend": ends,
-                    "mapqs": mapqs,
-                    "rname": refnames,
-                    "qname": querynames,
-                    "qlen": querylengths,
-                    "qalen": query_aln_lengths,
-                }
-            )
-        return df
+            b = BAM("test.bam")
+            df = b.get_df(fields=["flag", "rname"])
+            for chunk in b.get_df(fields=["rname", "rstart"], chunksize=1000000):
+                pass
+
+        """
+        if fields is None:
+            fields = [f for f in ALIGNMENT_FIELDS if f != "cigar" or include_cigar]
+        if chunksize:
+            return self.iter_df(fields, chunksize=chunksize, max_align=max_align, progress=progress)
+
+        chunks = list(self.iter_df(fields, max_align=max_align, progress=progress))
+        if not chunks:
+            return self._columns_to_df({f: np.array([], dtype=ALIGNMENT_FIELDS[f][1]) for f in fields})
+        return pd.concat(chunks, ignore_index=True)
+
+    def get_reference_counts(self, exclude_secondary=True, method="bincount"):
+        """Return the number of alignments per reference
+
+        :param bool exclude_secondary: exclude alignments with a flag above
+            256 (secondary, QC fail, duplicates and supplementary alignments).
+        :param str method: *bincount* reads flags and reference ids of all
+            alignments (unmapped reads with flag 4 are ignored). *index* uses
+            the statistics of the BAM index (mapped alignments, secondary
+            included) without reading the alignments; *exclude_secondary*
+            must be False. Files without index are read (*bincount*).
+        :return: a :class:`pandas.Series` indexed by reference names
+        """
+        references = list(self._data.references)
+        if method == "index":
+            if exclude_secondary:
+                raise ValueError("index statistics include secondary alignments. Set exclude_secondary to False")
+            try:
+                stats = self._data.get_index_statistics()
+            except ValueError:
+                stats = []
+            # old indices may not store any statistics
+            if sum(x.total for x in stats):
+                return pd.Series({x.contig: x.mapped for x in stats}, index=references, dtype="int64")
+            logger.warning(f"No index statistics for {self._filename}. Reading all alignments")
+        elif method != "bincount":
+            raise ValueError(f"method must be bincount or index. Got {method}")
+
+        counts = np.zeros(len(references), dtype=np.int64)
+        for columns in self._iter_columns(["flag", "rname"], chunksize=1000000):
+            flags, ids = columns["flag"], columns["rname"]
+            mask = (flags != 4) & (ids >= 0)
+            if exclude_secondary:
+                mask &= flags < 256
+            counts += np.bincount(ids[mask], minlength=len(references))
+        return pd.Series(counts, index=references)
 
     @_reset
     def get_df_concordance(self, max_align=-1, progress=True):
@@ -839,39 +911,39 @@ class SAMBAMbase:
         else:
             d[item] = n
 
-    def _get_summary(self):
-        """Count flags/mapq/read length in one pass."""
-        if self._summary is not None:
-            return self._summary
-        else:
-            # make sure we reset the pointer to the first read
-            self.reset()
+    def collect_stats(self, metrics=None, mapq=30, processes=None, shard_size=None):
+        """Compute all alignment statistics in a single pass
 
-        mapq_dict = {}
-        read_length_dict = {}
-        flag_dict = {}
-        mean_qualities = []
+        :return: a :class:`BAMStatsCollector`. The collector with all metrics
+            and default *mapq* is stored and reused by :attr:`summary`,
+            :meth:`get_stats_full`, :meth:`get_length_count`,
+            :meth:`plot_bar_flags`, :meth:`plot_bar_mapq` and
+            :meth:`plot_indel_dist`.
 
-        for read in tqdm(self, leave=False):
-            self._count_item(mapq_dict, read.mapq)
-            self._count_item(flag_dict, read.flag)
-            if read.is_unmapped is False:
-                self._count_item(read_length_dict, read.reference_length)
-            try:
-                mean_qualities.append(pylab.mean(read.query_qualities))
-            except TypeError:
-                mean_qualities.append(-1)
-        # FIXME do we need the try/except if so, add Exception
-        try:
-            mq = pylab.mean(mean_qualities)
-        except:
-            mq = 0
-        self._summary = {
-            "mapq": mapq_dict,
-            "read_length": read_length_dict,
-            "flags": flag_dict,
-            "mean_quality": pylab.mean(mean_qualities),
-        }
+        See :meth:`BAMStatsCollector.from_file` for the parameters.
+        """
+        default = metrics is None and mapq == 30
+        if default and self._stats is not None:
+            return self._stats
+
+        collector = BAMStatsCollector.from_file(
+            self._filename,
+            mode=self._mode,
+            metrics=metrics,
+            mapq=mapq,
+            processes=processes,
+            shard_size=shard_size,
+            **self._kwargs,
+        )
+        self._N = collector.count
+        if default:
+            self._stats = collector
+        return collector
+
+    def _get_summary(self):
+        """Count flags/mapq/read length in one pass."""
+        if self._summary is None:
+            self._summary = self.collect_stats().get_summary()
         return self._summary
 
     summary = property(_get_summary)
@@ -1020,169 +1092,19 @@ class SAMBAMbase:
         :rtype: dict
 
         .. note::
-            On a typical BAM file this takes around 7 minutes.  For a faster
-            (but less detailed) summary use :meth:`get_stats`.
+            All statistics are computed in the same pass (see
+            :meth:`collect_stats`), which can be shared between processes for
+            indexed files. For a faster (but less detailed) summary use
+            :meth:`get_stats`.
         """
-        # On a bam, this takes about 7minutes
-        # while calling samtools directly takes a little bit more than 1 minute.
-        # but then we can re-use this independently of samtools (not pysam though)
-
-        average_quality = 0
-        average_length = 0
-        bases_mapped = 0
-        bases_mapped_cigar = 0  # more precise according to samtools
-        forward = 0
-        reads_duplicated = 0
-        insert_size_sum = 0
-        insert_size_sum_square = 0
-        non_splice = 0
-        mapq0 = 0
-        mismatches = 0
-        multiple_hit = 0
-        qc_fail = 0
-        reverse = 0
-        reads_paired = 0
-        unique_hit = 0
-        unmapped = 0
-        read1 = 0
-        read2 = 0
-        splice = 0
-        secondary = 0
-        pair_diff_chrom = 0
-        proper_pair = 0
-        total_aln = 0
-        total_length = 0
-        total_r1_length = 0
-        total_r2_length = 0
-
-        for aln in self:
-            total_aln += 1
-            average_quality += sum(aln.query_qualities) / len(aln.query_qualities)
-
-            if aln.is_paired:
-                reads_paired += 1
-
-            if aln.is_unmapped:
-                unmapped += 1
-
-            if aln.is_qcfail:
-                qc_fail += 1
-                continue
-            if aln.is_duplicate:
-                reads_duplicated += 1
-                continue
-            if aln.is_secondary:
-                secondary += 1
-                continue
-
-            total_length += aln.rlen
-
-            # fixme not really a multiple hit in 100% of cases
-            if aln.mapq < mapq:
-                multiple_hit += 1
-                continue
-            else:
-                unique_hit += 1
-                if aln.is_read1:
-                    read1 += 1
-                    total_r1_length += aln.rlen
-                if aln.is_read2:
-                    read2 += 1
-                    total_r2_length += aln.rlen
-                if aln.is_reverse:
-                    reverse += 1
-                else:
-                    forward += 1
-
-            if aln.mapq == 0:
-                mapq += 0
-
-            # average length of all MAPPED reads to divide by read1+read2 that
-            # mapped
-            average_length += aln.rlen
-            A = abs(aln.tlen)
-
-            bases_mapped_cigar += sum([a[1] for a in aln.cigar if a[0] in [0, 1]])
-            bases_mapped += aln.rlen
-
-            introns = fetch_intron("dummy", aln.pos, aln.cigar)
-            if len(introns) == 0:
-                non_splice += 1
-            elif len(introns) >= 1:
-                splice += 1
-
-            if aln.is_proper_pair:
-                proper_pair += 1
-                read1_ref = self._data.get_reference_name(aln.tid)
-                read2_ref = self._data.get_reference_name(aln.rnext)
-                if read1_ref != read2_ref:
-                    pair_diff_chrom += 1
-                if aln.pos != 0:
-                    # to avoid effect of circular genome
-                    insert_size_sum += A
-                    insert_size_sum_square += A * A
-
-            # If NM is provided, not always the case though
-            try:
-                mismatches += aln.get_tag("NM")
-            except:
-                pass
-
-            if total_aln % 100000 == 0:
-                print(total_aln)
-                if max_entries != -1 and total_aln >= max_entries:
-                    break
-            if max_entries != -1 and total_aln >= max_entries:
-                break
-
-        results = {
-            "average_quality": average_quality / total_aln,
-            "average_length": average_length / (read1 + read2),
-            "bases mapped (cigar)": bases_mapped_cigar,
-            "bases mapped ": bases_mapped,
-            "forward": forward,
-            "is sorted": self.is_sorted,
-            "unmapped": unmapped,
-            "mismatches": mismatches,
-            "multiple_hit": multiple_hit,
-            "non_splice": non_splice,
-            "pair_diff_chrom": pair_diff_chrom,
-            "proper_pair": proper_pair,
-            "qc_fail": qc_fail,
-            "read1": read1,
-            "read2": read2,
-            "reads_duplicated": reads_duplicated,
-            "reads_mapq0": mapq0,
-            "reads_mapped": read1 + read2,
-            "reads_paired": reads_paired,
-            # In theory, the next one is paired-end technology bit set + both mates mapped
-            "reads_mapped_and_paired": reads_paired - secondary,
-            "raw_total_sequences": total_aln - secondary,
-            "reverse": reverse,
-            "non_primary_alignements": secondary,
-            "secondary": secondary,
-            "splice": splice,
-            "total_alignments": total_aln,
-            "total_first_fragment_length": total_r1_length,
-            "total_last_fragment_length": total_r2_length,
-            "total_length": total_length,  # ignoring secondary, qcfail to agree with samtools
-            "unique_hit": unique_hit,
-            "error_rate": mismatches / bases_mapped_cigar,
-        }
-        assert results["forward"] + results["reverse"]
-
-        if proper_pair > 0:
-            results["insert_size_average"] = insert_size_sum / proper_pair
-            results["insert_size_std"] = math.sqrt(
-                insert_size_sum_square / (proper_pair) - (insert_size_sum / (proper_pair)) ** 2
-            )
-        if reads_paired > 0:
-            results["percentage_properly_paired"] = 100 * proper_pair / reads_paired
+        if max_entries == -1:
+            collector = self.collect_stats(mapq=mapq)
         else:
-            results["percentage_properly_paired"] = 0
-        # else:
-        #    results["insert_size_std"] = None
+            collector = BAMStatsCollector(mapq=mapq).collect(islice(self._data, max_entries))
 
+        results = collector.get_stats_full()
+        results["is sorted"] = self.is_sorted
+        assert results["forward"] + results["reverse"]
         return results
 
     """
@@ -1268,8 +1190,7 @@ SN	pairs on different chromosomes:	0
 
         .. seealso:: :class:`SAMFlags` for meaning of each flag
         """
-        df = self.get_flags_as_df()
-        df = df.sum()
+        df = self.collect_stats().get_flags_count()
         pylab.clf()
         if logy is True:
             barplot = df.plot(kind="bar", logy=logy, grid=True)
@@ -1372,14 +1293,11 @@ SN	pairs on different chromosomes:	0
             b.plot_bar_mapq()
 
         """
-        df = self.get_mapq_as_df()
-        df.plot(
-            kind="hist",
-            bins=range(0, df.max().values[0] + 1),
-            legend=False,
-            grid=True,
-            logy=True,
-        )
+        counts = self.collect_stats().mapq
+        M = int(np.flatnonzero(counts).max()) if counts.any() else 0
+        pylab.clf()
+        pylab.hist(range(M + 1), bins=range(0, max(M, 1) + 1), weights=counts[: M + 1], log=True)
+        pylab.grid(True)
         pylab.xlabel("MAPQ", fontsize=fontsize)
         pylab.ylabel("Count", fontsize=fontsize)
         pylab.gcf().set_layout_engine("tight")
@@ -1405,19 +1323,20 @@ SN	pairs on different chromosomes:	0
     def get_gc_content(self):
         """Return GC content for all reads (mapped or not)
 
+        This reads the whole file to return one exact value per read. The
+        histogram of GC content (1% bins) is computed in the single pass of
+        :meth:`collect_stats` (*gc* attribute).
+
         .. seealso:: :meth:`plot_gc_content`
 
         """
         data = [(f.seq.count("C") + f.seq.count("G")) / len(f.seq) * 100.0 for f in self if f.seq]
         return data
 
-    @_reset
     def get_length_count(self):
         """Return counter of all fragment lengths"""
-        import collections
-
-        data = [this.rlen for this in self]
-        return collections.Counter(data)
+        lengths = self.collect_stats().read_length
+        return Counter({int(k): int(lengths[k]) for k in np.flatnonzero(lengths)})
 
     def plot_gc_content(self, fontsize=16, ec="k", bins=100):
         """plot GC content histogram
@@ -1434,16 +1353,19 @@ SN	pairs on different chromosomes:	0
             b.plot_gc_content()
 
         """
-        data = self.get_gc_content()
+        # histogram of the truncated percentages (0, 1, ..., 100) computed
+        # with the other statistics; each bin is drawn at its center
+        counts = self.collect_stats().gc
+        values = np.minimum(np.arange(101) + 0.5, 100)
         try:
             X = np.linspace(0, 100, bins)
         except:
             X = bins.copy()
 
-        pylab.hist(data, X, density=True, ec=ec)
+        pylab.hist(values, X, weights=counts, density=True, ec=ec)
         pylab.grid(True)
-        mu = pylab.mean(data)
-        sigma = pylab.std(data)
+        mu = np.average(values, weights=counts)
+        sigma = np.sqrt(np.average((values - mu) ** 2, weights=counts))
 
         X = pylab.linspace(X.min(), X.max(), 100)
 
@@ -1486,60 +1408,153 @@ SN	pairs on different chromosomes:	0
         # this scans the alignments once for all
         self.alignments = [this for this in self]
 
-    @_reset
     def _set_coverage(self):
         """Compute per-reference coverage vectors and store in :attr:`coverage`.
 
-        Requires that alignments have been cached via :meth:`_set_alignments`.
         Each key of :attr:`coverage` is a reference ID (integer) and the value
-        is a NumPy array of length equal to the longest alignment end position
-        seen for that reference.
+        is a NumPy array of length equal to the reference length. Only
+        references with at least one alignment are stored. See
+        :meth:`get_coverage` for details.
         """
-        try:
-            self.alignments
-        except AttributeError:
-            self._set_alignments()
-        ref_start = defaultdict(list)
-        ref_end = defaultdict(list)
-
-        for aln in self.alignments:
-            # Of course, we must have a valid reference name and start/end position not set to None
-            if aln.flag not in [4] and aln.rname != -1 and aln.reference_end and aln.reference_start:
-                ref_start[aln.rname].append(aln.reference_start)
-                ref_end[aln.rname].append(aln.reference_end)
-
-        self.coverage = {}
-
-        for rname in ref_start.keys():
-            N = max(ref_end[rname])
-            self.coverage[rname] = np.zeros(N)
-            for x, y in zip(ref_start[rname], ref_end[rname]):
-                if y and x >= 0 and y >= 0:
-                    self.coverage[rname][x:y] += 1
-                else:
-                    pass
+        # references are yielded in the order of the header
+        self.coverage = {
+            rid: coverage for rid, (_, _, coverage) in enumerate(self.iter_coverage(flag=4)) if coverage.any()
+        }
+
+    def iter_coverage(self, chrom=None, start=None, end=None, mapq=0, flag=1796, chunksize=1000000):
+        """Yield the depth of coverage of each reference
+
+        :param str chrom: restrict the coverage to this reference. Requires an
+            index if *start* or *end* are provided.
+        :param int start: 0-based start of the region (default to 0)
+        :param int end: 0-based end (excluded) of the region (default to the
+            reference length)
+        :param int mapq: ignore alignments with a mapping quality below this value
+        :param int flag: ignore alignments with any of these bits set (default
+            to unmapped, secondary, QC fail and duplicates as in samtools depth
+            or mosdepth)
+        :param int chunksize: number of alignments read at once
+        :return: generator of tuples (reference name, start, coverage) where
+            coverage[i] is the depth at the 0-based position start + i
+
+        The start and end positions of the alignments are accumulated into a
+        difference array that is integrated once (cumulative sum) so that the
+        cost does not depend on the read lengths. Deletions and skipped
+        regions within an alignment are counted as covered.
+
+        The file is read once. If it is sorted by coordinates, the coverage of
+        a reference is yielded as soon as all its alignments have been read so
+        that only one vector is kept in memory. A region (*chrom*) is fetched
+        with the index if available.
+        """
+        if chrom is None and (start is not None or end is not None):
+            raise ValueError("start and end can only be used with a chrom")
+        if chrom is not None and chrom not in self.lengths:
+            raise ValueError(f"{chrom} not found in the references")
+
+        references = list(self._data.references)
+        fields = ["flag", "mapqs", "rname", "rstart", "rend"]
+        region = None
+
+        if chrom is not None:
+            start = 0 if start is None else max(start, 0)
+            end = self.lengths[chrom] if end is None else min(end, self.lengths[chrom])
+            if self._data.has_index():
+                region = (chrom, start, end)
+            elif start > 0 or end < self.lengths[chrom]:
+                raise ValueError(f"An index is required to get the coverage of a region of {chrom}")
+            offset, sizes = start, {chrom: end - start}
+        else:
+            offset, sizes = 0, self.lengths
+
+        is_sorted = region is None and self._data.header.get("HD", {}).get("SO") == "coordinate"
+        diffs = {}
+        # references before this one have been yielded already
+        current = 0
+
+        def get_coverage(name):
+            if name in diffs:
+                return np.cumsum(diffs.pop(name)[:-1], dtype=np.int32)
+            return np.zeros(sizes[name], dtype=np.int32)
+
+        for columns in self._iter_columns(fields, chunksize=chunksize, region=region):
+            mask = (columns["flag"] & flag == 0) & (columns["mapqs"] >= mapq)
+            mask &= (columns["rname"] >= 0) & (columns["rend"] >= 0)
+            ids = columns["rname"][mask]
+            # group the alignments by reference once (already grouped if sorted)
+            order = np.argsort(ids, kind="stable")
+            sorted_ids = ids[order]
+            # clip alignments to the region
+            starts = columns["rstart"][mask][order] - offset
+            ends = columns["rend"][mask][order] - offset
+            rids, bounds = np.unique(sorted_ids, return_index=True)
+            bounds = np.append(bounds, len(sorted_ids))
+            for rid, first, last in zip(rids.tolist(), bounds[:-1].tolist(), bounds[1:].tolist()):
+                name = references[rid]
+                if name not in sizes:
+                    continue
+                if name not in diffs:
+                    diffs[name] = np.zeros(sizes[name] + 1, dtype=np.int32)
+                np.add.at(diffs[name], np.clip(starts[first:last], 0, sizes[name]), 1)
+                np.add.at(diffs[name], np.clip(ends[first:last], 0, sizes[name]), -1)
+
+            if is_sorted and len(ids):
+                # alignments of the last reference may be in the next chunk
+                for name in references[current : ids[-1]]:
+                    yield name, offset, get_coverage(name)
+                current = max(current, ids[-1])
+
+        for name in sizes if chrom is not None else references[current:]:
+            yield name, offset, get_coverage(name)
+
+    def get_coverage(self, chrom=None, start=None, end=None, mapq=0, flag=1796):
+        """Return the depth of coverage of each reference
+
+        ::
+
+            from sequana import sequana_data, BAM
+            b = BAM(sequana_data("measles.fa.sorted.bam"))
+            coverage = b.get_coverage()["ENA|K01711|K01711.1"]
+
+        :return: dictionary with reference names as keys and coverage vectors
+            as values. See :meth:`iter_coverage` for the parameters.
+        """
+        return {name: coverage for name, _, coverage in self.iter_coverage(chrom, start, end, mapq=mapq, flag=flag)}
+
+    def to_genomecov(self, filename, chrom=None, start=None, end=None, mapq=0, flag=1796):
+        """Save the depth of coverage in a BED file used by :class:`~sequana.bedtools.SequanaCoverage`
+
+        The output has 3 tab-separated columns (reference name, 1-based
+        position, depth) and includes positions with no coverage as in
+        *samtools depth -aa*. See :meth:`iter_coverage` for the parameters.
+
+        ::
+
+            b = BAM(sequana_data("measles.fa.sorted.bam"))
+            b.to_genomecov("measles.bed")
+
+        """
+        step = 2**20
+        with open(filename, "w") as fout:
+            for name, offset, coverage in self.iter_coverage(chrom, start, end, mapq=mapq, flag=flag):
+                # the name is escaped so that it is written as is
+                template = name.replace("{", "{{").replace("}", "}}") + "\t{}\t{}\n"
+                # written by blocks of lines formatted at once
+                for i in range(0, len(coverage), step):
+                    depths = coverage[i : i + step].tolist()
+                    first = offset + i + 1
+                    fout.write("".join(map(template.format, range(first, first + len(depths)), depths)))
 
-    @_reset
     def _set_indels(self):
         """Collect insertion and deletion lengths and store them in :attr:`insertions` and :attr:`deletions`.
 
-        Requires that alignments have been cached via :meth:`_set_alignments`.
+        Lengths are taken from the histograms of :meth:`collect_stats`.
         Insertion lengths are stored in :attr:`insertions` (list of ``int``)
         and deletion lengths in :attr:`deletions` (list of ``int``).
         """
-        try:
-            self.alignments
-        except:
-            self._set_alignments()
-
-        self.insertions = []
-        self.deletions = []
-        for this in self.alignments:
-            if this.cigarstring:
-                if "I" in this.cigarstring:
-                    self.insertions.extend([x[1] for x in this.cigartuples if x[0] == 1])
-                if "D" in this.cigarstring:
-                    self.deletions.extend([x[1] for x in this.cigartuples if x[0] == 2])
+        stats = self.collect_stats()
+        self.insertions = np.repeat(np.arange(len(stats.insertions)), stats.insertions).tolist()
+        self.deletions = np.repeat(np.arange(len(stats.deletions)), stats.deletions).tolist()
 
     def plot_coverage(self, chrom=None):
         """Please use :class:`SequanaCoverage` for more sophisticated
@@ -1730,6 +1745,406 @@ SN	pairs on different chromosomes:	0
         return paf
 
 
+def _add_histogram(total, counts):
+    # sum two histograms of different lengths
+    if len(counts) > len(total):
+        total, counts = counts.astype(np.int64), total
+    total[: len(counts)] += counts
+    return total
+
+
+def _get_shards(filename, mode, kwargs, shard_size=None):
+    # regions of an indexed file; each alignment belongs to a single region
+    # (the one containing its start). The last shard contains the unplaced
+    # reads.
+    with pysam.AlignmentFile(filename, mode=mode, **kwargs) as bam:
+        if not bam.has_index():
+            return None
+        shards = []
+        for contig, length in zip(bam.references, bam.lengths):
+            step = shard_size or length
+            for start in range(0, length, max(step, 1)):
+                shards.append((contig, start, min(start + step, length)))
+        shards.append(("*", None, None))
+    return shards
+
+
+def _collect_shard(args):
+    filename, mode, kwargs, region, metrics, mapq = args
+    collector = BAMStatsCollector(metrics=metrics, mapq=mapq)
+    with pysam.AlignmentFile(filename, mode=mode, **kwargs) as bam:
+        contig, start, end = region
+        if contig == "*":
+            collector.collect(bam.fetch("*"))
+        else:
+            # alignments overlapping the start belong to the previous region
+            collector.collect(x for x in bam.fetch(contig, start, end) if x.reference_start >= start)
+    return collector
+
+
+class BAMStatsCollector:
+    """Compute alignment statistics in a single pass over a SAM/BAM/CRAM file
+
+    Each alignment is read once and all registered metrics are updated.
+    Per-alignment values are buffered and aggregated by blocks into NumPy
+    histograms so that memory does not depend on the number of alignments.
+
+    ============ ===========================================================
+    metric       attributes
+    ============ ===========================================================
+    flags        :attr:`flags` (histogram of the 4096 possible flags)
+    mapq         :attr:`mapq` (histogram of the 256 mapping qualities)
+    length       :attr:`read_length` (query length of all alignments) and
+                 :attr:`mapped_length` (reference length of mapped ones)
+    quality      mean quality of the alignments (see :meth:`get_summary`)
+    gc           :attr:`gc` (histogram of GC content in percentage)
+    indels       :attr:`insertions` and :attr:`deletions` (histograms of
+                 length)
+    full         counters of :meth:`get_stats_full`
+    ============ ===========================================================
+
+    ::
+
+        from sequana.bamtools import BAMStatsCollector
+        stats = BAMStatsCollector.from_file("test.bam", processes=4)
+        stats.get_summary()
+        stats.get_stats_full()
+
+    Indexed files can be split into regions (contigs or parts of contigs)
+    analysed by several processes. Collectors are merged with :meth:`merge`;
+    all counts are integers and merged results are identical to a
+    sequential scan.
+    """
+
+    available_metrics = ("flags", "mapq", "length", "quality", "gc", "indels", "full")
+
+    counters = (
+        "bases_mapped",
+        "bases_mapped_cigar",
+        "forward",
+        "insert_size_sum",
+        "insert_size_sum_square",
+        "mapq0",
+        "mismatches",
+        "multiple_hit",
+        "non_splice",
+        "pair_diff_chrom",
+        "proper_pair",
+        "qc_fail",
+        "read1",
+        "read2",
+        "reads_duplicated",
+        "reads_paired",
+        "reverse",
+        "secondary",
+        "splice",
+        "total_length",
+        "total_r1_length",
+        "total_r2_length",
+        "unique_hit",
+        "unmapped",
+    )
+
+    def __init__(self, metrics=None, mapq=30, buffersize=100000):
+        """.. rubric:: constructor
+
+        :param metrics: list of metrics to compute (default to all). See
+            :attr:`available_metrics`.
+        :param int mapq: minimum mapping quality of unique hits (*full*)
+        :param int buffersize: number of alignments buffered before being
+            aggregated into histograms
+        """
+        metrics = self.available_metrics if metrics is None else tuple(metrics)
+        for metric in metrics:
+            if metric not in self.available_metrics:
+                raise ValueError(f"metric must be in {self.available_metrics}. Got {metric}")
+        # the full stats includes the average quality
+        if "full" in metrics and "quality" not in metrics:
+            metrics = metrics + ("quality",)
+        self.metrics = metrics
+        self.mapq_threshold = mapq
+        self.buffersize = buffersize
+
+        self.count = 0
+        self.flags = np.zeros(4096, dtype=np.int64)
+        self.mapq = np.zeros(256, dtype=np.int64)
+        self.read_length = np.zeros(0, dtype=np.int64)
+        self.mapped_length = np.zeros(0, dtype=np.int64)
+        self.gc = np.zeros(101, dtype=np.int64)
+        self.insertions = np.zeros(0, dtype=np.int64)
+        self.deletions = np.zeros(0, dtype=np.int64)
+        # sum of qualities of the alignments, per query length, so that the
+        # mean of the per-alignment mean qualities is exact
+        self.quality_sum = np.zeros(0, dtype=np.int64)
+        self.quality_count = np.zeros(0, dtype=np.int64)
+        self.quality_missing = 0
+        self.stats = dict.fromkeys(self.counters, 0)
+
+    @classmethod
+    def from_file(cls, filename, mode="r", metrics=None, mapq=30, processes=None, shard_size=None, **kwargs):
+        """Collect the statistics of a SAM/BAM/CRAM file
+
+        :param filename: input file
+        :param mode: mode used to open the file with pysam
+        :param metrics: see constructor
+        :param mapq: see constructor
+        :param int processes: number of processes used to analyse indexed
+            files (by contig and regions of *shard_size* bases). Non indexed
+            files are read sequentially.
+        :param int shard_size: size of the regions analysed by each process
+            (default to whole contigs)
+        :param kwargs: any other arguments accepted by pysam.AlignmentFile
+            (e.g. reference_filename for CRAM files)
+        """
+        shards = None
+        if processes and processes > 1:
+            shards = _get_shards(filename, mode, kwargs, shard_size)
+            if shards is None:
+                logger.warning(f"{filename} is not indexed. Reading it sequentially")
+
+        if shards is None:
+            collector = cls(metrics=metrics, mapq=mapq)
+            with pysam.AlignmentFile(filename, mode=mode, **kwargs) as bam:
+                collector.collect(bam.fetch(until_eof=True))
+            return collector
+
+        from multiprocessing import Pool
+
+        tasks = [(filename, mode, kwargs, shard, metrics, mapq) for shard in shards]
+        with Pool(min(processes, len(tasks))) as pool:
+            collectors = pool.map(_collect_shard, tasks)
+
+        collector = collectors[0]
+        for other in collectors[1:]:
+            collector.merge(other)
+        return collector
+
+    def collect(self, alignments):
+        """Update the metrics with an iterable of pysam alignments"""
+        do_length = "length" in self.metrics
+        do_quality = "quality" in self.metrics
+        do_gc = "gc" in self.metrics
+        do_indels = "indels" in self.metrics
+        do_full = "full" in self.metrics
+        mapq_threshold = self.mapq_threshold
+        stats = self.stats
+
+        # per-alignment values, aggregated every buffersize alignments
+        flags, mapqs, lengths, mapped_lengths, gcs = [], [], [], [], []
+        insertions, deletions, quality_lengths, quality_sums = [], [], [], []
+
+        for aln in alignments:
+            flag = aln.flag
+            mq = aln.mapping_quality
+            flags.append(flag)
+            mapqs.append(mq)
+            qlen = aln.query_length
+
+            if do_length:
+                lengths.append(qlen)
+                if not flag & 4:
+                    mapped_lengths.append(aln.reference_length)
+
+            if do_quality:
+                qualities = aln.query_qualities
+                if qualities:
+                    quality_lengths.append(len(qualities))
+                    quality_sums.append(sum(qualities))
+                else:
+                    self.quality_missing += 1
+
+            if do_gc:
+                seq = aln.query_sequence
+                if seq:
+                    gcs.append(int((seq.count("C") + seq.count("G")) / len(seq) * 100))
+
+            cigar = aln.cigartuples if (do_indels or do_full) else None
+            if do_indels and cigar:
+                for op, size in cigar:
+                    if op == 1:
+                        insertions.append(size)
+                    elif op == 2:
+                        deletions.append(size)
+
+            if do_full:
+                # same filters as samtools stats
+                if flag & 1:
+                    stats["reads_paired"] += 1
+                if flag & 4:
+                    stats["unmapped"] += 1
+                if flag & 512:
+                    stats["qc_fail"] += 1
+                elif flag & 1024:
+                    stats["reads_duplicated"] += 1
+                elif flag & 256:
+                    stats["secondary"] += 1
+                else:
+                    stats["total_length"] += qlen
+                    # fixme not really a multiple hit in 100% of cases
+                    if mq < mapq_threshold:
+                        stats["multiple_hit"] += 1
+                    else:
+                        self._update_full(aln, flag, mq, qlen, cigar or [])
+
+            if len(flags) >= self.buffersize:
+                self._flush(flags, mapqs, lengths, mapped_lengths, gcs, insertions, deletions, quality_lengths, quality_sums)
+        self._flush(flags, mapqs, lengths, mapped_lengths, gcs, insertions, deletions, quality_lengths, quality_sums)
+        return self
+
+    def _update_full(self, aln, flag, mq, qlen, cigar):
+        stats = self.stats
+        stats["unique_hit"] += 1
+        if flag & 64:
+            stats["read1"] += 1
+            stats["total_r1_length"] += qlen
+        if flag & 128:
+            stats["read2"] += 1
+            stats["total_r2_length"] += qlen
+        if flag & 16:
+            stats["reverse"] += 1
+        else:
+            stats["forward"] += 1
+        if mq == 0:
+            stats["mapq0"] += 1
+
+        stats["bases_mapped"] += qlen
+        splice = False
+        for op, size in cigar:
+            if op == 0 or op == 1:
+                stats["bases_mapped_cigar"] += size
+            elif op == 3:
+                splice = True
+        stats["splice" if splice else "non_splice"] += 1
+
+        if flag & 2:
+            stats["proper_pair"] += 1
+            if aln.reference_id != aln.next_reference_id:
+                stats["pair_diff_chrom"] += 1
+            if aln.reference_start != 0:
+                # to avoid effect of circular genome
+                size = abs(aln.template_length)
+                stats["insert_size_sum"] += size
+                stats["insert_size_sum_square"] += size * size
+
+        # If NM is provided, not always the case though
+        if aln.has_tag("NM"):
+            stats["mismatches"] += aln.get_tag("NM")
+
+    def _flush(self, flags, mapqs, lengths, mapped_lengths, gcs, insertions, deletions, quality_lengths, quality_sums):
+        self.count += len(flags)
+        self.flags += np.bincount(flags, minlength=4096)
+        self.mapq += np.bincount(mapqs, minlength=256)
+        if lengths:
+            self.read_length = _add_histogram(self.read_length, np.bincount(lengths))
+        if mapped_lengths:
+            self.mapped_length = _add_histogram(self.mapped_length, np.bincount(mapped_lengths))
+        if gcs:
+            self.gc += np.bincount(gcs, minlength=101)
+        if insertions:
+            self.insertions = _add_histogram(self.insertions, np.bincount(insertions))
+        if deletions:
+            self.deletions = _add_histogram(self.deletions, np.bincount(deletions))
+        if quality_lengths:
+            sums = np.bincount(quality_lengths, weights=np.array(quality_sums, dtype=np.float64))
+            self.quality_sum = _add_histogram(self.quality_sum, sums.astype(np.int64))
+            self.quality_count = _add_histogram(self.quality_count, np.bincount(quality_lengths))
+        for data in (flags, mapqs, lengths, mapped_lengths, gcs, insertions, deletions, quality_lengths, quality_sums):
+            data.clear()
+
+    def merge(self, other):
+        """Add the statistics of another collector (e.g. another region)"""
+        self.count += other.count
+        self.flags += other.flags
+        self.mapq += other.mapq
+        self.gc += other.gc
+        for name in ("read_length", "mapped_length", "insertions", "deletions", "quality_sum", "quality_count"):
+            setattr(self, name, _add_histogram(getattr(self, name), getattr(other, name)))
+        self.quality_missing += other.quality_missing
+        for key, value in other.stats.items():
+            self.stats[key] += value
+        return self
+
+    def _get_quality_total(self):
+        # sum of the mean quality of each alignment (-1 if no quality)
+        lengths = np.flatnonzero(self.quality_sum)
+        return math.fsum(self.quality_sum[lengths] / lengths) - self.quality_missing
+
+    def get_mean_quality(self):
+        """Return the mean of the alignments' mean quality"""
+        if self.count == 0:
+            return 0
+        return self._get_quality_total() / self.count
+
+    def get_flags_count(self):
+        """Return number of alignments for each SAM flag bit (0 for flag=0)"""
+        bits = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+        values = np.arange(4096)
+        counts = {0: int(self.flags[0])}
+        for bit in bits:
+            counts[bit] = int(self.flags[(values & bit) != 0].sum())
+        return pd.Series(counts)
+
+    def get_summary(self):
+        """Return flags, mapq and mapped read lengths counts as dictionaries
+
+        Same as :attr:`SAMBAMbase.summary`.
+        """
+        return {
+            "mapq": {int(k): int(self.mapq[k]) for k in np.flatnonzero(self.mapq)},
+            "read_length": {int(k): int(self.mapped_length[k]) for k in np.flatnonzero(self.mapped_length)},
+            "flags": {int(k): int(self.flags[k]) for k in np.flatnonzero(self.flags)},
+            "mean_quality": self.get_mean_quality(),
+        }
+
+    def get_stats_full(self):
+        """Return the statistics of :meth:`SAMBAMbase.get_stats_full`"""
+        s = self.stats
+        secondary = s["secondary"]
+        results = {
+            "average_quality": self._get_quality_total() / self.count,
+            "average_length": s["bases_mapped"] / (s["read1"] + s["read2"]),
+            "bases mapped (cigar)": s["bases_mapped_cigar"],
+            "bases mapped ": s["bases_mapped"],
+            "forward": s["forward"],
+            "unmapped": s["unmapped"],
+            "mismatches": s["mismatches"],
+            "multiple_hit": s["multiple_hit"],
+            "non_splice": s["non_splice"],
+            "pair_diff_chrom": s["pair_diff_chrom"],
+            "proper_pair": s["proper_pair"],
+            "qc_fail": s["qc_fail"],
+            "read1": s["read1"],
+            "read2": s["read2"],
+            "reads_duplicated": s["reads_duplicated"],
+            "reads_mapq0": s["mapq0"],
+            "reads_mapped": s["read1"] + s["read2"],
+            "reads_paired": s["reads_paired"],
+            # In theory, the next one is paired-end technology bit set + both mates mapped
+            "reads_mapped_and_paired": s["reads_paired"] - secondary,
+            "raw_total_sequences": self.count - secondary,
+            "reverse": s["reverse"],
+            "non_primary_alignements": secondary,
+            "secondary": secondary,
+            "splice": s["splice"],
+            "total_alignments": self.count,
+            "total_first_fragment_length": s["total_r1_length"],
+            "total_last_fragment_length": s["total_r2_length"],
+            "total_length": s["total_length"],  # ignoring secondary, qcfail to agree with samtools
+            "unique_hit": s["unique_hit"],
+            "error_rate": s["mismatches"] / s["bases_mapped_cigar"],
+        }
+
+        if s["proper_pair"] > 0:
+            N = s["proper_pair"]
+            results["insert_size_average"] = s["insert_size_sum"] / N
+            results["insert_size_std"] = math.sqrt(s["insert_size_sum_square"] / N - (s["insert_size_sum"] / N) ** 2)
+        if s["reads_paired"] > 0:
+            results["percentage_properly_paired"] = 100 * s["proper_pair"] / s["reads_paired"]
+        else:
+            results["percentage_properly_paired"] = 0
+        return results
+
+
 class SAM(SAMBAMbase):
     """SAM Reader. See :class:`~samtools.bamtools.SAMBAMbase` for details"""
 
@@ -1841,26 +2256,25 @@ class MultiBAM:
 
     df = property(_get_df)
 
-    def run(self, exclude_secondary=True):
+    def run(self, exclude_secondary=True, method="bincount"):
         """Count alignments per reference sequence for every BAM file.
 
         :param bool exclude_secondary: if ``True`` (default), secondary
             alignments (flag ≥ 256) and unmapped reads (flag 4) are excluded
             from the counts.
+        :param str method: *bincount* or *index* (see
+            :meth:`SAMBAMbase.get_reference_counts`)
         :return: DataFrame with samples as rows and reference names as columns.
             Each cell contains the number of alignments.
         :rtype: pandas.DataFrame
         """
-        from collections import Counter
-
-        if exclude_secondary:
-            data = [Counter(bam.get_df().query("flag!=4 and flag<256").rname) for bam in self.bams]
-        else:
-            data = [Counter(bam.get_df().query("flag!=4").rname) for bam in self.bams]
+        data = [bam.get_reference_counts(exclude_secondary=exclude_secondary, method=method) for bam in self.bams]
 
         df = pd.DataFrame(data)
         # if there is no alignments, it is equal to 0, not NA
-        df = df.fillna(0)
+        df = df.fillna(0).astype(int)
+        # keep references with at least one alignment
+        df = df.loc[:, (df > 0).any()]
 
         # let us sort the index
         df.index = self.tags
@@ -13,10 +13,11 @@
 """Utilities for the genome coverage"""
 import copy
 import gc
+import json
 import os
 import random
+import shutil
 import sys
-from collections import Counter
 
 import colorlog
 from easydev import Progress, TempFile
@@ -28,13 +29,15 @@ from sequana.gff3 import GFF3
 from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
 from sequana.lazy import pylab, pysam
+from sequana.running_median import RunningMedian
 from sequana.stats import evenness
 from sequana.summary import Summary
+from sequana.tools import get_base_content, sliding_base_content
 
 logger = colorlog.getLogger(__name__)
 
 
-__all__ = ["SequanaCoverage", "ChromosomeCov", "DoubleThresholds"]
+__all__ = ["SequanaCoverage", "ChromosomeCov", "DoubleThresholds", "CoverageCache"]
 
 
 class DoubleThresholds(object):
@@ -134,6 +137,213 @@ class DoubleThresholds(object):
         return txt
 
 
+def _get_row_offsets(filename, rows, blocksize=2**24):
+    # Return a dictionary with the byte offsets of the requested row numbers.
+    # The file is read by blocks and newlines are located with numpy, which
+    # is much faster than iterating over the lines.
+    offsets = {row: 0 for row in rows if row == 0}
+    pending = sorted(set(row for row in rows if row > 0))
+
+    i = 0
+    nlines = 0
+    position = 0
+    with open(filename, "rb") as fin:
+        while i < len(pending):
+            block = fin.read(blocksize)
+            if not block:
+                break
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            # row R starts just after the newline character of row R-1
+            while i < len(pending) and pending[i] - 1 < nlines + len(newlines):
+                offsets[pending[i]] = position + int(newlines[pending[i] - 1 - nlines]) + 1
+                i += 1
+            nlines += len(newlines)
+            position += len(block)
+    return offsets
+
+
+class CoverageCache(object):
+    """Binary cache of a genomecov BED file used by :class:`SequanaCoverage`
+
+    The cache is stored next to the BED file in a directory named after the
+    input file with the *.sqcache* extension. It contains an *index.json* file
+    with the chromosome names, their row positions and byte offsets within the
+    BED file. If all numeric columns are integers (the usual case for
+    mosdepth/samtools outputs), each chromosome is also stored as a raw int32
+    array (rows x columns) that is memory-mapped when read back, so that
+    :class:`ChromosomeCov` can slice the coverage directly instead of parsing
+    the text file again.
+
+    The cache is invalidated as soon as the modification time or the size of
+    the BED file changes.
+
+    ::
+
+        cache = CoverageCache("sample.bed")
+        if cache.is_valid():
+            data = cache.get_array("chr1")
+
+    The cache is created by :class:`SequanaCoverage` when *use_cache* is set
+    to True.
+    """
+
+    version = 1
+
+    def __init__(self, input_filename):
+        """.. rubric:: constructor
+
+        :param str input_filename: the BED file to be cached.
+        """
+        self.input_filename = input_filename
+        self.directory = f"{input_filename}.sqcache"
+        self.index_filename = os.path.join(self.directory, "index.json")
+        self.index = None
+
+        # used while building the cache only
+        self._handles = {}
+        self._ncols = None
+        self._with_arrays = True
+
+    def _get_signature(self):
+        st = os.stat(self.input_filename)
+        return {"mtime": st.st_mtime_ns, "size": st.st_size, "version": self.version}
+
+    def is_valid(self):
+        """Return True if the cache exists and corresponds to the BED file"""
+        try:
+            with open(self.index_filename, "r") as fin:
+                index = json.load(fin)
+        except (OSError, ValueError):
+            return False
+
+        if index.get("signature") != self._get_signature():
+            logger.info(f"Coverage cache {self.directory} is outdated.")
+            return False
+        self.index = index
+        return True
+
+    @property
+    def has_arrays(self):
+        """True if the coverage arrays are available (integer data only)"""
+        return self.index is not None and bool(self.index["arrays"])
+
+    def get_array(self, chrom_name):
+        """Return a read-only memory-mapped int32 array for a chromosome
+
+        The array has one row per BED row and one column per numeric column
+        (position, coverage and optional extra coverage tracks).
+        """
+        filename = os.path.join(self.directory, self.index["arrays"][chrom_name])
+        N = self.index["positions"][chrom_name]["N"]
+        return np.memmap(filename, dtype=np.int32, mode="r", shape=(N, self.index["ncols"]))
+
+    def iter_chunks(self, chrom_name, chunksize):
+        """Yield dataframes of a chromosome, as pd.read_table would do
+
+        Columns are named 0 (chromosome name), 1 (position), 2 (coverage) and
+        optional extra columns. If arrays are not cached, the BED file is read
+        starting from the byte offset of the chromosome.
+        """
+        N = self.index["positions"][chrom_name]["N"]
+
+        if self.has_arrays:
+            data = self.get_array(chrom_name)
+            for start in range(0, N, chunksize):
+                # int64 to behave exactly as the text parser
+                values = np.asarray(data[start : start + chunksize], dtype=np.int64)
+                df = pd.DataFrame(values, columns=range(1, values.shape[1] + 1))
+                codes = np.zeros(len(df), dtype=np.int8)
+                df.insert(0, 0, pd.Categorical.from_codes(codes, categories=[chrom_name]))
+                yield df
+        else:
+            with open(self.input_filename, "r") as fin:
+                fin.seek(self.index["offsets"][chrom_name])
+                yield from pd.read_table(
+                    fin, nrows=N, header=None, sep="\t", chunksize=chunksize, dtype={0: "string"}
+                )
+
+    def create(self):
+        """Create an empty cache directory. Return False if not possible"""
+        try:
+            if os.path.isdir(self.directory):
+                shutil.rmtree(self.directory)
+            os.makedirs(self.directory)
+        except OSError as err:
+            logger.warning(f"Could not create the coverage cache {self.directory}: {err}")
+            return False
+
+        self.index = None
+        self._handles = {}
+        self._ncols = None
+        self._with_arrays = True
+        return True
+
+    def _discard_arrays(self):
+        for handle in self._handles.values():
+            handle.close()
+            os.remove(handle.name)
+        self._handles = {}
+        self._with_arrays = False
+
+    def append(self, chrom_name, values):
+        """Append the numeric values (2D array) of a chromosome to the cache
+
+        If values are not integers or do not fit into int32, only the
+        index will be saved.
+        """
+        if not self._with_arrays:
+            return
+
+        int32 = np.iinfo(np.int32)
+        if values.dtype.kind not in "iu":
+            valid = False
+        elif self._ncols is not None and values.shape[1] != self._ncols:
+            valid = False
+        else:
+            valid = values.size == 0 or (values.max() <= int32.max and values.min() >= int32.min)
+
+        if not valid:
+            logger.info("Coverage data is not made of int32 values. Caching the index only")
+            self._discard_arrays()
+            return
+
+        self._ncols = values.shape[1]
+        if chrom_name not in self._handles:
+            filename = os.path.join(self.directory, f"{len(self._handles)}.bin")
+            self._handles[chrom_name] = open(filename, "wb")
+        self._handles[chrom_name].write(np.ascontiguousarray(values, dtype=np.int32).tobytes())
+
+    def save(self, chrom_names, positions, total_length):
+        """Close the arrays and save the index. Must be called last"""
+        arrays = {}
+        for chrom_name, handle in self._handles.items():
+            handle.close()
+            arrays[chrom_name] = os.path.basename(handle.name)
+        self._handles = {}
+
+        starts = {name: int(positions[name]["start"]) for name in chrom_names}
+        offsets = _get_row_offsets(self.input_filename, starts.values())
+
+        index = {
+            "signature": self._get_signature(),
+            "chrom_names": list(chrom_names),
+            "positions": {
+                name: {key: int(value) for key, value in positions[name].items()} for name in chrom_names
+            },
+            "offsets": {name: offsets[starts[name]] for name in chrom_names},
+            "total_length": int(total_length),
+            "ncols": self._ncols,
+            "arrays": arrays if self._with_arrays else {},
+        }
+        try:
+            with open(self.index_filename, "w") as fout:
+                json.dump(index, fout)
+        except OSError as err:  # pragma: no cover
+            logger.warning(f"Could not save the coverage cache index: {err}")
+            return
+        self.index = index
+
+
 class SequanaCoverage(object):
     """Create a list of dataframe to hold data from a BED file generated with
     samtools depth.
@@ -194,6 +404,7 @@ class SequanaCoverage(object):
         chromosome_list=[],
         reference_file=None,
         gc_window_size=101,
+        use_cache=False,
     ):
         """.. rubric:: constructor
 
@@ -227,6 +438,9 @@ class SequanaCoverage(object):
             and could also be used by the Snakemake implementation.
         :param reference_file: if provided, computes the GC content
         :param int gc_window_size: size of the GC sliding window. (default 101)
+        :param bool use_cache: if True, a binary cache (see :class:`CoverageCache`)
+            is created next to the input file during the first scan and used
+            afterwards to access chromosomes without parsing the BED file again.
         """
         # Keep various information as attributes
 
@@ -237,6 +451,8 @@ class SequanaCoverage(object):
         self._reference_file = reference_file
         self._window_size = None
         self._input_filename = input_filename
+        self.use_cache = use_cache
+        self._cache = None
 
         # place holder for basic stats on all chromosomes.
         self._stats = {}
@@ -384,6 +600,20 @@ class SequanaCoverage(object):
         #               positions. Starting is zero in general, but not
         #               compulsary
         #  - total_length: number of rows in the BED file
+        # If use_cache is set, the scan also fills a CoverageCache, or
+        # reuses a valid one, in which case the BED file is not read at all.
+        cache = None
+        if self.use_cache:
+            cache = CoverageCache(self.input_filename)
+            if cache.is_valid():
+                logger.info(f"Using coverage cache {cache.directory}")
+                self.chrom_names = cache.index["chrom_names"]
+                self.positions = cache.index["positions"]
+                self.total_length = cache.index["total_length"]
+                self._cache = cache
+                return
+            if not cache.create():
+                cache = None
 
         N = 0
 
@@ -402,18 +632,22 @@ class SequanaCoverage(object):
 
         Nchunk = int(fullsize / smallsize)
         i = 0
-        for chunk in tqdm(
-            pd.read_table(
+        # to fill the cache, all columns are needed
+        if cache:
+            reader = pd.read_table(
+                self.input_filename, header=None, sep="\t", chunksize=self.chunksize, dtype={0: "string"}
+            )
+        else:
+            reader = pd.read_table(
                 self.input_filename,
                 header=None,
                 sep="\t",
                 usecols=[0],
                 chunksize=self.chunksize,
                 dtype="string",
-            ),
-            total=Nchunk,
-            disable=self.quiet_progress,
-        ):
+            )
+
+        for chunk in tqdm(reader, total=Nchunk, disable=self.quiet_progress):
             # accumulate length
             N += len(chunk)
 
@@ -424,15 +658,20 @@ class SequanaCoverage(object):
                     self.chrom_names.append(contig)
 
             # group by names (unordered)
-            chunk = chunk.groupby(0)
+            grouped = chunk.groupby(0)
             for contig in contigs:
                 if contig not in positions:
                     positions[contig] = {
-                        "start": chunk.groups[contig].min(),
-                        "end": chunk.groups[contig].max(),
+                        "start": grouped.groups[contig].min(),
+                        "end": grouped.groups[contig].max(),
                     }
                 else:
-                    positions[contig]["end"] = chunk.groups[contig].max()
+                    positions[contig]["end"] = grouped.groups[contig].max()
+
+                if cache:
+                    # rows of a contig are contiguous in the BED file
+                    indices = grouped.indices[contig]
+                    cache.append(contig, chunk.iloc[indices[0] : indices[-1] + 1, 1:].to_numpy())
             i += 1
             i = min(i, Nchunk)
         del chunk
@@ -443,6 +682,11 @@ class SequanaCoverage(object):
             positions[k]["N"] = positions[k]["end"] - positions[k]["start"] + 1
         self.positions = positions
 
+        if cache:
+            cache.save(self.chrom_names, positions, N)
+            if cache.index is not None:
+                self._cache = cache
+
     def get_stats(self):
         """Return basic statistics for each chromosome
 
@@ -541,15 +785,19 @@ class ChromosomeCov(object):
         N = self.bed.positions[self.chrom_name]["N"]
         toskip = self.bed.positions[self.chrom_name]["start"]
 
-        self.iterator = pd.read_table(
-            self.bed.input_filename,
-            skiprows=toskip,
-            nrows=N,
-            header=None,
-            sep="\t",
-            chunksize=self.chunksize,
-            dtype={0: "string"},
-        )
+        if self.bed._cache is not None:
+            # slice the memory-mapped arrays or seek to the byte offset
+            self.iterator = self.bed._cache.iter_chunks(self.chrom_name, self.chunksize)
+        else:
+            self.iterator = pd.read_table(
+                self.bed.input_filename,
+                skiprows=toskip,
+                nrows=N,
+                header=None,
+                sep="\t",
+                chunksize=self.chunksize,
+                dtype={0: "string"},
+            )
 
         if N <= self.chunksize:
             # we can load all data into memory:
@@ -639,7 +887,7 @@ class ChromosomeCov(object):
             logger.error(msg)
             raise Exception(msg)
 
-    def run(self, W, k=2, circular=False, binning=None, cnv_delta=None):
+    def run(self, W, k=2, circular=False, binning=None, cnv_delta=None, engine="auto"):
 
         self.init()
         # for the coverare snakemake pipeline
@@ -679,7 +927,7 @@ class ChromosomeCov(object):
                 self._set_chunk(chunk)
 
                 logger.debug("running median computation")
-                self.running_median(W, circular=circular)
+                self.running_median(W, circular=circular, engine=engine)
                 logger.debug("zscore computation")
                 self.compute_zscore(k=k, verbose=False)  # avoid repetitive warning
 
@@ -752,7 +1000,7 @@ class ChromosomeCov(object):
             self._df = binned_df.copy()
             self.binning = binning
 
-            self.running_median(int(W / binning), circular=circular)
+            self.running_median(int(W / binning), circular=circular, engine=engine)
             self.compute_zscore(k=k, verbose=False)  # avoid repetitive warning
             # Only one ROIs, but we use the same logic as in the chunk case,
             # and store the rois/summary in the ChromosomeCovMultiChunk
@@ -828,18 +1076,26 @@ class ChromosomeCov(object):
             self.ma = ma[n // 2 + 1 : -n // 2]
             self._df["ma"] = pd.Series(self.ma, index=self.df["cov"].index)
 
-    def running_median(self, n, circular=False):
+    def running_median(self, n, circular=False, engine="auto"):
         """Compute running median of genome coverage
 
         :param int n: window's size.
         :param bool circular: if a mapping is circular (e.g. bacteria
             whole genome sequencing), set to True
+        :param str engine: running median engine. See
+            :mod:`sequana.running_median` for details. All engines give the
+            same results. The default (auto) uses the histogram engine if the
+            coverage is made of integers (the usual case), which is nearly
+            O(n) whatever the window size.
 
         Store the results in the :attr:`df` attribute (dataframe) with a
         column named *rm*.
 
         .. versionchanged:: 0.1.21
             Use Pandas rolling function to speed up computation.
+        .. versionchanged:: 0.23
+            Use :class:`~sequana.running_median.RunningMedian` engines, which
+            handle circular data without copying the whole coverage.
 
         """
         self._check_window(n)
@@ -850,29 +1106,11 @@ class ChromosomeCov(object):
         mid = int(self.window_size / 2)
         self.range = [None, None]
         try:
-            if self.circular:
-                # BASED on running_median pure implementation, could be much
-                # slower than pure pandas rolling function. Keep those 4 lines
-                # for book keeping though.
-                # cover = list(self.df["cov"])
-                # cover = cover[-mid:] + cover + cover[:mid]
-                # rm = running_median.RunningMedian(cover, n).run()
-                # self.df["rm"] = rm[mid:-mid]
-                rm = (
-                    pd.concat([self.df["cov"][-mid:], self.df["cov"], self.df["cov"][:mid]])
-                    .rolling(n, center=True)
-                    .median()
-                )
-                self._df["rm"] = rm[mid:-mid]
+            cover = self.df["cov"].to_numpy(dtype=float)
+            rm = RunningMedian(cover, self.window_size, engine=engine, circular=self.circular).run()
+            self._df["rm"] = rm
 
-            else:
-                rm = self.df["cov"].rolling(n, center=True).median()
-                # Like in RunningMedian, we copy the NAN with real data
-                rm[0:mid] = self.df["cov"][0:mid]
-                rm[-mid:] = self.df["cov"][-mid:]
-                # rm = running_median.RunningMedian(cover, n).run()
-
-                self._df["rm"] = rm
+            if not self.circular:
                 # set up slice for gaussian prediction
                 self.range = [mid, -mid]
         except:
@@ -1714,49 +1952,36 @@ class ChromosomeCov(object):
         if self.bed.reference_file is None:
             return
 
-        fasta = pysam.FastxFile(self.bed.reference_file)
-        chrom_gc_content = dict()
-
         if ws is None:
             gc_window_size = self.bed.gc_window_size
         else:
             gc_window_size = ws
 
-        mid = int(gc_window_size / 2.0)
-
-        for chrom in fasta:
-            if chrom.name == self.chrom_name or chrom.name.split(".")[0] == self.chrom_name:
-                # Create gc_content array
-                gc_content = np.empty(len(chrom.sequence))
-                gc_content[:] = np.nan
-                if self.bed.circular:
-                    chrom.sequence = chrom.sequence[-mid:] + chrom.sequence + chrom.sequence[:mid]
-                    # Does not shift index of array
-                    mid = 0
-
-                # Count first window content
-                counter = Counter(chrom.sequence[0:gc_window_size])
-                gc_count = 0
-                for letter in "GCgc":
-                    gc_count += counter[letter]
-
-                gc_content[mid] = gc_count
-
-                for i in range(1, len(chrom.sequence) - gc_window_size + 1):
-                    if chrom.sequence[i - 1] in "GCgc":
-                        gc_count -= 1
-                    if chrom.sequence[i + gc_window_size - 1] in "GCgc":
-                        gc_count += 1
-                    gc_content[i + mid] = gc_count
-                chrom_gc_content[chrom.name] = gc_content / gc_window_size
-
         # if accession processed by snpeff, the trailing version may be missing
+        name = self.chrom_name
         try:
-            self._gc_content = chrom_gc_content[self.chrom_name]
-        except:
-            logger.warning(
-                f"chromosome name {chrom.name} from the reference does not match the chromosome names in the BAM/BED"
+            self._gc_content = get_base_content(
+                self.bed.reference_file,
+                name,
+                gc_window_size,
+                "GCgc",
+                circular=self.bed.circular,
+                cache=self.bed.use_cache,
             )
+            return
+        except KeyError:
+            pass
+
+        for chrom in pysam.FastxFile(self.bed.reference_file):
+            if chrom.name.split(".")[0] == self.chrom_name:
+                self._gc_content = sliding_base_content(
+                    chrom.sequence, gc_window_size, "GCgc", circular=self.bed.circular
+                )
+                return
+
+        logger.warning(
+            f"chromosome name {self.chrom_name} from the BAM/BED not found in the reference {self.bed.reference_file}"
+        )
 
 
 class FilteredGenomeCov(object):
@@ -1864,45 +2089,115 @@ class FilteredGenomeCov(object):
 
         Uses a double thresholds method using the :attr:`threshold`
 
-        """
-        region_start = None
-        region_stop = None
-        start = 1
-        stop = 1
-        prev = 1
-        # handle case where for example position n-1 have a zscore of -5 and n
-        # have a zscore of 5. It is two different regions.
-        region_zscore = 0
-
-        merge_df = []
-        for pos, zscore in zip(self.rawdf["pos"], self.rawdf[zscore_label]):
-            stop = pos
-            if stop - self.step == prev and zscore * region_zscore >= 0:
-                prev = stop
-            else:
-                if region_start:
-                    merge_df.append(self._merge_row(region_start, region_stop))
-                    region_start = None
-                start = stop
-                prev = stop
-                region_zscore = zscore
-
-            if zscore > 0 and zscore > self.thresholds.high:
-                if not region_start:
-                    region_start = pos
-                    region_stop = pos
-                else:
-                    region_stop = pos
-            elif zscore < 0 and zscore < self.thresholds.low:
-                if not region_start:
-                    region_start = pos
-                    region_stop = pos
-                else:
-                    region_stop = pos
+        Rows of :attr:`rawdf` are above the secondary thresholds. Consecutive
+        rows (given the :attr:`step`) with zscores of the same sign form a
+        cluster. Each cluster that contains at least one position above
+        the main thresholds gives a region, which starts at the first and ends
+        at the last of these positions. The clustering is done with run-length
+        encoding of the position gaps and zscore signs, and statistics of the
+        regions are computed with numpy reduceat.
 
-        if start < stop and region_start:
-            merge_df.append(self._merge_row(region_start, region_stop))
-        return merge_df
+        """
+        pos = self.rawdf["pos"].to_numpy()
+        zscore = self.rawdf[zscore_label].to_numpy(dtype=float)
+        N = len(pos)
+        if N == 0:
+            return []
+
+        # a new cluster starts when positions are not consecutive or when the
+        # sign of the zscore changes. The first cluster is a special case: it
+        # starts at position 1 with a null zscore, so the first row extends it
+        # if its position is 1 + step. Such a cluster ignores sign changes.
+        gaps = np.empty(N, dtype=bool)
+        gaps[0] = pos[0] - self.step != 1
+        gaps[1:] = (pos[1:] - self.step) != pos[:-1]
+        breaks = gaps.copy()
+        breaks[1:] |= zscore[1:] * zscore[:-1] < 0
+        if not gaps[0]:
+            first_gap = np.flatnonzero(gaps)
+            first_gap = first_gap[0] if len(first_gap) else N
+            breaks[1:first_gap] = False
+        cluster_ids = np.cumsum(breaks)
+
+        # positions above the main thresholds
+        selected = ((zscore > 0) & (zscore > self.thresholds.high)) | (
+            (zscore < 0) & (zscore < self.thresholds.low)
+        )
+        selected = np.flatnonzero(selected)
+        if len(selected) == 0:
+            return []
+
+        # first and last selected rows of each cluster
+        ids = cluster_ids[selected]
+        is_first = np.ones(len(ids), dtype=bool)
+        is_first[1:] = ids[1:] != ids[:-1]
+        is_last = np.ones(len(ids), dtype=bool)
+        is_last[:-1] = ids[1:] != ids[:-1]
+        first_rows = selected[is_first]
+        last_rows = selected[is_last]
+
+        # the region of the last cluster is ignored if the cluster is
+        # made of one row only (e.g. the last row alone)
+        if ids[-1] == cluster_ids[-1]:
+            cluster_start = np.flatnonzero(breaks)
+            cluster_start = pos[cluster_start[-1]] if (breaks[0] or cluster_ids[-1] > 0) else 1
+            if not cluster_start < pos[-1]:
+                first_rows = first_rows[:-1]
+                last_rows = last_rows[:-1]
+        if len(first_rows) == 0:
+            return []
+
+        return self._merge_rows(first_rows, last_rows, zscore_label)
+
+    def _merge_rows(self, first_rows, last_rows, zscore_label="zscore"):
+        # statistics of the rows first_rows[i] to last_rows[i] (included) of
+        # rawdf. segments do not overlap so we reduce on [first, last+1, ...]
+        # and keep every other value. A sentinel is added for the last segment.
+        df = self.rawdf
+        indices = np.empty(2 * len(first_rows), dtype=np.int64)
+        indices[0::2] = first_rows
+        indices[1::2] = last_rows + 1
+        counts = last_rows - first_rows + 1
+
+        def reduce(ufunc, column, dtype=None):
+            values = df[column].to_numpy(dtype=dtype)
+            values = np.append(values, values[:1])
+            return ufunc.reduceat(values, indices)[0::2]
+
+        cov = reduce(np.add, "cov", float) / counts
+        rm = reduce(np.add, "rm", float) / counts
+        zscore = reduce(np.add, zscore_label, float) / counts
+        max_cov = reduce(np.maximum, "cov")
+        max_zscore = np.where(zscore >= 0, reduce(np.maximum, zscore_label), reduce(np.minimum, zscore_label))
+
+        starts = df["pos"].to_numpy()[first_rows]
+        stops = df["pos"].to_numpy()[last_rows]
+        chroms = df["chr"].to_numpy()[first_rows]
+
+        return [
+            {
+                "chr": chrom,
+                "start": start,
+                "end": stop + 1,
+                "size": stop - start + 1,
+                "mean_cov": mean_cov,
+                "mean_rm": mean_rm,
+                "mean_zscore": mean_zscore,
+                "log2_ratio": np.log2(mean_cov / mean_rm) if mean_rm != 0 and mean_cov != 0 else None,
+                "max_zscore": this_max_zscore,
+                "max_cov": this_max_cov,
+            }
+            for chrom, start, stop, mean_cov, mean_rm, mean_zscore, this_max_zscore, this_max_cov in zip(
+                chroms,
+                starts.tolist(),
+                stops.tolist(),
+                cov,
+                rm,
+                zscore,
+                max_zscore,
+                max_cov,
+            )
+        ]
 
     def _add_annotation(self, region_list, feature_list):
         """Add annotation from a dictionary generated by parsers in
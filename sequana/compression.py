@@ -0,0 +1,296 @@
+#
+#  This file is part of Sequana software
+#
+#  Copyright (c) 2016-2022 - Sequana Development Team
+#
+#  Distributed under the terms of the 3-clause BSD license.
+#  The full license is in the LICENSE file, distributed with this software.
+#
+#  website: https://github.com/sequana/sequana
+#  documentation: http://sequana.readthedocs.io
+#
+##############################################################################
+"""Compressed streams used to read and write (FASTQ) files
+
+Compression is often the bottleneck when reading or writing FASTQ files. The
+function :func:`open_compressed` opens a gzip file in read or write mode
+(binary or text) using the fastest backend available:
+
+============ ===============================================================
+backend      description
+============ ===============================================================
+pigz         external pigz command (multithreaded) through a pipe
+igzip        external igzip command (ISA-L) through a pipe
+threads      in-process writer; blocks are compressed in parallel threads
+             (zlib releases the GIL). Also used to write BGZF files.
+gzip         standard :mod:`gzip` module
+============ ===============================================================
+
+Outputs are streamed straight to the compressed file (no temporary file)::
+
+    from sequana.compression import open_compressed
+
+    with open_compressed("reads.fastq.gz", "wb", threads=4) as fout:
+        fout.write(data)
+
+BGZF files (*bgzf=True*) are valid gzip files made of independent blocks and
+can be indexed by samtools or tabix. Files without the .gz extension are
+opened with the builtin :func:`open`.
+
+"""
+import gzip
+import io
+import os
+import shutil
+import struct
+import subprocess
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import colorlog
+
+logger = colorlog.getLogger(__name__)
+
+
+__all__ = ["open_compressed", "compress_file", "BlockGzipWriter", "get_backend"]
+
+
+# maximum uncompressed size of a BGZF block (as in htslib) so that the
+# compressed block is always below 64Kb.
+BGZF_BLOCKSIZE = 65280
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+def _get_threads(threads):
+    if threads is None:
+        return os.cpu_count() or 1
+    return max(int(threads), 1)
+
+
+def get_backend(backend="auto", bgzf=False):
+    """Return the name of the backend to be used
+
+    :param backend: one of *auto*, *pigz*, *igzip*, *threads* or *gzip*. With
+        *auto*, the first external command found (pigz, igzip) is used,
+        otherwise *threads*.
+    :param bgzf: BGZF output can only be written with the *threads* backend.
+    """
+    if bgzf:
+        return "threads"
+    if backend == "auto":
+        for name in ("pigz", "igzip"):
+            if shutil.which(name):
+                return name
+        return "threads"
+    if backend not in {"pigz", "igzip", "threads", "gzip"}:
+        raise ValueError(f"backend must be auto, pigz, igzip, threads or gzip. Got {backend}")
+    return backend
+
+
+def _get_command(backend, threads, level=None):
+    if backend == "pigz":
+        command = ["pigz", "-p", str(threads)]
+        if level is not None:
+            command.append(f"-{level}")
+    else:
+        command = ["igzip"]
+        if level is not None:
+            # igzip compression levels are between 0 and 3
+            command.append(f"-{min(level, 3)}")
+    return command
+
+
+def _deflate(data, level, bgzf=False):
+    # compress data as one gzip member or as a list of BGZF blocks
+    if not bgzf:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    blocks = []
+    for start in range(0, len(data), BGZF_BLOCKSIZE):
+        block = data[start : start + BGZF_BLOCKSIZE]
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(block) + compressor.flush()
+        # gzip header with the BC extra field that stores the block size - 1
+        blocks.append(struct.pack("<BBBBIBBHBBHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25))
+        blocks.append(cdata)
+        blocks.append(struct.pack("<II", zlib.crc32(block), len(block)))
+    return b"".join(blocks)
+
+
+class BlockGzipWriter(io.RawIOBase):
+    """Write a gzip file by compressing blocks in parallel threads
+
+    :param filename: output filename
+    :param int level: compression level (1-9)
+    :param int threads: number of threads (default to number of CPUs)
+    :param bool bgzf: write a BGZF file (blocks of 64Kb) instead of a gzip
+        file made of blocks of *blocksize* bytes.
+    :param int blocksize: size of the uncompressed blocks
+    :param str mode: 'wb' or 'ab'
+
+    Each block is compressed as an independent gzip member (or a group of
+    BGZF blocks), which is valid gzip. Blocks are written in order.
+    """
+
+    def __init__(self, filename, level=6, threads=None, bgzf=False, blocksize=2**20, mode="wb"):
+        super().__init__()
+        self.filename = filename
+        self.level = level
+        self.bgzf = bgzf
+        self.blocksize = blocksize
+        self.threads = _get_threads(threads)
+
+        self._fout = open(filename, mode)
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(self.threads) if self.threads > 1 else None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.blocksize:
+            self._submit(bytes(self._buffer[: self.blocksize]))
+            del self._buffer[: self.blocksize]
+        return len(data)
+
+    def _submit(self, data):
+        if self._executor is None:
+            self._fout.write(_deflate(data, self.level, self.bgzf))
+            return
+        self._pending.append(self._executor.submit(_deflate, data, self.level, self.bgzf))
+        # limit the memory used by blocks waiting to be written
+        while len(self._pending) > 2 * self.threads:
+            self._fout.write(self._pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._fout.write(self._pending.popleft().result())
+            if self.bgzf:
+                self._fout.write(BGZF_EOF)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._fout.close()
+            super().close()
+
+
+class _PipedGzip(io.RawIOBase):
+    # read or write a gzip file through an external command (pigz, igzip)
+
+    def __init__(self, command, filename, mode="rb"):
+        super().__init__()
+        self.filename = filename
+        self._reading = mode.startswith("r")
+        if self._reading:
+            self._proc = subprocess.Popen(command + ["-dc", filename], stdout=subprocess.PIPE)
+            self._stream = self._proc.stdout
+        else:
+            self._fout = open(filename, mode)
+            self._proc = subprocess.Popen(command + ["-c"], stdin=subprocess.PIPE, stdout=self._fout)
+            self._stream = self._proc.stdin
+
+    def readable(self):
+        return self._reading
+
+    def writable(self):
+        return not self._reading
+
+    def readinto(self, buffer):
+        return self._stream.readinto(buffer)
+
+    def write(self, data):
+        self._stream.write(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._reading:
+                eof = not self._stream.read(1)
+                self._stream.close()
+                if not eof:
+                    # closed before the end of the file
+                    self._proc.terminate()
+                retcode = self._proc.wait()
+                if eof and retcode != 0:
+                    raise OSError(f"Could not decompress {self.filename} (exit code {retcode})")
+            else:
+                self._stream.close()
+                retcode = self._proc.wait()
+                self._fout.close()
+                if retcode != 0:
+                    raise OSError(f"Could not compress {self.filename} (exit code {retcode})")
+        finally:
+            super().close()
+
+
+def open_compressed(filename, mode="rb", threads=None, level=6, bgzf=False, backend="auto"):
+    """Open a file for reading or writing; gzip if the filename ends in .gz
+
+    :param filename: input or output file
+    :param str mode: 'r', 'w' or 'a' followed by 'b' (binary, default) or 't'
+    :param int threads: number of threads used by the backend (default to
+        number of CPUs)
+    :param int level: compression level
+    :param bool bgzf: write a BGZF file (indexable blocks)
+    :param backend: see :func:`get_backend`
+    :return: a file object
+
+    ::
+
+        with open_compressed("test.fastq.gz", "rt") as fin:
+            for line in fin:
+                pass
+
+    """
+    filename = str(filename)
+    text = "t" in mode
+    mode = mode.replace("t", "").replace("b", "") + "b"
+
+    if not filename.endswith(".gz"):
+        return open(filename, mode if not text else mode[0])
+
+    backend = get_backend(backend, bgzf=bgzf and not mode.startswith("r"))
+    threads = _get_threads(threads)
+
+    if mode.startswith("r"):
+        if backend in ("pigz", "igzip"):
+            stream = io.BufferedReader(_PipedGzip(_get_command(backend, threads), filename), 2**20)
+        else:
+            stream = gzip.open(filename, "rb")
+    else:
+        if backend in ("pigz", "igzip"):
+            raw = _PipedGzip(_get_command(backend, threads, level), filename, mode)
+        elif backend == "threads":
+            raw = BlockGzipWriter(filename, level=level, threads=threads, bgzf=bgzf, mode=mode)
+        else:
+            raw = gzip.open(filename, mode, compresslevel=level)
+        stream = io.BufferedWriter(raw, 2**20) if backend != "gzip" else raw
+
+    if text:
+        return io.TextIOWrapper(stream)
+    return stream
+
+
+def compress_file(filename, threads=None, level=6, bgzf=False, remove=True):
+    """Compress a file into filename.gz (and remove the original by default)
+
+    :return: the name of the compressed file
+    """
+    output = f"{filename}.gz"
+    with open(filename, "rb") as fin, open_compressed(output, "wb", threads=threads, level=level, bgzf=bgzf) as fout:
+        shutil.copyfileobj(fin, fout, 2**20)
+    if remove:
+        os.remove(filename)
+    return output
@@ -13,7 +13,6 @@
 """Utilities to manipulate FASTQ and Reads"""
 import gzip
 import os
-import subprocess
 import zlib
 from collections import Counter, defaultdict
 from functools import wraps
@@ -22,6 +21,8 @@ from itertools import islice
 import pysam
 from tqdm import tqdm
 
+from sequana.compression import compress_file, open_compressed
+from sequana.kmer import KmerCounter
 from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
 from sequana.lazy import pylab
@@ -45,7 +46,7 @@ def grouper(iterable):
     return izip_longest(*args)
 
 
-__all__ = ["Identifier", "FastQ", "FastQC", "is_fastq"]
+__all__ = ["Identifier", "FastQ", "FastQBatch", "FastQC", "is_fastq", "iter_fastq_batches"]
 
 
 def is_fastq(filename):
@@ -176,6 +177,150 @@ class Identifier(object):
         return "Identifier (%s)" % self.version
 
 
+class FastQBatch(object):
+    """A batch of FASTQ records as returned by :meth:`FastQ.iter_batches`
+
+    Records are not decoded: the raw bytes are kept in :attr:`data` and each
+    record is described by the start and end offsets of its 4 lines
+    (:attr:`starts` and :attr:`ends`, NumPy arrays of shape (N, 4), end of
+    lines excluded). Selections can therefore be vectorised::
+
+        for batch in FastQ("test.fastq.gz").iter_batches(10000):
+            fout.write(batch.to_bytes(batch.lengths > 50))
+
+    """
+
+    def __init__(self, data, starts, ends):
+        self.data = data
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        return FastQBatch(self.data, self.starts[index], self.ends[index])
+
+    @property
+    def lengths(self):
+        """length of the reads"""
+        return self.ends[:, 1] - self.starts[:, 1]
+
+    def _concatenate(self, line):
+        # gather a given line of all records in a single uint8 array
+        buffer = np.frombuffer(self.data, dtype=np.uint8)
+        starts = self.starts[:, line]
+        lengths = self.ends[:, line] - starts
+        shifts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return buffer[np.arange(len(shifts)) + shifts]
+
+    @property
+    def sequences(self):
+        """concatenated sequences (uint8 array); use :attr:`lengths` to split them"""
+        return self._concatenate(1)
+
+    @property
+    def qualities(self):
+        """concatenated qualities (uint8 array); use :attr:`lengths` to split them"""
+        return self._concatenate(3)
+
+    @property
+    def raw(self):
+        """the records as they appear in the file (memoryview)
+
+        Valid for contiguous records only (batches from :meth:`FastQ.iter_batches`)
+        """
+        if len(self) == 0:
+            return memoryview(b"")
+        last = self.ends[-1, 3]
+        # include the end of line (possibly windows)
+        last += 1 + (self.data[last] == 13)
+        return memoryview(self.data)[self.starts[0, 0] : last]
+
+    def get_identifiers(self):
+        """Return identifiers (bytes, first word including the @ sign)"""
+        data = self.data
+        return [data[a:b].split(None, 1)[0] for a, b in zip(self.starts[:, 0].tolist(), self.ends[:, 0].tolist())]
+
+    def to_bytes(self, selection=None):
+        """Return records as FASTQ bytes
+
+        :param selection: optional boolean mask of the records to keep.
+
+        The third line of a record is replaced by a single + sign.
+        """
+        starts, ends = self.starts, self.ends
+        if selection is not None:
+            starts, ends = starts[selection], ends[selection]
+        data = memoryview(self.data)
+        parts = []
+        for a, b, c, d in zip(starts[:, 0].tolist(), ends[:, 1].tolist(), starts[:, 3].tolist(), ends[:, 3].tolist()):
+            parts.extend((data[a:b], b"\n+\n", data[c:d], b"\n"))
+        return b"".join(parts)
+
+    def to_fasta_bytes(self, selection=None):
+        """Return records as FASTA bytes (identifier line and sequence)"""
+        starts, ends = self.starts, self.ends
+        if selection is not None:
+            starts, ends = starts[selection], ends[selection]
+        data = memoryview(self.data)
+        parts = []
+        for a, b, c, d in zip(starts[:, 0].tolist(), ends[:, 0].tolist(), starts[:, 1].tolist(), ends[:, 1].tolist()):
+            parts.extend((b">", data[a + 1 : b], b"\n", data[c:d], b"\n"))
+        return b"".join(parts)
+
+
+def iter_fastq_batches(fileobj, n=100000, blocksize=4 * 1024 * 1024):
+    """Iterate over the records of an opened FASTQ file (binary mode) by batches
+
+    :param fileobj: file object opened in binary mode
+    :param int n: number of reads per batch (the last batch may be smaller)
+    :param int blocksize: size of the blocks read from *fileobj*
+    :return: iterator of :class:`FastQBatch`
+
+    .. seealso:: :meth:`FastQ.iter_batches`
+    """
+    chunks = []
+    nlines = 0
+    eof = False
+    while not eof:
+        block = fileobj.read(blocksize)
+        eof = not block
+        chunks.append(block)
+        nlines += block.count(b"\n")
+        if nlines < 4 * n and not eof:
+            continue
+
+        data = b"".join(chunks)
+        if eof and data and not data.endswith(b"\n"):
+            data += b"\n"
+
+        buffer = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(buffer == 10)
+        N = len(newlines) // 4
+        # complete batches only, except at the end of the file
+        if not eof:
+            N -= N % n
+        newlines = newlines[: 4 * N]
+
+        if N:
+            starts = np.empty(4 * N, dtype=np.int64)
+            starts[0] = 0
+            starts[1:] = newlines[:-1] + 1
+            # windows end of lines
+            ends = newlines - (buffer[newlines - 1] == 13)
+            batch = FastQBatch(data, starts.reshape(N, 4), ends.reshape(N, 4))
+            for i in range(0, N, n):
+                yield batch[i : i + n]
+
+        pending = data[newlines[-1] + 1 :] if N else data
+        chunks = [pending]
+        nlines = pending.count(b"\n")
+
+    if pending.strip():  # pragma: no cover
+        logger.warning("Incomplete last record ignored")
+
+
 class FastQ(object):
     """Class to handle FastQ files
 
@@ -325,26 +470,12 @@ class FastQ(object):
 
     def _extract_head(self, N, output_filename):
         with open(self.filename, "r") as fin:
-            if output_filename.endswith("gz"):
-                output_filename_nogz = output_filename.replace(".gz", "")
-
-                with open(output_filename_nogz, "w") as fout:
-                    fout.writelines(islice(fin, N))
-
-                # compress the file
-                self._gzip(output_filename_nogz)
-
-            else:
-                with open(output_filename, "w") as fout:
-                    fout.writelines(islice(fin, N))
+            with open_compressed(output_filename, "wt") as fout:
+                fout.writelines(islice(fin, N))
 
     def _gzip(self, filename):
-        try:
-            s = subprocess.Popen(["pigz", "-f", filename])
-            s.wait()
-        except:  # pragma: no cover
-            s = subprocess.Popen(["gzip", filename, "-f"])
-            s.wait()
+        # compress the file in place (filename.gz) with pigz if available
+        compress_file(filename)
 
     def _extract_head_gz(self, N, output_filename="test.fastq.gz", level=6, CHUNKSIZE=65536):
         """
@@ -375,14 +506,12 @@ class FastQ(object):
         # this is to supress the header
         decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
 
-        # will we gzip the output file ?
-        output_filename, tozip = self._istozip(output_filename)
-
         with open(self.filename, "rb") as fin:
             buf = fin.read(CHUNKSIZE)
             count = 0
 
-            with open(output_filename, "wb") as fout:
+            # output is compressed on the fly if it ends in .gz
+            with open_compressed(output_filename, "wb", level=level) as fout:
                 while buf:
                     outstr = decoder.decompress(buf)
                     if len(outstr) == 0:  # pragma: no cover
@@ -407,8 +536,6 @@ class FastQ(object):
                     fout.write(outstr)  # pragma: no cover
                     buf = fin.read(CHUNKSIZE)  # pragma: no cover
 
-        if tozip is True:
-            self._gzip(output_filename)
         return count
 
     def _istozip(self, filename):
@@ -532,6 +659,8 @@ class FastQ(object):
             output_filename.split(".", -1)
             left, right = input_filename.rsplit(".", 1)
             output_filename = left + "_%s_%s." % (lb, ub) + right
+            if gzip is True:
+                output_filename += ".gz"
             outputs.append(output_filename)
 
         d = zlib.decompressobj(16 + zlib.MAX_WBITS)
@@ -542,7 +671,7 @@ class FastQ(object):
 
             # open an output file handler
             current_file_counter = 0
-            fout = open(outputs[0], "wb")
+            fout = open_compressed(outputs[0], "wb")
 
             while buf:
                 outstr = d.decompress(buf)
@@ -568,7 +697,7 @@ class FastQ(object):
                     # and open the next one where we can already save the end of
                     # the buffer
                     current_file_counter += 1
-                    fout = open(outputs[current_file_counter], "wb")
+                    fout = open_compressed(outputs[current_file_counter], "wb")
                     fout.write(remaining)
                     # we need to keep track of what has be written
                     count = remaining.count(b"\n")
@@ -577,11 +706,8 @@ class FastQ(object):
                 else:
                     fout.write(outstr)
                     buf = fin.read(CHUNKSIZE)
+            fout.close()
 
-        if gzip is True:
-            for output in outputs:
-                self._gzip(output)
-            outputs = [x + ".gz" for x in outputs]
         return outputs
 
     def _check_multiple(self, N, multiple=4):
@@ -614,23 +740,19 @@ class FastQ(object):
                 output_filename = self.filename
                 output_filename.split(".", -1)
                 left, right = self.filename.rsplit(".", 1)
-                output_filename = left + "_%s_%s." % (lb, ub) + right
+                output_filename = left + "_%s_%s." % (lb, ub) + right + (".gz" if gzip is True else "")
                 outputs.append(output_filename)
-                with open(output_filename, "w") as fout:
+                with open_compressed(output_filename, "wt") as fout:
                     fout.writelines(islice(fin, N))
             # last chunk is dealt with outside the loop
             lb = ub + 1
             ub = self.n_lines
-            output_filename = left + "_%s_%s." % (lb, ub) + right
+            output_filename = left + "_%s_%s." % (lb, ub) + right + (".gz" if gzip is True else "")
             if remainder != 0:
                 outputs.append(output_filename)
-                with open(output_filename, "w") as fout:
+                with open_compressed(output_filename, "wt") as fout:
                     fout.writelines(islice(fin, remainder))
 
-        if gzip is True:
-            for output in outputs:
-                self._gzip(output)
-            outputs = [x + ".gz" for x in outputs]
         return outputs
 
     def split_chunks(self, N=10):  # pragma: no cover
@@ -647,6 +769,29 @@ class FastQ(object):
         """
         raise NotImplementedError
 
+    def iter_batches(self, n=100000, blocksize=4 * 1024 * 1024, threads=None):
+        """Iterate over the reads by batches of n reads
+
+        :param int n: number of reads per batch (the last batch may be
+            smaller)
+        :param int blocksize: size of the blocks read from the (decompressed)
+            file
+        :param int threads: threads used to decompress the file (see
+            :func:`sequana.compression.open_compressed`)
+        :return: iterator of :class:`FastQBatch`
+
+        Blocks of bytes are read and split into records without decoding: end
+        of lines are found with NumPy and each batch provides offsets and
+        lengths of the identifiers, sequences and qualities. This is much
+        faster than iterating over the reads one by one::
+
+            f = FastQ("test.fastq.gz")
+            total = sum(batch.lengths.sum() for batch in f.iter_batches())
+
+        """
+        with open_compressed(self.filename, "rb", threads=threads) as fin:
+            yield from iter_fastq_batches(fin, n=n, blocksize=blocksize)
+
     def __iter__(self):
         return self
 
@@ -711,23 +856,18 @@ class FastQ(object):
         return 1
 
     def to_fasta(self, output_filename="test.fasta"):
-        """
-        Slow but works for now in pure python with input compressed data.
-        """
-        with open(output_filename, "w") as fout:
-            for this in self:
-                fout.write("{}\n{}\n".format(this["identifier"].decode(), this["sequence"].decode()))
-        return
+        """Save the reads in a FASTA file (input can be compressed)"""
+        with open(output_filename, "wb") as fout:
+            for batch in self.iter_batches():
+                fout.write(batch.to_fasta_bytes())
 
     def keep_reads(self, identifiers, progress=True, output_filename="kept.fastq"):
         # make sure we are at the beginning
         self.rewind()
 
-        output_filename, tozip = self._istozip(output_filename)
-
         id_set_bytes = {id_.encode() for id_ in identifiers}
 
-        with open(output_filename, "wb") as fout:
+        with open_compressed(output_filename, "wb") as fout:
             found = 0
 
             for count, lines in tqdm(
@@ -752,10 +892,6 @@ class FastQ(object):
             if found != len(identifiers):  # pragma: no cover
                 print("\nWARNING: not all identifiers were found in the fastq file.")
 
-        if tozip is True:  # pragma: no cover
-            logger.info("Compressing file")
-            self._gzip(output_filename)
-
     def filter(
         self,
         identifiers_list=[],
@@ -766,86 +902,55 @@ class FastQ(object):
     ):
         """Save reads in a new file if there are not in the identifier_list
 
+        :param identifiers_list: identifiers of the reads to ignore (first word
+            of the header including the @ sign)
         :param int min_bp: ignore reads with length shorter than min_bp
         :param int max_bp: ignore reads with length above max_bp
 
         """
-        # 7 seconds without identifiers to scan the file
-        # on a 750000 reads
-
         if min_bp is None:
             min_bp = 0
 
         if max_bp is None:
             max_bp = 1e9
 
-        # make sure we are at the beginning
-        self.rewind()
-
-        output_filename, tozip = self._istozip(output_filename)
-
-        with open(output_filename, "w") as fout:
-            buf = ""
-            filtered = 0
-            saved = 0
-
-            for count, lines in tqdm(
-                enumerate(grouper(self._fileobj)),
-                desc="sequana:fastq filter reads",
-                disable=not progress,
-            ):
-                identifier = lines[0].split()[0]
-                if lines[0].split()[0].decode() in identifiers_list:
-                    filtered += 1
-                else:  # pragma: no cover
-                    N = len(lines[1])
-                    if N <= max_bp and N >= min_bp:
-                        buf += "{}{}+\n{}".format(
-                            lines[0].decode("utf-8"),
-                            lines[1].decode("utf-8"),
-                            lines[3].decode("utf-8"),
-                        )
-                        saved += 1
-                    else:
-                        filtered += 1
-                    if count % 100000 == 0:
-                        fout.write(buf)
-                        buf = ""
-            fout.write(buf)
-            if filtered < len(identifiers_list):  # pragma: no cover
+        identifiers = {x.encode() for x in identifiers_list}
+
+        filtered = 0
+        saved = 0
+        found = 0
+        with open_compressed(output_filename, "wb") as fout:
+            for batch in tqdm(self.iter_batches(), desc="sequana:fastq filter reads", disable=not progress):
+                lengths = batch.lengths
+                keep = (lengths <= max_bp) & (lengths >= min_bp)
+                if identifiers:
+                    unwanted = np.array([x in identifiers for x in batch.get_identifiers()], dtype=bool)
+                    found += unwanted.sum()
+                    keep &= ~unwanted
+                fout.write(batch.to_bytes(keep))
+                saved += keep.sum()
+                filtered += len(batch) - keep.sum()
+
+            if found < len(identifiers_list):  # pragma: no cover
                 print("\nWARNING: not all identifiers were found in the fastq file to " + "be filtered.")
         logger.info("\n{} reads were filtered out and {} saved in {}".format(filtered, saved, output_filename))
 
-        if tozip is True:  # pragma: no cover
-            logger.info("Compressing file")
-            self._gzip(output_filename)
-
-    def to_kmer_content(self, k=7):
+    def to_kmer_content(self, k=7, canonical=False):
         """Return a Series with kmer count across all reads
 
         :param int k: (default to 7-mers)
+        :param bool canonical: count k-mers and their reverse complement
+            together
         :return: Pandas Series with index as kmer and values as count.
 
-        Takes about 30 seconds on a million reads.
+        K-mers are encoded as integers and counted per batch of reads (see
+        :class:`sequana.kmer.KmerCounter`). K-mers with letters other than
+        ACGT are ignored.
         """
-        # Counter is slow if we apply it on each read.
-        # .count is slow as well
-
-        from sequana.kmer import get_kmer
-
-        counter = Counter()
-        buffer_ = []
-        for this in tqdm(self):
-            buffer_.extend(list(get_kmer(this["sequence"].decode(), k)))
-            if len(buffer_) > 100000:  # pragma: no cover
-                counter += Counter(buffer_)
-                buffer_ = []
-        counter += Counter(buffer_)
-
-        ts = pd.Series(counter)
-        ts.sort_values(inplace=True, ascending=False)
-
-        return ts
+        counter = KmerCounter(k=k, canonical=canonical)
+        for batch in tqdm(self.iter_batches()):
+            counter.update_batch(batch)
+        return counter.to_series()
 
     def to_krona(self, k=7, output_filename="fastq.krona"):
         """Save Krona file with ACGT content within all k-mers
@@ -905,8 +1010,7 @@ class FastQ(object):
         pylab.ylim([0, 100])
 
     def stats(self):
-        self.rewind()
-        lengths = [len(read["sequence"]) for read in self]
+        lengths = np.concatenate([batch.lengths for batch in self.iter_batches()] or [[]]).tolist()
 
         stats = {}
         stats["N"] = len(lengths)
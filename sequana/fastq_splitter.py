@@ -12,127 +12,229 @@
 ##############################################################################
 # sequana/fastq_tools/splitter.py
 import gzip
+import multiprocessing
 import os
 from pathlib import Path
-from typing import Iterator, Union
+from typing import Union
 
 import colorlog
 from tqdm import tqdm
 
+from sequana.compression import open_compressed
+from sequana.fastq import iter_fastq_batches
+
 logger = colorlog.getLogger(__name__)
 
 
+def _write_part(queue, out_path, gzip_output, bgzf):
+    # writer process used by FastqSplitter.by_part(processes=True)
+    if gzip_output:
+        fout = open_compressed(out_path, "wb", threads=1, level=5, bgzf=bgzf)
+    else:
+        fout = open(out_path, "wb")
+    with fout:
+        for data in iter(queue.get, None):
+            fout.write(data)
+
+
+class _PartWriters:
+    # output files of a split; parts are opened on demand, in the current
+    # process or in a dedicated writer process each.
+
+    def __init__(self, splitter, pattern, gzip_output, processes=False):
+        self.splitter = splitter
+        self.pattern = pattern
+        self.gzip_output = gzip_output
+        self.processes = processes
+        self._files = {}
+
+    def open(self, part):
+        out_path = self.splitter._get_outfile(self.pattern, part + 1, self.gzip_output)
+        if self.processes:
+            queue = multiprocessing.Queue(maxsize=8)
+            proc = multiprocessing.Process(
+                target=_write_part, args=(queue, out_path, self.gzip_output, self.splitter.bgzf), daemon=True
+            )
+            proc.start()
+            self._files[part] = (queue, proc)
+        else:
+            self._files[part] = self.splitter._open_outfile(self.pattern, part + 1, self.gzip_output, mode="wb")
+
+    def write(self, part, data):
+        if part not in self._files:
+            self.open(part)
+        if self.processes:
+            self._files[part][0].put(bytes(data))
+        else:
+            self._files[part].write(data)
+
+    def close(self, part):
+        if self.processes:
+            queue, proc = self._files.pop(part)
+            queue.put(None)
+            proc.join()
+            if proc.exitcode != 0:
+                raise RuntimeError(f"Writer of part {part + 1} failed (exit code {proc.exitcode})")
+        else:
+            self._files.pop(part).close()
+
+    def close_all(self):
+        for part in sorted(self._files):
+            self.close(part)
+
+
 class FastqSplitter:
-    def __init__(self, filename: Union[str, Path]):
+    """Split a FASTQ file by number of reads or number of parts
+
+    :param filename: input FASTQ file (can be gzipped)
+    :param threads: threads used to (de)compress the files
+    :param bgzf: compressed outputs are written as BGZF (indexable) files
+
+    Reads are processed by batches of raw bytes and never decoded. Splitting
+    by size is done in a single pass; splitting into N parts can be done
+    without counting the reads first (see :meth:`by_part`)::
+
+        splitter = FastqSplitter("R1.fastq.gz")
+        splitter.by_part(10, "R1.#.fastq.gz", gzip_output=True, mode="roundrobin")
+
+    """
+
+    def __init__(self, filename: Union[str, Path], threads: int = None, bgzf: bool = False):
         self.filename = Path(filename)
         self.is_gz = self.filename.suffix == ".gz"
+        self.threads = threads
+        self.bgzf = bgzf
+
+    def _iter_batches(self, buffer_size):
+        with open_compressed(self.filename, "rb", threads=self.threads) as fin:
+            yield from iter_fastq_batches(fin, n=buffer_size)
 
-    def _open(self):
-        if self.is_gz:
-            return gzip.open(self.filename, "rt")
-        return open(self.filename, "r")
-
-    def _read_fastq(self) -> Iterator[list[str]]:
-        """Yield one FASTQ record (4 lines)."""
-        with self._open() as fh:
-            while True:
-                record = [fh.readline() for _ in range(4)]
-                if not record[0]:
-                    break
-                yield record
-
-    def _open_outfile(self, pattern: str, part_num: int, gzip_output: bool):
+    def _get_outfile(self, pattern: str, part_num: int, gzip_output: bool):
         out_name = pattern.replace("#", str(part_num))
         out_path = Path(out_name)
         out_path.parent.mkdir(parents=True, exist_ok=True)
-        mode = "wt"
         if gzip_output and not out_path.suffix == ".gz":
             out_path = out_path.with_suffix(out_path.suffix + ".gz")
+        return out_path
+
+    def _open_outfile(self, pattern: str, part_num: int, gzip_output: bool, mode: str = "wt"):
+        out_path = self._get_outfile(pattern, part_num, gzip_output)
         if gzip_output:
-            return gzip.open(out_path, mode, compresslevel=5)
-        return open(out_path, mode)
+            return open_compressed(out_path, mode, threads=self.threads, level=5, bgzf=self.bgzf)
+        return open(out_path, mode.replace("t", ""))
 
     def get_nreads(self):
         logger.info("Computing read counts")
         from sequana.tools import GZLineCounter
 
-        count = GZLineCounter(self.filename)
-        count = count._use_gzip() / 4
-        print(count)
+        count = GZLineCounter(str(self.filename))
+        count = len(count) // 4
+        logger.info(f"Found {count} reads")
         return count
 
     def by_size(self, reads_per_chunk: int, pattern: str, gzip_output: bool = False, buffer_size: int = 10000):
-        """Split FASTQ into chunks of N reads with file-based progress."""
-        # rough estimate of total reads
-        nreads = self.get_nreads()
-        est_total_files = max(1, nreads // reads_per_chunk)
-
-        chunk_id = 1
-        out_fh = self._open_outfile(pattern, chunk_id, gzip_output)
-        buffer = []
-        reads_written = 0
-
-        progress = tqdm(total=est_total_files, desc="Splitting FASTQ", unit="file")
-
-        for record in self._read_fastq():
-            buffer.extend(record)
-            reads_written += 1
-
-            if len(buffer) >= 4 * buffer_size:
-                out_fh.writelines(buffer)
-                buffer.clear()
-
-            if reads_written >= reads_per_chunk:
-                if buffer:
-                    out_fh.writelines(buffer)
-                    buffer.clear()
-                out_fh.close()
-                chunk_id += 1
-                out_fh = self._open_outfile(pattern, chunk_id, gzip_output)
-                reads_written = 0
-                progress.update(1)
-
-        if buffer:
-            out_fh.writelines(buffer)
-        out_fh.close()
-        progress.update(1)  # last file
+        """Split FASTQ into chunks of N reads (single pass)."""
+        writers = _PartWriters(self, pattern, gzip_output)
+        part = 0
+        written = 0
+
+        progress = tqdm(desc="Splitting FASTQ", unit="read", unit_scale=True)
+        for batch in self._iter_batches(buffer_size):
+            start = 0
+            while start < len(batch):
+                if written == reads_per_chunk:
+                    writers.close(part)
+                    part += 1
+                    written = 0
+                end = min(len(batch), start + reads_per_chunk - written)
+                writers.write(part, batch[start:end].raw)
+                written += end - start
+                start = end
+            progress.update(len(batch))
+
+        if written == 0 and part == 0:  # empty input
+            writers.open(part)
+        writers.close_all()
         progress.close()
 
-    def by_part(self, n_parts: int, pattern: str, gzip_output: bool = False, buffer_size: int = 10000):
-        """Split FASTQ into N parts with approximate read counting."""
-        nreads = self.get_nreads()
-        reads_per_part = max(1, nreads // n_parts)
-
-        chunk_id = 1
-        out_fh = self._open_outfile(pattern, chunk_id, gzip_output)
-        buffer = []
-        reads_written = 0
-
-        progress = tqdm(total=n_parts, desc="Splitting FASTQ", unit="file")
-
-        for record in self._read_fastq():
-            buffer.extend(record)
-            reads_written += 1
-
-            # write buffer for efficiency
-            if len(buffer) >= 4 * buffer_size:
-                out_fh.writelines(buffer)
-                buffer.clear()
-
-            # switch file when reads_per_part is reached, except for last chunk
-            if reads_written >= reads_per_part and chunk_id < n_parts:
-                if buffer:
-                    out_fh.writelines(buffer)
-                    buffer.clear()
-                out_fh.close()
-                chunk_id += 1
-                out_fh = self._open_outfile(pattern, chunk_id, gzip_output)
-                reads_written = 0
-                progress.update(1)
-
-        # write remaining reads to the last chunk
-        if buffer:
-            out_fh.writelines(buffer)
-        out_fh.close()
-        progress.update(1)
-        progress.close()
+    def by_part(
+        self,
+        n_parts: int,
+        pattern: str,
+        gzip_output: bool = False,
+        buffer_size: int = 10000,
+        mode: str = "count",
+        processes: bool = False,
+    ):
+        """Split FASTQ into N parts.
+
+        :param n_parts: number of output files
+        :param pattern: output filename pattern (# is replaced by the part number)
+        :param gzip_output: compress outputs
+        :param buffer_size: number of reads processed at once
+        :param mode: how reads are dispatched:
+
+            - *count*: contiguous parts of equal size. Reads are counted
+              first, which requires an extra pass on the input file.
+            - *roundrobin*: blocks of *buffer_size* reads are written to each
+              part in turn (single pass). Parts are balanced but reads are not
+              contiguous. Since the dispatch only depends on the read index,
+              R1 and R2 files split with the same parameters stay paired.
+            - *offset*: contiguous parts of (approximately) equal compressed
+              size, based on the position in the input file (single pass).
+              Paired files are not guaranteed to stay synchronised.
+        :param processes: if True, each part is compressed and written by its
+            own process.
+        """
+        if mode not in {"count", "roundrobin", "offset"}:
+            raise ValueError(f"mode must be count, roundrobin or offset. Got {mode}")
+
+        writers = _PartWriters(self, pattern, gzip_output, processes=processes)
+        for part in range(n_parts):
+            writers.open(part)
+
+        progress = tqdm(desc="Splitting FASTQ", unit="read", unit_scale=True)
+        try:
+            if mode == "count":
+                self._split_by_count(writers, n_parts, buffer_size, progress)
+            elif mode == "roundrobin":
+                for i, batch in enumerate(self._iter_batches(buffer_size)):
+                    writers.write(i % n_parts, batch.raw)
+                    progress.update(len(batch))
+            else:
+                self._split_by_offset(writers, n_parts, buffer_size, progress)
+        finally:
+            writers.close_all()
+            progress.close()
+
+    def _split_by_count(self, writers, n_parts, buffer_size, progress):
+        reads_per_part = max(1, self.get_nreads() // n_parts)
+        part = 0
+        written = 0
+        for batch in self._iter_batches(buffer_size):
+            start = 0
+            while start < len(batch):
+                # last part takes the remaining reads
+                if written == reads_per_part and part < n_parts - 1:
+                    part += 1
+                    written = 0
+                end = len(batch)
+                if part < n_parts - 1:
+                    end = min(end, start + reads_per_part - written)
+                writers.write(part, batch[start:end].raw)
+                written += end - start
+                start = end
+            progress.update(len(batch))
+
+    def _split_by_offset(self, writers, n_parts, buffer_size, progress):
+        # the position in the (compressed) input file decides of the part.
+        # gzip is used here to access the position of the raw file.
+        size = max(os.path.getsize(self.filename), 1)
+        position = 0
+        with open(self.filename, "rb") as fh:
+            fin = gzip.GzipFile(fileobj=fh) if self.is_gz else fh
+            for batch in iter_fastq_batches(fin, n=buffer_size, blocksize=1024 * 1024):
+                writers.write(min(int(position * n_parts / size), n_parts - 1), batch.raw)
+                # data read so far; the next batch starts before this position
+                position = fh.tell()
+                progress.update(len(batch))
@@ -12,13 +12,17 @@
 ##############################################################################
 """feature counts related tools"""
 import glob
+import hashlib
+import json
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import colorlog
 
+from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
 from sequana.lazy import pylab
 
@@ -31,9 +35,139 @@ __all__ = [
     "MultiFeatureCount",
     "FeatureCount",
     "FeatureCountMerger",
+    "merge_feature_counts",
 ]
 
 
+# annotation columns of featureCounts outputs; other columns are counts
+_ANNOTATION_COLUMNS = ["Geneid", "Chr", "Start", "End", "Strand", "Length"]
+
+
+def _read_csv(filename, skiprows=None, **kwargs):
+    # featureCounts outputs start with a '# Program:featureCounts' line
+    if skiprows is None:
+        return pd.read_csv(filename, sep="\t", comment="#", low_memory=False, **kwargs)
+    return pd.read_csv(filename, sep="\t", skiprows=skiprows, low_memory=False, **kwargs)
+
+
+def _hash_ids(ids):
+    return hashlib.md5("\n".join(map(str, ids)).encode()).hexdigest()
+
+
+def _read_counts(args):
+    # read the Geneid and count columns of one file (run in threads)
+    filename, columns, skiprows = args
+    df = _read_csv(filename, skiprows=skiprows, usecols=["Geneid"] + columns)
+    return _hash_ids(df["Geneid"]), df["Geneid"], df[columns].to_numpy()
+
+
+def _get_signature(filenames):
+    signature = []
+    for filename in filenames:
+        st = os.stat(filename)
+        signature.append([str(filename), st.st_mtime_ns, st.st_size])
+    return json.dumps(signature)
+
+
+def _load_cache(cache, signature):
+    try:
+        with np.load(cache, allow_pickle=False) as data:
+            if str(data["signature"]) != signature:
+                return None
+            columns = [str(x) for x in data["columns"]]
+            annotation = [str(x) for x in data["annotation"]]
+            df = pd.DataFrame({name: data[f"annotation_{i}"] for i, name in enumerate(annotation)})
+            counts = pd.DataFrame(data["counts"], columns=columns[len(annotation) :])
+            return pd.concat([df, counts], axis=1)
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _save_cache(cache, signature, df, annotation):
+    arrays = {"signature": np.array(signature), "columns": np.array(df.columns, dtype=str)}
+    arrays["annotation"] = np.array(annotation, dtype=str)
+    for i, name in enumerate(annotation):
+        values = df[name].to_numpy()
+        arrays[f"annotation_{i}"] = values.astype(str) if values.dtype == object else values
+    arrays["counts"] = df.iloc[:, len(annotation) :].to_numpy()
+    try:
+        with open(cache, "wb") as fout:
+            np.savez(fout, **arrays)
+    except OSError as err:  # pragma: no cover
+        logger.warning(f"Could not save the count matrix in {cache}: {err}")
+
+
+def merge_feature_counts(filenames, skiprows=None, threads=None, cache=None):
+    """Merge featureCounts output files into one table
+
+    The annotation columns (Geneid, Chr, Start, End, Strand, Length) are
+    read from the first file only. Other files are read in parallel threads,
+    keeping only their Geneid and count columns. Counts are stored in one
+    preallocated int32 matrix (float64 if counts are fractional). Files must
+    contain the same features: a hash of the Geneid column is compared to
+    that of the first file and, if the order differs, counts are re-ordered.
+
+    :param filenames: list of featureCounts output files. Each file may
+        contain one or several samples.
+    :param skiprows: number of lines to skip at the top of the files. By
+        default, lines starting with # are ignored.
+    :param threads: number of threads (default to number of CPUs)
+    :param cache: optional .npz file where the merged table is stored. It is
+        used as long as the input files are unchanged.
+    :return: a dataframe with the annotation columns followed by the count
+        columns of each file (same as merging the files with :func:`pandas.merge`)
+    """
+    filenames = list(filenames)
+    if len(filenames) == 0:
+        raise ValueError("No files provided")
+
+    if cache is not None:
+        signature = _get_signature(filenames)
+        df = _load_cache(cache, signature)
+        if df is not None:
+            return df
+
+    first = _read_csv(filenames[0], skiprows=skiprows)
+    annotation = [x for x in first.columns if x in _ANNOTATION_COLUMNS]
+    if "Geneid" not in annotation:
+        raise ValueError(f"No Geneid column found in {filenames[0]}")
+
+    # count columns of each file, from the headers only
+    headers = [list(first.columns)] + [list(_read_csv(x, skiprows=skiprows, nrows=0).columns) for x in filenames[1:]]
+    columns = [[x for x in header if x not in annotation] for header in headers]
+    offsets = np.cumsum([0] + [len(x) for x in columns])
+
+    geneids = first["Geneid"]
+    reference = _hash_ids(geneids)
+    counts = np.zeros((len(first), offsets[-1]), dtype=np.int32)
+
+    def fill(i, values):
+        nonlocal counts
+        if not np.issubdtype(values.dtype, np.integer) and counts.dtype != np.float64:
+            counts = counts.astype(np.float64)
+        counts[:, offsets[i] : offsets[i + 1]] = values
+
+    fill(0, first[columns[0]].to_numpy())
+    df = first[annotation]
+    del first
+
+    items = [(filename, cols, skiprows) for filename, cols in zip(filenames[1:], columns[1:])]
+    threads = threads or os.cpu_count() or 1
+    with ThreadPoolExecutor(max(1, min(threads, len(items) or 1))) as executor:
+        for i, (digest, ids, values) in enumerate(executor.map(_read_counts, items), 1):
+            if digest != reference:
+                # same features in another order, otherwise cannot be merged
+                if len(ids) != len(geneids) or set(ids) != set(geneids) or not ids.is_unique:
+                    raise ValueError(f"Features of {filenames[i]} differ from those of {filenames[0]}")
+                values = values[pd.Index(ids).get_indexer(geneids)]
+            fill(i, values)
+
+    df = pd.concat([df, pd.DataFrame(counts, columns=sum(columns, []))], axis=1)
+    if cache is not None:
+        _save_cache(cache, signature, df, annotation)
+    return df
+
+
 def get_most_probable_strand(filenames, tolerance, sample_name):
     """Return most propable strand given 3 feature count files (strand of 0,1, and 2)
 
@@ -276,7 +410,7 @@ class MultiFeatureCount:
 class FeatureCountMerger:
     """Merge several feature counts files"""
 
-    def __init__(self, pattern="*feature.out", fof=[], skiprows=1):
+    def __init__(self, pattern="*feature.out", fof=[], skiprows=1, threads=None, cache=None):
 
         self.skiprows = skiprows
         if len(fof):
@@ -292,10 +426,7 @@ class FeatureCountMerger:
                 logger.critical(f"file x not found")
                 sys.exit(1)
 
-        self.df = pd.read_csv(self.filenames[0], sep="\t", skiprows=self.skiprows)
-        for filename in self.filenames[1:]:
-            other_df = pd.read_csv(filename, sep="\t", skiprows=self.skiprows)
-            self.df = pd.merge(self.df, other_df)
+        self.df = merge_feature_counts(self.filenames, skiprows=self.skiprows, threads=threads, cache=cache)
 
     def to_tsv(self, output_filename="all_features.out"):
         self.df.to_csv(output_filename, sep="\t", index=False)
@@ -445,11 +576,7 @@ class FeatureCount:
 
     def _read_data(self):
         if len(self.filename) > 1:
-            df = pd.read_csv(self.filename[0], sep="\t", comment="#", low_memory=False)
-            for ff in self.filename[1:]:
-                other_df = pd.read_csv(ff, sep="\t", comment="#", low_memory=False)
-                df = pd.merge(df, other_df)
-            df = df.set_index("Geneid")
+            df = merge_feature_counts(self.filename).set_index("Geneid")
         else:
             df = pd.read_csv(self.filename[0], sep="\t", comment="#", index_col=0, low_memory=False)
         self._raw_df = df
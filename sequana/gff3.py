@@ -10,17 +10,32 @@
 #  documentation: http://sequana.readthedocs.io
 #
 ##############################################################################
+import csv
+import hashlib
+import io
+import json
+import mmap
 import os
+import re
 import sys
 from collections import defaultdict
+from itertools import islice
 
 import colorlog
 import natsort
 
 from sequana.errors import BadFileFormat
+from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
 from sequana.lazy import pysam
 
+try:
+    import pyarrow  # noqa: F401
+
+    _HAS_PYARROW = True
+except ImportError:  # pragma: no cover
+    _HAS_PYARROW = False
+
 logger = colorlog.getLogger(__name__)
 
 __all__ = ["GFF3"]
@@ -36,6 +51,27 @@ TEMPLATE = {
     "phase": None,
 }
 
+# key=value pairs (or key value in GTF) with or without quotes. Quoted values
+# may contain semicolons (e.g., MF="GO:0005524;GO:0004004")
+ATTRIBUTE_PATTERN = re.compile(r'(\S+?)[= ](".*?"|[^;]*)(?:;|$)')
+
+# URL-encoded characters decoded in the attributes. We do not convert the
+# special %3B into ; or %20 into spaces for now
+SPECIAL_CHARACTERS = [
+    ("%09", "\t"),
+    ("%0A", "\n"),
+    ("%0D", "\r"),
+    ("%25", "%"),
+    ("%3D", "="),
+    ("%26", "&"),
+    ("%2C", ","),
+    ("%28", "("),
+    ("%29", ")"),
+]
+
+# version of the dataframe stored in the cache
+CACHE_VERSION = 1
+
 
 class GFF3:
     """Read a GFF file, version 3
@@ -71,13 +107,18 @@ class GFF3:
 
     """
 
-    def __init__(self, filename, skip_types=["biological_region"], light=False):
+    def __init__(self, filename, skip_types=["biological_region"], light=False, cache=False):
         """Initialise a GFF3 reader.
 
         :param str filename: path to the GFF3 file to read.
         :param list skip_types: list of feature types to skip while reading.
             Defaults to ``["biological_region"]`` which speeds up parsing of
             large mammalian GFF files.
+        :param cache: if True, the dataframe (see :attr:`df`) is stored in a
+            directory next to the GFF file (GFF name with *.sqcache*
+            extension) so that it is read only once. A directory can also be
+            provided. Entries are keyed on the hash of the file content.
+            Parquet is used if pyarrow is installed, pickle otherwise.
         :raises IOError: if *filename* does not exist.
         """
         self.filename = filename
@@ -92,6 +133,7 @@ class GFF3:
         self._added_CDS = False
         self._directons = None  # a place holder to store directons
         self._light = light
+        self.cache = cache
 
     def _get_features(self):
         """Extract unique GFF feature types
@@ -204,35 +246,175 @@ class GFF3:
         ``start``, ``stop``, ``score``, ``strand``, ``phase``, ``attributes``)
         plus one column per attribute key found in the file.
 
-        The result is cached so subsequent accesses are instantaneous.
+        The result is cached so subsequent accesses are instantaneous. The 9
+        columns are read with the C parser of pandas and the attributes are
+        parsed in bulk (see :meth:`read` to iterate over the records). With
+        the *cache* option, the dataframe is also stored on disk.
         """
         if self._df is not None:
             return self._df
 
-        logger.info("Processing GFF file. 1. Reading the input file. Please be patient")
-        # ~ 30 seconds on mouse
-        df = pd.DataFrame(self.read())
+        if self.cache:
+            cache_filename = self._get_cache_filename()
+            if os.path.exists(cache_filename):
+                self._df = self._read_cache(cache_filename)
+                self._features = set(self._df["genetic_type"])
+                return self._df
 
-        # now, let us populated some common attributes
-        # gene, gene_id, ID, Name
-        if not self._light:
-            try:
-                attrs_df = pd.json_normalize(df["attributes"])
-            except KeyError:
-                raise BadFileFormat
-            df = pd.concat([df, attrs_df], axis=1)
-        else:
-            common = ["gene_id", "ID", "Name"]
-            try:
-                attrs_df = pd.json_normalize(df["attributes"])
-                attrs_df = attrs_df[[c for c in common if c in attrs_df.columns]]
-                df = pd.concat([df, attrs_df], axis=1)
-            except KeyError:
-                raise BadFileFormat
+        logger.info("Processing GFF file. Reading the input file.")
+        df = self._read_dataframe()
+
+        if self.cache:
+            self._write_cache(df, cache_filename)
 
         self._df = df
         return self._df
 
+    def _read_columns(self):
+        # the 9 columns of the records as strings, read with the C parser of
+        # pandas. Same filters as in read()
+        if os.path.getsize(self.filename) == 0:
+            raise BadFileFormat(f"{self.filename} is empty")
+
+        with open(self.filename, "rb") as fin:
+            with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # stop once FASTA starts
+                end = 0 if mm[:7] == b"##FASTA" else mm.find(b"\n##FASTA") + 1
+                source = io.BytesIO(mm[:end]) if end else self.filename
+                df = pd.read_csv(
+                    source,
+                    sep="\t",
+                    header=None,
+                    names=list(range(9)),
+                    dtype=str,
+                    quoting=csv.QUOTE_NONE,
+                    na_filter=False,
+                    on_bad_lines="skip",
+                    engine="c",
+                )
+
+        # skip comments and rows that do not have 9 columns (e.g. fasta sequences)
+        df[8] = df[8].str.strip()
+        keep = (df[8] != "") & ~df[0].str.startswith("#")
+        # skipping biological_region saves lots of time
+        if self.skip_types:
+            keep &= ~df[2].str.strip().isin(self.skip_types)
+        return df[keep].reset_index(drop=True)
+
+    @staticmethod
+    def _convert_column(column, special, converter):
+        # values not in *special* are converted (e.g. float). Mixed columns are
+        # kept as objects as in a dataframe built from records.
+        is_special = column.isin(special)
+        if is_special.all():
+            return column
+        if not is_special.any():
+            return converter(column)
+        column = column.astype(object)
+        column[~is_special] = converter(column[~is_special]).astype(object)
+        return column
+
+    def _read_dataframe(self):
+        """Vectorised equivalent of pd.DataFrame(self.read()) + attributes columns"""
+        data = self._read_columns()
+        if len(data) == 0:
+            raise BadFileFormat(f"No valid GFF records found in {self.filename}")
+
+        df = pd.DataFrame(
+            {
+                "seqid": data[0],
+                "source": data[1],
+                "genetic_type": data[2],
+                "start": data[3].astype(int),
+                "stop": data[4].astype(int),
+                "score": self._convert_column(data[5], {".", "?"}, lambda x: x.astype(float)),
+                "strand": data[6].where(data[6].isin({"+", "-", ".", "?"}), None),
+                "phase": self._convert_column(data[7], {"."}, lambda x: x.astype(int) % 3),
+            }
+        )
+        self._features = set(df["genetic_type"])
+
+        # attributes are decoded on the whole column at once
+        texts = data[8].tolist()
+        invalid = next((text for text in texts if "=" not in text and " " not in text), None)
+        if invalid is not None:
+            logger.error(f"Your GFF/GTF does not seem to be correct ({invalid}). Expected a = or space as separator")
+            sys.exit(1)
+        text = "\0".join(texts)
+        if "%" in text:
+            for code, character in SPECIAL_CHARACTERS:
+                if code in text:
+                    text = text.replace(code, character)
+            texts = text.split("\0")
+
+        # key/value pairs of all records, flattened
+        findall = ATTRIBUTE_PATTERN.findall
+        matches = [findall(text) for text in texts]
+        counts = [len(match) for match in matches]
+        keys = [key for match in matches for key, _ in match]
+        values = [value for match in matches for _, value in match]
+
+        if '"' in text:
+            # Remove quotes around the values
+            values = [value.strip('"') for value in values]
+            pairs = zip(keys, values)
+            df["attributes"] = [dict(islice(pairs, count)) for count in counts]
+        else:
+            df["attributes"] = [dict(match) for match in matches]
+
+        # now, let us populated some common attributes
+        # gene, gene_id, ID, Name. One column per attribute in order of
+        # appearance (as json_normalize)
+        codes, names = pd.factorize(np.array(keys, dtype=object))
+        table = np.full((len(df), len(names)), np.nan, dtype=object)
+        table[np.repeat(np.arange(len(df)), counts), codes] = np.array(values, dtype=object)
+        attrs_df = pd.DataFrame({name: table[:, i] for i, name in enumerate(names)}, index=df.index)
+
+        if self._light:
+            common = ["gene_id", "ID", "Name"]
+            attrs_df = attrs_df[[c for c in common if c in attrs_df.columns]]
+        return pd.concat([df, attrs_df], axis=1)
+
+    def _get_cache_filename(self):
+        checksum = hashlib.md5()
+        with open(self.filename, "rb") as fin:
+            for block in iter(lambda: fin.read(2**24), b""):
+                checksum.update(block)
+        # reading options change the dataframe
+        checksum.update(repr((sorted(self.skip_types), self._light, CACHE_VERSION)).encode())
+
+        directory = f"{self.filename}.sqcache" if self.cache is True else str(self.cache)
+        extension = "parquet" if _HAS_PYARROW else "pkl"
+        return os.path.join(directory, f"gff3_{checksum.hexdigest()}.{extension}")
+
+    def _write_cache(self, df, filename):
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            if filename.endswith(".pkl"):
+                df.to_pickle(filename)
+            else:
+                # parquet cannot store dictionaries and mixed types
+                df = df.copy()
+                df["attributes"] = [json.dumps(x) for x in df["attributes"]]
+                df["score"] = df["score"].astype(str)
+                df["phase"] = df["phase"].astype(str)
+                df.to_parquet(filename)
+        except OSError as err:  # pragma: no cover
+            logger.warning(f"Could not save GFF cache in {filename}: {err}")
+
+    def _read_cache(self, filename):
+        if filename.endswith(".pkl"):
+            return pd.read_pickle(filename)
+
+        df = pd.read_parquet(filename)
+        df["attributes"] = [json.loads(x) for x in df["attributes"]]
+        df["score"] = self._convert_column(df["score"], {".", "?"}, lambda x: x.astype(float))
+        df["phase"] = self._convert_column(df["phase"], {"."}, lambda x: x.astype(float).astype(int))
+        # missing attributes are None in parquet
+        columns = df.columns[9:]
+        df[columns] = df[columns].where(df[columns].notna(), np.nan)
+        return df
+
     df = property(_get_df)
 
     def get_duplicated_attributes_per_genetic_type(self):
@@ -669,44 +851,11 @@ class GFF3:
             logger.error(f"Your GFF/GTF does not seem to be correct ({text}). Expected a = or space as separator")
             sys.exit(1)
 
-        # ugly but fast replacement of special characters.
-        text = text.replace("%09", "\t").replace("%0A", "\n").replace("%0D", "\r")
-        text = text.replace("%25", "%").replace("%3D", "=").replace("%26", "&").replace("%2C", ",")
-        text = text.replace("%28", "(").replace("%29", ")")  # brackets
-        # we do not convert the special %3B into ;  or %20 into spaces for now
-
-        import re
-
-        def parse_gff_attributes(attributes, sep="="):
-            """parse attributes so handle
-
-            Quoted values (e.g., key="value")
-            Unquoted values (e.g., key=value)
-            Empty values (e.g., key="")
-            Values with semicolons (e.g., MF="GO:0005524;GO:0004004")
-            """
-            # Regular expression to match key=value pairs with or without quotes
-
-            pattern = re.compile(r'(\S+?)[= ](".*?"|[^;]*)(?:;|$)')
-
-            # Dictionary to store parsed attributes
-            parsed_attributes = {}
-
-            # Find all matches for key=value pairs
-            matches = pattern.findall(attributes)
-
-            # Populate dictionary with matches
-            for key, value in matches:
-                # Remove quotes around the value if present
-                value = value.strip('"')
-                parsed_attributes[key] = value
-
-            return parsed_attributes
-
-        return parse_gff_attributes(text)
+        for code, character in SPECIAL_CHARACTERS:
+            text = text.replace(code, character)
 
-        # replace " by nothing (GTF case)
-        # attributes[attr[:idx]] = value.replace('"', "").replace("%3B", ";").replace("%20", " ")
+        # Remove quotes around the value if present
+        return {key: value.strip('"') for key, value in ATTRIBUTE_PATTERN.findall(text)}
 
     def to_gtf(self, output_filename="test.gtf", mapper={"ID": "{}_id"}):
         """Convert the GFF3 file to GTF format (experimental).
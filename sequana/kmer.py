@@ -10,13 +10,37 @@
 #  documentation: http://sequana.readthedocs.io
 #
 ##############################################################################
+"""Utilities related to k-mers
+
+K-mers can be counted with :class:`KmerCounter`. Sequences are encoded with 2
+bits per base (A=0, C=1, G=2, T=3) so that a k-mer (k <= 31) is stored as an
+integer. K-mers are counted with :func:`numpy.bincount` for k <= 12 and in a
+hash table for longer k-mers::
+
+    from sequana.kmer import KmerCounter
+
+    counter = KmerCounter(k=7, canonical=True)
+    counter.update("ACGTTGCAAACGT")
+    counter.to_series()
+
+"""
 import itertools
 
 import colorlog
 
+from sequana.lazy import numpy as np
+from sequana.lazy import pandas as pd
+
 logger = colorlog.getLogger(__name__)
 
 
+__all__ = ["build_kmer", "get_kmer", "encode_kmers", "decode_kmers", "count_kmer_occurrences", "KmerCounter"]
+
+
+# largest k-mer counted with bincount (4**12 counters)
+MAX_BINCOUNT_K = 12
+
+
 def build_kmer(length=6, letters="CG"):
     """Return list of kmer of given length based on a set of letters
 
@@ -37,3 +61,217 @@ def get_kmer(sequence, k=7):
     """
     for i in range(0, len(sequence) - k + 1):
         yield sequence[i : i + k]
+
+
+def _encode_bases(sequence):
+    # 2-bit codes of each base; 4 for letters other than ACGT (case insensitive)
+    if isinstance(sequence, str):
+        sequence = sequence.encode()
+    table = np.full(256, 4, dtype=np.uint8)
+    for code, letters in enumerate((b"Aa", b"Cc", b"Gg", b"Tt")):
+        for letter in letters:
+            table[letter] = code
+    return table[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def _pack(codes, k):
+    # k-mers of the 2-bit codes as integers, built from shorter k-mers:
+    # a (m + n)-mer is (m-mer << 2n) | n-mer (binary decomposition of k)
+    result, length = None, 0
+    block, size = codes.astype(np.int64), 1
+    while k:
+        if k & 1:
+            if result is None:
+                result, length = block, size
+            else:
+                result = (result[: len(block) - length] << (2 * size)) | block[length:]
+                length += size
+        k >>= 1
+        if k:
+            block = (block[:-size] << (2 * size)) | block[size:]
+            size *= 2
+    return result
+
+
+def encode_kmers(sequence, k=7, canonical=False, lengths=None):
+    """Return the valid k-mers of a sequence as integers (2 bits per base)
+
+    :param sequence: a string, bytes or uint8 array (ASCII letters)
+    :param int k: length of the k-mers (at most 31)
+    :param bool canonical: return the smallest of the k-mer and its reverse
+        complement
+    :param lengths: if the sequence is made of several concatenated reads,
+        their lengths. K-mers overlapping two reads are ignored.
+    :return: array of int64. K-mers with letters other than ACGT are ignored.
+
+    ::
+
+        >>> encode_kmers("ACGTA", k=3)
+        array([ 6, 27, 44])
+
+    """
+    kmers, valid = _encode_kmers(sequence, k, canonical=canonical, lengths=lengths)
+    return kmers[valid]
+
+
+def _encode_kmers(sequence, k, canonical=False, lengths=None):
+    # all k-mers (one per position) and a mask of the valid ones
+    if not 0 < k <= 31:
+        raise ValueError(f"k must be between 1 and 31. Got {k}")
+    if isinstance(sequence, np.ndarray):
+        sequence = sequence.astype(np.uint8, copy=False).tobytes()
+    codes = _encode_bases(sequence)
+    if len(codes) < k:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+
+    kmers = _pack(codes, k)
+    if canonical:
+        reverse = _pack(3 - codes[::-1], k)[::-1]
+        # letters other than ACGT are not complemented but filtered below
+        np.minimum(kmers, reverse, out=kmers)
+
+    # k-mers without invalid letters and within a single read
+    invalid = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(codes == 4, out=invalid[1:])
+    valid = invalid[k:] == invalid[:-k]
+    if lengths is not None:
+        lengths = np.asarray(lengths, dtype=np.int64)
+        nkmers = np.clip(lengths - k + 1, 0, None)
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(nkmers.sum()) + np.repeat(offsets - np.cumsum(nkmers) + nkmers, nkmers)
+        within = np.zeros(len(valid), dtype=bool)
+        within[positions] = True
+        valid &= within
+    return kmers, valid
+
+
+def count_kmer_occurrences(sequence, kmers, lengths=None):
+    """Return the number of occurrences of a set of k-mers in each read
+
+    :param sequence: a string, bytes or uint8 array (see :func:`encode_kmers`)
+    :param kmers: list of k-mers of the same length
+    :param lengths: lengths of the concatenated reads (one read by default)
+    :return: array of counts (one per read). Overlapping occurrences are
+        counted.
+
+    The sequence is scanned once whatever the number of k-mers::
+
+        >>> count_kmer_occurrences("AACCCTAACCCTAA", ["AACCCT", "ACCCTA"])
+        array([4])
+
+    """
+    k = len(kmers[0])
+    if any(len(x) != k for x in kmers):
+        raise ValueError("k-mers must have the same length")
+    targets = np.unique(np.concatenate([encode_kmers(x, k) for x in kmers]))
+
+    codes, valid = _encode_kmers(sequence, k, lengths=lengths)
+    if k <= MAX_BINCOUNT_K:
+        table = np.zeros(4**k, dtype=bool)
+        table[targets] = True
+        # k-mers with invalid letters may be out of range (masked anyway)
+        valid &= table[codes & (4**k - 1)]
+    else:
+        valid &= np.isin(codes, targets)
+
+    if lengths is None:
+        return np.array([valid.sum()])
+    lengths = np.asarray(lengths, dtype=np.int64)
+    # read of the first base of each k-mer
+    reads = np.repeat(np.arange(len(lengths)), lengths)[: len(valid)]
+    return np.bincount(reads[valid], minlength=len(lengths))
+
+
+def decode_kmers(kmers, k=7):
+    """Convert k-mers encoded by :func:`encode_kmers` into strings
+
+    ::
+
+        >>> decode_kmers([6, 27, 44], k=3)
+        ['ACG', 'CGT', 'GTA']
+
+    """
+    kmers = np.asarray(kmers, dtype=np.int64)
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.int64)
+    letters = np.frombuffer(b"ACGT", dtype=np.uint8)[(kmers[:, None] >> shifts) & 3]
+    return np.ascontiguousarray(letters).view(f"S{k}").ravel().astype(str).tolist()
+
+
+class KmerCounter(object):
+    """Count k-mers of sequences or FASTQ batches
+
+    ::
+
+        from sequana import FastQ
+        from sequana.kmer import KmerCounter
+
+        counter = KmerCounter(k=7)
+        for batch in FastQ("test.fastq.gz").iter_batches():
+            counter.update_batch(batch)
+        ts = counter.to_series()
+
+    K-mers with letters other than ACGT are ignored. With *canonical* set to
+    True, a k-mer and its reverse complement are counted together (the
+    smallest in lexicographic order is reported).
+    """
+
+    # number of pending (k-mer, count) pairs merged at once for k > MAX_BINCOUNT_K
+    _merge_size = 2**22
+
+    def __init__(self, k=7, canonical=False):
+        if not 0 < k <= 31:
+            raise ValueError(f"k must be between 1 and 31. Got {k}")
+        self.k = k
+        self.canonical = canonical
+        if k <= MAX_BINCOUNT_K:
+            self._counts = np.zeros(4**k, dtype=np.int64)
+        else:
+            # sorted unique k-mers and their counts; the k-mers counted in
+            # each batch are kept aside and merged by blocks
+            self._counts = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+            self._pending = []
+            self._pending_size = 0
+
+    def _add(self, kmers):
+        if isinstance(self._counts, tuple):
+            if len(kmers):
+                self._pending.append(np.unique(kmers, return_counts=True))
+                self._pending_size += len(self._pending[-1][0])
+                if self._pending_size > max(self._merge_size, len(self._counts[0])):
+                    self._merge()
+        elif len(kmers):
+            self._counts += np.bincount(kmers, minlength=len(self._counts))
+
+    def _merge(self):
+        # merge the counts of the pending batches into the sorted counts
+        if not self._pending:
+            return
+        kmers = np.concatenate([self._counts[0]] + [x[0] for x in self._pending])
+        counts = np.concatenate([self._counts[1]] + [x[1] for x in self._pending])
+        kmers, inverse = np.unique(kmers, return_inverse=True)
+        self._counts = (kmers, np.bincount(inverse.ravel(), weights=counts, minlength=len(kmers)).astype(np.int64))
+        self._pending = []
+        self._pending_size = 0
+
+    def update(self, sequence, lengths=None):
+        """Count the k-mers of a sequence (see :func:`encode_kmers`)"""
+        self._add(encode_kmers(sequence, self.k, canonical=self.canonical, lengths=lengths))
+
+    def update_batch(self, batch):
+        """Count the k-mers of a :class:`~sequana.fastq.FastQBatch`"""
+        self.update(batch.sequences, lengths=batch.lengths)
+
+    def get_counts(self):
+        """Return encoded k-mers and their counts (non-zero counts only)"""
+        if isinstance(self._counts, tuple):
+            self._merge()
+            return self._counts
+        kmers = np.flatnonzero(self._counts)
+        return kmers, self._counts[kmers]
+
+    def to_series(self):
+        """Return a Series with k-mers as index and counts as values (sorted by decreasing counts)"""
+        kmers, counts = self.get_counts()
+        ts = pd.Series(counts, index=decode_kmers(kmers, self.k), dtype=int)
+        ts.sort_values(inplace=True, ascending=False)
+        return ts
@@ -10,6 +10,7 @@
 #  documentation: http://sequana.readthedocs.io
 #
 ##############################################################################
+import json
 import os
 import shutil
 import sys
@@ -67,6 +68,87 @@ class KrakenDB:
         return self.name
 
 
+def _add_counts(total, counts):
+    # sum two bincount arrays of different lengths
+    if len(counts) > len(total):
+        total, counts = counts.astype(np.int64), total
+    total[: len(counts)] += counts
+    return total
+
+
+class KrakenReadsCache:
+    """Columnar on-disk cache of the reads of a kraken output file
+
+    The status (C/U), taxon and read length of each read are appended chunk
+    by chunk to binary files (uint8, int32, int32) stored in a directory next
+    to the kraken file (*.sqcache* extension). They are memory-mapped when
+    read back. For paired data, only the length of the first read is kept.
+    The cache is ignored as soon as the kraken file changes.
+
+    ::
+
+        cache = KrakenReadsCache("kraken.out")
+        if cache.is_valid():
+            df = cache.read()
+
+    """
+
+    version = 1
+    status = ["C", "U"]
+    columns = {"status": "uint8", "taxon": "int32", "length": "int32"}
+
+    def __init__(self, filename):
+        self.filename = str(filename)
+        self.directory = f"{filename}.sqcache"
+        self.index_filename = os.path.join(self.directory, "kraken_reads.json")
+
+    def _get_filename(self, column):
+        return os.path.join(self.directory, f"kraken_{column}.bin")
+
+    def _get_signature(self):
+        st = os.stat(self.filename)
+        return {"mtime": st.st_mtime_ns, "size": st.st_size, "version": self.version}
+
+    def is_valid(self):
+        try:
+            with open(self.index_filename, "r") as fin:
+                return json.load(fin) == self._get_signature()
+        except (OSError, ValueError):
+            return False
+
+    def open(self):
+        """Open the cache for writing (existing data is removed)"""
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.index_filename):
+            os.remove(self.index_filename)
+        self._streams = {column: open(self._get_filename(column), "wb") for column in self.columns}
+
+    def append(self, status, taxon, length):
+        """Append a chunk of reads; *status* are codes of :attr:`status`"""
+        for column, values in zip(self.columns, (status, taxon, length)):
+            np.asarray(values, dtype=self.columns[column]).tofile(self._streams[column])
+
+    def close(self, complete=True):
+        """Close the files; the cache is valid only if *complete* is True"""
+        for stream in self._streams.values():
+            stream.close()
+        if complete:
+            with open(self.index_filename, "w") as fout:
+                json.dump(self._get_signature(), fout)
+
+    def read(self):
+        """Return the reads as a dataframe (status is categorical)"""
+        data = {}
+        for column, dtype in self.columns.items():
+            filename = self._get_filename(column)
+            if os.path.getsize(filename):
+                data[column] = np.memmap(filename, dtype=dtype, mode="r")
+            else:
+                data[column] = np.array([], dtype=dtype)
+        data["status"] = pd.Categorical.from_codes(data["status"], categories=self.status)
+        return pd.DataFrame(data)
+
+
 class KrakenResults:
     """Translate Kraken results into a Krona-compatible file
 
@@ -116,13 +198,22 @@ class KrakenResults:
 
     """
 
-    def __init__(self, filename="kraken.out", verbose=True, mode="ncbi"):
+    def __init__(self, filename="kraken.out", verbose=True, mode="ncbi", streaming=False, cache=False):
         """.. rubric:: **constructor**
 
         :param filename: the input from KrakenAnalysis class
+        :param bool streaming: do not keep the reads in memory. Taxon counts,
+            classified/unclassified totals and read length histograms are
+            computed chunk by chunk. :attr:`df` is then read from the cache
+            (if available) or from the input file when required.
+        :param bool cache: store the reads in a columnar cache next to the
+            input file (see :class:`KrakenReadsCache`). Subsequent instances
+            read the cache instead of parsing the input file.
 
         """
         self.filename = filename
+        self.streaming = streaming
+        self.cache = cache
 
         on_rtd = os.environ.get("READTHEDOCS", None) == "True"
 
@@ -186,7 +277,7 @@ class KrakenResults:
         if isinstance(ids, list) is False:
             ids = [ids]
 
-        lineage = [self.tax.get_lineage_and_rank(x) for x in ids]
+        lineage = self.tax.get_lineages_and_ranks(ids)
         # Now, we filter each lineage to keep only relevant ranks
         # There are a few caveats though as explained hereafter
 
@@ -251,76 +342,107 @@ class KrakenResults:
 
         return df
 
-    def _parse_data(self):
-        taxonomy = {}
+    def _read_chunks(self):
+        # we select only col 0,2,3 to save memory, which is required on very
+        # large files. Chunks of 1M reads are reasonable in memory
+        return pd.read_csv(
+            self.filename,
+            sep="\t",
+            header=None,
+            usecols=[0, 2, 3],
+            names=["status", "taxon", "length"],
+            dtype={"status": "category"},
+            chunksize=1000000,
+        )
+
+    @staticmethod
+    def _get_lengths(lengths):
+        # if paired and kraken2, there are | in length to separate both reads.
+        # to simplify, if this is the case, we just take the first read length
+        if lengths.dtype.kind in "iu":
+            return lengths.values
+        return lengths.astype(str).str.split("|", n=1).str[0].astype(int).values
 
+    def _parse_data(self):
         logger.info("Reading kraken data from {}".format(self.filename))
         columns = ["status", "taxon", "length"]
-        # we select only col 0,2,3 to save memory, which is required on very
-        # large files
-
-        try:
-            # each call to concat in the for loop below
-            # will take time and increase with chunk position.
-            # for 15M reads, this has a big cost. So chunksize set to 1M
-            # is better than 1000 and still reasonable in memory
-            reader = pd.read_csv(
-                self.filename,
-                sep="\t",
-                header=None,
-                usecols=[0, 2, 3],
-                chunksize=1000000,
-            )
-        except (pd.errors.EmptyDataError, FileNotFoundError):  # pragma: no cover
-            logger.warning("Empty files. 100%% unclassified ?")
-            self.unclassified = 0  # size of the input data set
-            self.classified = 0
-            self._df = pd.DataFrame([], columns=columns)
-            self._taxons = self._df.taxon
-            return
-        except pd.errors.ParserError:
-            # raise NotImplementedError  # this section is for the case
-            #    #only_classified_output when there is no found classified read
-            raise NotImplementedError
 
-        for chunk in reader:
+        self._df = pd.DataFrame([], columns=columns)
+        self._taxons = self._df.taxon
+        self.classified = 0
+        self.unclassified = 0
+        self.length_histograms = {"C": np.zeros(0, dtype=np.int64), "U": np.zeros(0, dtype=np.int64)}
+
+        cache = KrakenReadsCache(self.filename) if self.cache else None
+        writer = None
+        if cache is not None and cache.is_valid():
+            logger.info(f"Reading kraken reads from {cache.directory}")
+            chunks = [cache.read()]
+        else:
             try:
-                self._df
-                self._df = pd.concat([self._df, chunk])
-            except AttributeError:
-                self._df = chunk
-
-        self._df.columns = columns
-
-        count = sum(self._df.taxon == 1)
-        percentage = count / len(self._df) * 100
-        if percentage >= 1:
-            logger.warning(
-                "Found {} taxons of classified reads with root ID (1) ({} %)".format(count, round(percentage, 2))
-            )
-
-        # This gives the list of taxons as index and their amount
-        # above, we select only columns 0, 2, 3  the column are still labelled
-        # 0, 2, 3 in the df
-        self._taxons = self._df.groupby("taxon").size()
+                chunks = self._read_chunks()
+            except (pd.errors.EmptyDataError, FileNotFoundError):  # pragma: no cover
+                logger.warning("Empty files. 100%% unclassified ?")
+                return
+            except pd.errors.ParserError:
+                # raise NotImplementedError  # this section is for the case
+                #    #only_classified_output when there is no found classified read
+                raise NotImplementedError
+            if cache is not None:
+                writer = cache
+                writer.open()
+
+        # counts are accumulated chunk by chunk so that reads need not be kept
+        counts = np.zeros(0, dtype=np.int64)
+        histograms = {"C": np.zeros(0, dtype=np.int64), "U": np.zeros(0, dtype=np.int64)}
+        frames = []
         try:
-            self._taxons.drop(0, inplace=True)
-        except:
-            pass  # 0 may not be there
+            for chunk in chunks:
+                taxon = chunk["taxon"].values.astype(np.int64)
+                lengths = self._get_lengths(chunk["length"])
+                status = np.asarray(chunk["status"].astype(str))
+
+                counts = _add_counts(counts, np.bincount(taxon))
+                for key in histograms:
+                    histograms[key] = _add_counts(histograms[key], np.bincount(lengths[status == key]))
+
+                if writer is not None:
+                    writer.append(np.where(status == "C", 0, 1), taxon, lengths)
+                if not self.streaming:
+                    frames.append(chunk)
+        except Exception:
+            if writer is not None:
+                writer.close(complete=False)
+            raise
+        if writer is not None:
+            writer.close()
+
+        self.length_histograms = histograms
+        self.classified = int(self.length_histograms["C"].sum())
+        self.unclassified = int(self.length_histograms["U"].sum())
+
+        if frames:
+            self._df = pd.concat(frames, ignore_index=True)
+            # chunks may have different categories
+            self._df["status"] = self._df["status"].astype("category")
+        elif self.streaming:
+            del self._df
+
+        total = self.classified + self.unclassified
+        if total and len(counts) > 1:
+            percentage = counts[1] / total * 100
+            if percentage >= 1:
+                logger.warning(
+                    "Found {} taxons of classified reads with root ID (1) ({} %)".format(counts[1], round(percentage, 2))
+                )
+
+        # This gives the list of taxons as index and their amount (taxon 0 is
+        # the unclassified)
+        taxons = np.flatnonzero(counts)
+        taxons = taxons[taxons != 0]
+        self._taxons = pd.Series(counts[taxons], index=pd.Index(taxons, name="taxon"))
         self._taxons.sort_values(ascending=False, inplace=True)
 
-        category = self.df.groupby("status").size()
-
-        if "C" in category.index:
-            self.classified = category["C"]
-        else:
-            self.classified = 0
-
-        if "U" in category.index:
-            self.unclassified = category["U"]
-        else:
-            self.unclassified = 0
-
         logger.debug(self.taxons.iloc[0:10])
 
     def _get_taxons(self):
@@ -335,9 +457,20 @@ class KrakenResults:
     def _get_df(self):
         try:
             return self._df
-        except:
+        except AttributeError:
+            pass
+
+        if not hasattr(self, "_taxons"):
             self._parse_data()
-            return self._df
+            if hasattr(self, "_df"):
+                return self._df
+
+        # streaming mode: reads are not kept in memory
+        cache = KrakenReadsCache(self.filename)
+        if cache.is_valid():
+            return cache.read()
+        logger.info("Reading all reads from {}".format(self.filename))
+        return pd.concat(self._read_chunks(), ignore_index=True)
 
     df = property(_get_df)
 
@@ -586,7 +719,7 @@ class KrakenResults:
         .. todo:: For a future release, we could use this kind of plot
             https://stackoverflow.com/questions/57720935/how-to-use-correct-cmap-colors-in-nested-pie-chart-in-matplotlib
         """
-        if len(self._df) == 0:
+        if self.classified + self.unclassified == 0:
             return
 
         if self._data_created == False:
@@ -665,37 +798,79 @@ class KrakenResults:
             status = self.kraken_to_krona()
         shell("ktImportText %s -o %s" % (self.output_filename, output))
 
+    def _get_length_stats(self):
+        # boxplot statistics computed from the read length histograms
+        stats = []
+        for status, histogram in sorted(self.length_histograms.items()):
+            if histogram.sum() == 0:
+                continue
+            cumsum = np.cumsum(histogram) / histogram.sum()
+            q1, med, q3 = np.searchsorted(cumsum, [0.25, 0.5, 0.75])
+            lengths = np.flatnonzero(histogram)
+            iqr = q3 - q1
+            inside = lengths[(lengths >= q1 - 1.5 * iqr) & (lengths <= q3 + 1.5 * iqr)]
+            stats.append(
+                {
+                    "label": status,
+                    "q1": q1,
+                    "med": med,
+                    "q3": q3,
+                    "whislo": inside.min(),
+                    "whishi": inside.max(),
+                    "fliers": lengths[(lengths < inside.min()) | (lengths > inside.max())],
+                }
+            )
+        return stats
+
     def boxplot_classified_vs_read_length(self):
-        """Show distribution of the read length grouped by classified or not"""
+        """Show distribution of the read length grouped by classified or not
+
+        In streaming mode, the boxplot is computed from the length histograms
+        (:attr:`length_histograms`) and the statistics are returned.
+        """
+        if self.streaming:
+            self.taxons  # make sure data is parsed
+            stats = self._get_length_stats()
+            pylab.clf()
+            pylab.gca().bxp(stats)
+            return stats
 
         # if paired and kraken2, there are | in length to separate both reads.
         # to simplify, if this is the case, we will just take the first read
         # length for now.
         df = self.df.copy()
-
-        try:  # kraken2
-            df.length = df.length.apply(lambda x: int(x.split("|")[0]))
-        except:
-            pass
+        df["length"] = self._get_lengths(df["length"])
 
         df[["status", "length"]].groupby("status").boxplot()
 
         return df
 
     def histo_classified_vs_read_length(self):
-        """Show distribution of the read length grouped by classified or not"""
+        """Show distribution of the read length grouped by classified or not
 
-        # if paired and kraken2, there are | in length to separate both reads.
-        # to simplify, if this is the case, we will just take the first read
-        # length for now.
-        df = self.df.copy()
+        In streaming mode, the histograms are computed while reading the data
+        and the dataframe of counts (length versus status) is returned.
+        """
+        if self.streaming:
+            self.taxons  # make sure data is parsed
+            M = max(len(x) for x in self.length_histograms.values())
+            df = pd.DataFrame({k: np.pad(v, (0, M - len(v))) for k, v in self.length_histograms.items()})
+            bins = pylab.linspace(0, M, max(int(M / 5), 2))
+            fig, axes = pylab.subplots(1, 2, sharey=True)
+            for ax, status in zip(axes, ["C", "U"]):
+                ax.hist(df.index, bins=bins, weights=df[status])
+                ax.set_title(status)
+        else:
+            # if paired and kraken2, there are | in length to separate both reads.
+            # to simplify, if this is the case, we will just take the first read
+            # length for now.
+            df = self.df.copy()
+            df["length"] = self._get_lengths(df["length"])
 
-        if "|" in str(df.length.values[0]):
-            df.length = df.length.apply(lambda x: int(x.split("|")[0]))
+            df = df[["status", "length"]]
+            M = df["length"].max()
+            df.hist(by="status", sharey=True, bins=pylab.linspace(0, M, int(M / 5)))
 
-        df = df[["status", "length"]]
-        M = df["length"].max()
-        df.hist(by="status", sharey=True, bins=pylab.linspace(0, M, int(M / 5)))
         axes = pylab.gcf().get_axes()
         axes[0].set_xlabel("read length")
         axes[1].set_xlabel("read length")
@@ -10,9 +10,11 @@
 #  documentation: http://sequana.readthedocs.io
 #
 ##############################################################################
+import csv
 import os
 import shutil
 import sys
+from itertools import zip_longest
 from pathlib import Path, PosixPath
 
 import colorlog
@@ -251,172 +253,170 @@ class KrakenConsensus(object):
         return summary
 
 
-from functools import lru_cache
+def searchLCA(taxids, taxonomy, buffer={}):
+    """Return the lowest common ancestor of a tuple of taxons
 
-from easydev import do_profile
-
-
-# @lru_cache(maxsize=32)
-def searchLCA(taxids, taxonomy_file, buffer={}):
+    :param taxids: tuple of taxons (strings or integers)
+    :param taxonomy: a :class:`~sequana.taxonomy.TaxonomyIndex`. A dataframe
+        such as :attr:`sequana.taxonomy.Taxonomy.records` is also accepted
+        but the index is then built for each call.
+    :param buffer: dictionary used to store results of previous calls
+    :return: the LCA or -1 if none of the taxons were found
+    """
+    from sequana.taxonomy import TaxonomyIndex
 
     if taxids in buffer:
         return buffer[taxids]
 
-    obsolets = {1513193: 2748961, 35306: 3052441}
-    # taxonomy_file.update(obsolets)
-    IDs = taxids
-
-    taxids = [int(x) for x in taxids]
-    # TODO. handle unknown IDs
-    try:
-        parents = taxonomy_file.loc[taxids].parent.values
-    except:
-        parents = []
+    if not isinstance(taxonomy, TaxonomyIndex):
+        taxonomy = TaxonomyIndex.from_records(taxonomy)
 
-    if len(parents) == 0:
+    taxid = taxonomy.lca_reduce([int(x) for x in taxids])
+    if taxid == -1:
         logger.warning(f"the taxids {taxids} were not found")
-        buffer[IDs] = -1
-        return -1
-    elif len(parents) == 1:
-        buffer[IDs] = parents.index[0]
-        return parents.index[0]
-    else:
-        taxid = "1"
-        LCA_found = False
-        while not LCA_found:
-            if len(set(parents)) == 1:
-                LCA_found = True
-                taxid = list(parents)[0]
-                break
-            else:
-                parents = taxonomy_file.loc[parents].parent.values
+    buffer[taxids] = taxid
+    return taxid
 
-        if taxid == 1:
-            # print("no LCA found for these taxids:", taxids)
-            buffer[IDs] = 1
-            return 1
-        else:
-            buffer[IDs] = taxid
-            return taxid
 
+_COLUMNS = ["status", "read", "taxon", "length", "kmers"]
 
-def build_consensus(inputs, output):
+# taxonomy index used by the worker processes of build_consensus
+_worker_index = None
 
-    import glob
-    from collections import defaultdict
 
-    from sequana.taxonomy import Taxonomy
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
 
-    tax = Taxonomy(verbose=True)
-    tax.load_records()
 
-    def find_best_hit(kmer_totals):
-        """Find the k-mer key with the highest total value."""
-        best_hit_key = 0
-        best_hit_value = 0
+def _read_kraken_chunks(filenames, chunksize):
+    # read all kraken outputs by aligned blocks of reads
+    readers = [
+        pd.read_csv(
+            filename,
+            sep="\t",
+            header=None,
+            names=_COLUMNS,
+            dtype={"status": str, "read": str, "taxon": np.int64, "length": str, "kmers": str},
+            keep_default_na=False,
+            quoting=csv.QUOTE_NONE,
+            chunksize=chunksize,
+        )
+        for filename in filenames
+    ]
+    for chunks in zip_longest(*readers):
+        if any(chunk is None for chunk in chunks) or len(set(len(chunk) for chunk in chunks)) != 1:
+            raise ValueError("kraken outputs do not have the same number of reads")
+        reads = chunks[0]["read"].to_numpy()
+        if any((chunk["read"].to_numpy() != reads).any() for chunk in chunks[1:]):
+            raise ValueError("kraken outputs do not have the same reads in the same order")
+        yield chunks
+
+
+def consensus_taxons(status, taxons, index):
+    """Return the consensus of the classification of reads by several databases
+
+    :param status: 2D array of booleans (reads x databases); True if the read
+        is classified by the database
+    :param taxons: 2D array of taxons (reads x databases)
+    :param index: a :class:`~sequana.taxonomy.TaxonomyIndex`
+    :return: array of taxons, one per read. 0 for unclassified reads. Reads
+        classified with a single taxon keep it; otherwise the lowest common
+        ancestor of the taxons is returned (unknown taxons are ignored; -1 if
+        none is known).
+    """
+    taxons = np.where(status, taxons, 0)
+    first = taxons.max(axis=1)
+    # reads with a single taxon (possibly found by several databases)
+    single = ((taxons == 0) | (taxons == first[:, None])).all(axis=1)
+
+    result = first.copy()
+    multi = np.flatnonzero(~single)
+    if len(multi) == 0:
+        return result
+
+    # batched LCA of the reads with several taxons, one database at a time
+    candidates = taxons[multi]
+    candidates[index.get_parent(candidates.ravel()).reshape(candidates.shape) < 0] = 0
+    lca = np.zeros(len(multi), dtype=np.int64)
+    for column in candidates.T:
+        found = column != 0
+        both = found & (lca > 0)
+        lca[both] = index.lca(lca[both], column[both])
+        start = found & (lca == 0)
+        lca[start] = column[start]
+    # no known taxon
+    lca[lca == 0] = -1
+    result[multi] = lca
+    return result
+
+
+def _merge_chunks(chunks, index=None):
+    # merge aligned chunks of kraken outputs into kraken formatted lines
+    index = index if index is not None else _worker_index
+
+    status = np.column_stack([chunk["status"].values == "C" for chunk in chunks])
+    taxons = np.column_stack([chunk["taxon"].values for chunk in chunks])
+    consensus = consensus_taxons(status, taxons, index)
+
+    # k-mers of all databases; paired data have left and right k-mers
+    last = chunks[-1]
+    kmers = [chunk["kmers"].str.partition("|:|") for chunk in chunks]
+    left = kmers[0][0].str.strip()
+    right = kmers[0][2].str.strip()
+    for kmer in kmers[1:]:
+        left = left + " " + kmer[0].str.strip()
+        right = right + " " + kmer[2].str.strip()
+    if (kmers[0][1] == "|:|").any():
+        kmers = left + " |:| " + right
+    else:
+        kmers = left
 
-        for key, value in kmer_totals.items():
-            # 'if key' means that key==0 are ignored.
-            if key not in ["0", 0] and value > best_hit_value:
-                best_hit_key = key
-                best_hit_value = value
+    classified = np.where(status.any(axis=1), "C", "U")
+    lines = classified + "\t" + last["read"] + "\t" + consensus.astype(str) + "\t" + last["length"] + "\t" + kmers
+    return "\n".join(lines) + "\n"
 
-        return best_hit_key, best_hit_value
 
-    def parse_kmer_info(kmer_info):
-        """Parse the k-mer information string into a dictionary."""
-        kmer_dict = {}
-        parts = kmer_info.split()
-        for part in parts:
-            if part != "|:|":
-                key, value = part.split(":")
-                kmer_dict[key] = int(value)
-        return kmer_dict
+def build_consensus(inputs, output, chunksize=100000, processes=None, taxonomy=None):
+    """Merge kraken outputs obtained with several databases
 
-    def scanner(files, output):
+    All input files must contain the same reads in the same order (kraken
+    was run on the same data with different databases). Files are read by
+    blocks of *chunksize* reads. A read is classified if at least one database
+    classified it. Its taxon is the taxon found by the databases if they agree
+    or the lowest common ancestor of the taxons otherwise. K-mers of all
+    databases are concatenated.
 
-        buffer = {}
+    :param inputs: list of kraken output files
+    :param output: merged kraken output
+    :param int chunksize: number of reads per block
+    :param int processes: if set, blocks are merged in a pool of processes
+    :param taxonomy: a :class:`~sequana.taxonomy.TaxonomyIndex`. Default to
+        the index of :class:`~sequana.taxonomy.Taxonomy`.
+    """
+    if taxonomy is None:
+        from sequana.taxonomy import Taxonomy
 
-        fout = open(output, "w")
+        tax = Taxonomy(verbose=True)
+        tax.load_records()
+        taxonomy = tax.index
 
-        streams = [open(x, "r") for x in files]
-        count = 0
-        while True:
-            try:
-                count += 1
-                if count % 10000 == 0:
+    count = 0
+    with open(output, "w") as fout:
+        try:
+            chunks = _read_kraken_chunks(inputs, chunksize)
+            if processes:
+                from multiprocessing import Pool
+
+                with Pool(processes, initializer=_init_worker, initargs=(taxonomy,)) as pool:
+                    for text in pool.imap(_merge_chunks, chunks):
+                        fout.write(text)
+                        count += text.count("\n")
+                        logger.info(f"Processed {count} reads")
+            else:
+                for chunk in chunks:
+                    fout.write(_merge_chunks(chunk, taxonomy))
+                    count += len(chunk[0])
                     logger.info(f"Processed {count} reads")
-                lines = [stream.readline() for stream in streams]
-
-                kmer_totals = defaultdict(int)
-
-                taxids = []
-                classifications = []
-                kmers = []
-
-                for line in lines:
-                    parts = line.split("\t")
-                    # Parse the k-mer info and update totals
-                    # 50% here
-                    # kmer_dict = parse_kmer_info(parts[4].strip())
-                    # for key, value in kmer_dict.items():
-                    #        print("=", key, value)
-                    #         kmer_totals[key] += value
-
-                    # if parts[1] == "HISEQ:426:C5T65ACXX:5:2302:18333:2293":
-                    #    print(line)
-                    #    print(kmer_totals)
-                    if parts[0] == "C":
-                        taxids.append(parts[2])
-                        classifications.extend(parts[4])
-
-                    kmers.append(parts[4])
-
-                taxids = list(set(taxids))
-
-                if len(taxids) == 0:
-                    classified = "U"
-                    best_taxid = "0"
-                elif len(taxids) == 1:
-                    classified = "C"
-                    best_taxid = taxids[0]
-                else:
-                    best_taxid = searchLCA(tuple(taxids), tax.records, buffer)
-                    classified = "C"
-
-                # TODO
-                # save the kmers for saving later
-                # buffer_kmers = kmer_totals.copy()
-
-                # let us just ignore the 'A' and taxid 0
-                # kmer_totals['A'] = -1
-                # kmer_totals['0'] = -1
-
-                # 6% here
-                # best_taxid = find_best_hit(kmer_totals)
-
-                # print(kmer_totals, best_taxid)
-                # count+=1
-                # if count>10:
-                #    break
-
-                # kmers = " ".join([f"{k}:{v}" for k,v in kmer_totals.items()])
-                kmer_left = " ".join([x.split("|:|")[0] for x in kmers])
-                try:
-                    kmer_right = " ".join([x.split("|:|")[1] for x in kmers])
-                    kmers = kmer_left + " |:| " + kmer_right
-                except:
-                    kmers = kmer_left
-
-                fout.write("\t".join([classified, parts[1], str(best_taxid), parts[3], kmers]))
-            except Exception as err:
-                logger.error(str(err))
-                break
-
-        fout.close()
-
-        for stream in streams:
-            stream.close()
-
-    # Get the aggregated k-mer information
-    kmer_totals = scanner(inputs, output)
+        except pd.errors.EmptyDataError:
+            logger.warning("Empty kraken outputs. No reads to merge")
@@ -71,11 +71,14 @@ class BAMQCModule(SequanaBaseModule):
     def _computation(self):
         self.bam = BAM(self.bam_input)
 
+        # all statistics are computed in a single pass
+        stats = self.bam.collect_stats()
+
         results = {}
-        results["alignment_count"] = len(self.bam)
+        results["alignment_count"] = stats.count
 
         # first, we store the flags
-        df = self.bam.get_flags_as_df().sum()
+        df = stats.get_flags_count()
         df = df.to_frame()
         df.columns = ["counter"]
         sf = SAMFlags()
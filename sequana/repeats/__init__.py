@@ -12,7 +12,7 @@ families, plus the shustring-based exact-repeat finder:
 - :class:`~sequana.repeats.gquad.GQuadruplex` — G-quadruplexes (GQ)
 - :class:`~sequana.repeats.directrepeat.DirectRepeats` — direct / slipped repeats (DR)
 - :class:`~sequana.repeats.G4hunter.G4Hunter` — G-quadruplexes (score-based)
-- :class:`~sequana.repeats.shustring.Repeats` — exact repeats via shustring
+- :class:`~sequana.repeats.shustring.Repeats` — exact repeats via shortest unique substrings
 - :class:`~sequana.repeats.palindromes.Palindromes` — reverse-complement palindromes
 - :class:`~sequana.repeats.imotif.IMotif` — i-motifs (C-rich, G-quadruplex counterpart)
 - :class:`~sequana.repeats.trf.TRF` — parser for Tandem Repeat Finder (external ``trf``) output
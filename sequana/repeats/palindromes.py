@@ -4,7 +4,19 @@ A DNA *palindrome* is a sequence equal to its own reverse complement (e.g.
 ``GAATTC``). Such palindromes always have an even length: the central base of
 an odd-length window would have to be its own complement, which never happens
 for A/C/G/T. Only even window sizes are therefore scanned.
+
+The longest palindrome centred between each pair of consecutive bases is found
+with Manacher's algorithm, in linear time: the reverse complement of a
+palindrome is the palindrome itself so that the radius found at a mirrored
+center can be reused. Bases other than A/C/G/T never pair.
+
+By default, one (maximal) palindrome is reported per center. With
+``expand=True`` all palindromes of all sizes between *min_len* and *max_len*
+are reported (e.g. GAATTC also reports AATT).
 """
+import os
+
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
@@ -14,7 +26,96 @@ from sequana.tools import reverse_complement
 _COLS = ["seqid", "start", "end", "length", "sequence"]
 
 
+def _encode(seq):
+    # A=0, C=1, G=2, T=3 (complement is 3 - code), others=4
+    table = np.full(256, 4, dtype=np.uint8)
+    for code, letter in enumerate(b"ACGT"):
+        table[letter] = code
+    return table[np.frombuffer(seq.encode(), dtype=np.uint8)]
+
+
+def _scan_python(arr):
+    n = arr.shape[0]
+    radius = np.zeros(n, np.int64)
+    left, right = 0, -1
+    for i in range(1, n):
+        k = 0 if i > right else min(radius[left + right - i + 1], right - i + 1)
+        while i + k < n and i - k - 1 >= 0 and arr[i + k] < 4 and arr[i + k] + arr[i - k - 1] == 3:
+            k += 1
+        radius[i] = k
+        if i + k - 1 > right:
+            left, right = i - k, i + k - 1
+    return radius
+
+
+try:
+    from numba import njit
+
+    @njit(cache=True)
+    def _scan_numba(arr):
+        n = arr.shape[0]
+        radius = np.zeros(n, np.int64)
+        left = 0
+        right = -1
+        for i in range(1, n):
+            if i > right:
+                k = 0
+            else:
+                k = min(radius[left + right - i + 1], right - i + 1)
+            while i + k < n and i - k - 1 >= 0 and arr[i + k] < 4 and arr[i + k] + arr[i - k - 1] == 3:
+                k += 1
+            radius[i] = k
+            if i + k - 1 > right:
+                left = i - k
+                right = i + k - 1
+        return radius
+
+    _HAS_NUMBA = True
+except ImportError:  # pragma: no cover
+    _scan_numba = None
+    _HAS_NUMBA = False
+
+
+def _scan_one(item):
+    """Worker (module-level so it can be pickled for multiprocessing).
+
+    ``item`` = (seqid, upper-cased sequence string, (min_len, max_len,
+    expand)). Returns the start, end and sequence of each palindrome.
+    """
+    seqid, seq, (min_len, max_len, expand) = item
+    scan = _scan_numba if _HAS_NUMBA else _scan_python
+    # radius[c]: half length of the longest palindrome centred before base c
+    radius = scan(_encode(seq))
+    if max_len is not None:
+        np.minimum(radius, max_len // 2, out=radius)
+    min_half = (min_len + 1) // 2
+    centers = np.flatnonzero(radius >= min_half)
+    halves = radius[centers]
+
+    if expand:
+        counts = halves - min_half + 1
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        centers = np.repeat(centers, counts)
+        halves = min_half + offsets
+        # same order as a scan by increasing size
+        order = np.lexsort((centers - halves, halves))
+        centers, halves = centers[order], halves[order]
+
+    starts = centers - halves
+    ends = centers + halves
+    seqs = [seq[s:e] for s, e in zip(starts.tolist(), ends.tolist())]
+    return seqid, starts, ends, seqs
+
+
 class Palindromes:
+    """Detect reverse-complement palindromes
+
+    :param fasta_file: input FASTA.
+    :param min_len: minimum length of the palindromes.
+    :param max_len: maximum length of the palindromes (longer palindromes are
+        truncated around their center). None for no limit.
+    """
+
     def __init__(self, fasta_file, min_len=4, max_len=12):
         self.fasta_file = fasta_file
         self.min_len = min_len
@@ -27,23 +128,44 @@ class Palindromes:
         seq = seq.upper()
         return seq == reverse_complement(seq)
 
-    def run(self):
-        fa = FastA(self.fasta_file)
+    def run(self, progress=True, processes=None, expand=False):
+        """Scan every sequence for palindromes.
 
-        results = []
-        for name, sequence in zip(tqdm(fa.names), fa.sequences):
-            sequence = sequence.upper()
-            seq_len = len(sequence)
+        :param processes: number of worker processes. ``None`` (default) uses
+            all CPUs. Pass ``1`` to force a single in-process (serial) scan.
+        :param expand: report the palindromes of all sizes (sorted by size
+            and position) instead of the longest palindrome of each center.
+        """
+        fa = FastA(self.fasta_file)
+        args = (self.min_len, self.max_len, expand)
+        items = [(seqid, fa.sequences[i].upper(), args) for i, seqid in enumerate(fa.names)]
+        if processes is None:
+            processes = os.cpu_count() or 1
+        use_pool = _HAS_NUMBA and processes > 1 and len(items) > 1
+        if use_pool:
+            from multiprocessing import Pool
 
-            # Even sizes only: odd-length windows can never be palindromes.
-            start = self.min_len + (self.min_len % 2)
-            for size in range(start, self.max_len + 1, 2):
-                for i in range(seq_len - size + 1):
-                    subseq = sequence[i : i + size]
-                    if subseq == reverse_complement(subseq):
-                        results.append({"seqid": name, "start": i, "end": i + size, "length": size, "sequence": subseq})
+            with Pool(min(processes, len(items))) as pool:
+                results = list(
+                    tqdm(
+                        pool.imap(_scan_one, items),
+                        total=len(items),
+                        disable=not progress,
+                        desc="Palindromes",
+                        unit="seq",
+                    )
+                )
+        else:
+            results = [_scan_one(it) for it in tqdm(items, disable=not progress, desc="Palindromes", unit="seq")]
 
-        self.df = pd.DataFrame(results, columns=_COLS)
+        frames = []
+        for seqid, starts, ends, seqs in results:
+            if len(starts) == 0:
+                continue
+            frames.append(
+                pd.DataFrame({"seqid": seqid, "start": starts, "end": ends, "length": ends - starts, "sequence": seqs})
+            )
+        self.df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=_COLS)
 
     def to_bed(self, output_file):
         if self.df.empty:
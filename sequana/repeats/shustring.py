@@ -9,19 +9,210 @@
 #  documentation: http://sequana.readthedocs.io
 #
 ##############################################################################
-"""Find exact repeats in a genome using the *shustring* tool."""
+"""Find exact repeats in a genome using shortest unique substrings
+
+The shortest unique substring (*shustring*) starting at a position of a
+sequence is the shortest substring starting there that occurs only once in
+the sequence and its reverse complement. Long shustrings reveal repeats.
+
+Shustring lengths are computed in-process with a suffix array and its LCP
+array (longest common prefix between consecutive suffixes) built over the
+sequence followed by its reverse complement::
+
+    from sequana.repeats.shustring import get_shustrings
+    lengths = get_shustrings("ACGTTTACGT")
+
+The external *shustring* tool can still be used (method="shustring").
+"""
+import hashlib
+import json
+import os
 import subprocess
 
 import colorlog
 
 from sequana.fasta import FastA
+from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
 from sequana.lazy import pylab
 
 logger = colorlog.getLogger(__name__)
 
 
-__all__ = ["Repeats"]
+__all__ = ["Repeats", "ShustringCache", "get_shustrings", "suffix_array"]
+
+
+def suffix_array(text):
+    """Return the suffix array of a sequence of integers (prefix doubling)
+
+    :param text: 1D array of integers
+    :return: array of the suffix start positions in lexicographic order.
+        A suffix sorts before any longer suffix it is a prefix of.
+    """
+    text = np.asarray(text)
+    m = len(text)
+    if m == 0:
+        return np.zeros(0, dtype=np.int64)
+    _, rank = np.unique(text, return_inverse=True)
+    rank = rank.astype(np.int64).ravel()
+    k = 1
+    while True:
+        # sort on the ranks of the first k letters then of the next k letters
+        second = np.zeros(m, dtype=np.int64)
+        second[: m - k] = rank[k:] + 1
+        key = rank * (m + 1) + second
+        sa = np.argsort(key, kind="stable")
+        sorted_key = key[sa]
+        rank = np.empty(m, dtype=np.int64)
+        rank[sa] = np.concatenate(([0], np.cumsum(sorted_key[1:] != sorted_key[:-1])))
+        if rank[sa[-1]] == m - 1 or k >= m:
+            return sa
+        k *= 2
+
+
+def _lcp_python(text, sa):
+    # Kasai algorithm. lcp[r]: common prefix of the suffixes sa[r - 1] and sa[r]
+    m = text.shape[0]
+    rank = np.empty(m, np.int64)
+    rank[sa] = np.arange(m)
+    lcp = np.zeros(m, np.int64)
+    h = 0
+    for i in range(m):
+        r = rank[i]
+        if r > 0:
+            j = sa[r - 1]
+            while i + h < m and j + h < m and text[i + h] == text[j + h]:
+                h += 1
+            lcp[r] = h
+            if h > 0:
+                h -= 1
+        else:
+            h = 0
+    return rank, lcp
+
+
+try:
+    from numba import njit
+
+    @njit(cache=True)
+    def _lcp_numba(text, sa):
+        m = text.shape[0]
+        rank = np.empty(m, np.int64)
+        for r in range(m):
+            rank[sa[r]] = r
+        lcp = np.zeros(m, np.int64)
+        h = 0
+        for i in range(m):
+            r = rank[i]
+            if r > 0:
+                j = sa[r - 1]
+                while i + h < m and j + h < m and text[i + h] == text[j + h]:
+                    h += 1
+                lcp[r] = h
+                if h > 0:
+                    h -= 1
+            else:
+                h = 0
+        return rank, lcp
+
+    _HAS_NUMBA = True
+except ImportError:  # pragma: no cover
+    _lcp_numba = None
+    _HAS_NUMBA = False
+
+
+def get_shustrings(sequence):
+    """Return the shortest unique substring length at each position
+
+    Substrings are unique in the sequence and its reverse complement. The
+    sequence is upper-cased; letters other than A, C, G, T are kept as is
+    (and are their own complement).
+
+    :param str sequence: a DNA sequence
+    :return: int32 array with one value per position. Trailing positions with
+        no unique substring (the suffix occurs elsewhere) are set to 0.
+    """
+    sequence = sequence.upper()
+    n = len(sequence)
+    if n == 0:
+        return np.zeros(0, dtype=np.int32)
+    revcomp = sequence.translate(str.maketrans("ACGTU", "TGCAA"))[::-1]
+    # letters are shifted so that 0 and 1 are unique separators
+    text = np.frombuffer((sequence + revcomp).encode(), dtype=np.uint8).astype(np.int32) + 2
+    text = np.concatenate((text[:n], [0], text[n:], [1])).astype(np.int32)
+
+    sa = suffix_array(text)
+    lcp_func = _lcp_numba if _HAS_NUMBA else _lcp_python
+    rank, lcp = lcp_func(text, sa)
+
+    # longest prefix shared with another suffix + 1 (neighbours in the array)
+    rank = rank[:n]
+    lcp = np.append(lcp, 0)
+    lengths = np.maximum(lcp[rank], lcp[rank + 1]) + 1
+    # a unique substring cannot run into the separator
+    lengths[np.arange(n) + lengths > n] = 0
+    return lengths.astype(np.int32)
+
+
+class ShustringCache(object):
+    """On-disk cache of the shustring lengths of the sequences of a FASTA file
+
+    Lengths computed with :func:`get_shustrings` are stored as .npy files in
+    a directory next to the FASTA file (FASTA name with the *.sqcache*
+    extension), one file per sequence. The cache is emptied as soon as the
+    modification time or the size of the FASTA file changes.
+    """
+
+    version = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.directory = f"{filename}.sqcache"
+        self.index_filename = os.path.join(self.directory, "shustring.json")
+
+    def _get_signature(self):
+        st = os.stat(self.filename)
+        return {"mtime": st.st_mtime_ns, "size": st.st_size, "version": self.version}
+
+    def _get_filename(self, name):
+        key = hashlib.md5(name.encode()).hexdigest()
+        return os.path.join(self.directory, f"shustring_{key}.npy")
+
+    def _check(self):
+        # remove outdated files. Return False if the cache cannot be used.
+        try:
+            with open(self.index_filename, "r") as fin:
+                valid = json.load(fin) == self._get_signature()
+        except (OSError, ValueError):
+            valid = False
+
+        if valid:
+            return True
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for filename in os.listdir(self.directory):
+                if filename.startswith("shustring_"):
+                    os.remove(os.path.join(self.directory, filename))
+            with open(self.index_filename, "w") as fout:
+                json.dump(self._get_signature(), fout)
+        except OSError as err:
+            logger.warning(f"Could not use the cache {self.directory}: {err}")
+            return False
+        return True
+
+    def get(self, name, sequence):
+        """Return the shustring lengths of a sequence, computed if needed"""
+        if not self._check():
+            return get_shustrings(sequence)
+
+        filename = self._get_filename(name)
+        if os.path.exists(filename):
+            return np.load(filename, mmap_mode="r")
+
+        lengths = get_shustrings(sequence)
+        np.save(filename, lengths)
+        return lengths
 
 
 class Repeats:
@@ -38,13 +229,13 @@ class Repeats:
         rr.threshold = 4
         rr.hist_length_repeats()
 
-    .. note:: Works with shustring package from Bioconda (April 2017)
-    .. todo:: use a specific sequence (first one by default). Others can be
-        selected by name
+    Shustring lengths are computed in-process (see :func:`get_shustrings`).
+    The external shustring tool (Bioconda) can be used instead with
+    method="shustring".
 
     """
 
-    def __init__(self, filename_fasta, merge=False, name=None):
+    def __init__(self, filename_fasta, merge=False, name=None, method="native", cache=False):
         """.. rubric:: Constructor
 
         Input must be a fasta file with valid DNA or RNA characters
@@ -57,6 +248,11 @@ class Repeats:
             analyse all sequences, you need to use a loop by setting
             _header for each sequence with the sequence name found in
             sequence header.
+        :param str method: *native* (suffix array) or *shustring* (external
+            tool).
+        :param bool cache: store the lengths computed by the *native*
+            method in a *.sqcache* directory next to the FASTA file (see
+            :class:`ShustringCache`).
 
 
         .. note:: known problems. Header with a > character (e.g. in the
@@ -82,6 +278,10 @@ class Repeats:
         if not isinstance(merge, bool):
             raise TypeError("do_merge must be boolean")
         self._do_merge = merge
+        if method not in ("native", "shustring"):
+            raise ValueError(f"method must be native or shustring. Got {method}")
+        self.method = method
+        self.cache = cache
         if name is not None:
             self.header = name
         else:
@@ -108,8 +308,21 @@ class Repeats:
     def _get_shustrings_length(self):
         """Return dataframe with shortest unique substring length at each position
         shortest unique substrings are unique in the sequence and its complement
-        Uses shustring tool"""
-        if self._df_shustring is None:
+        """
+        if self._df_shustring is None and self.method == "native":
+            sequence = self._fasta.sequences[self._fasta.names.index(self.header)]
+            if self.cache:
+                lengths = ShustringCache(self._filename_fasta).get(self.header, sequence)
+            else:
+                lengths = get_shustrings(sequence)
+            # trailing positions without unique substring are not reported
+            N = int(np.count_nonzero(lengths))
+            self._df_shustring = pd.DataFrame(
+                {"position": np.arange(1, N + 1, dtype=np.int32), "repeat_length": np.asarray(lengths[:N])}
+            )
+            self._length = len(lengths)
+            self._longest_shustring = int(lengths.max()) if N else 0
+        elif self._df_shustring is None:
             # read fasta
             task_read = subprocess.Popen(["cat", self._filename_fasta], stdout=subprocess.PIPE)
 
@@ -168,27 +381,16 @@ class Repeats:
 
         # if there is no result yet, or the threshold has changed
         if (self._begin_end_repeat_position is None) | (self.threshold != self._previous_thr) | force:
-            nb_row = self.df_shustring.shape[0]
-            i = 0
-            step_repeat_seq = []
             be_repeats = []
             e = 0
 
-            # use list because faster
-            list_len_shus = list(self.df_shustring.loc[:, "repeat_length"])
-
-            while i < nb_row:
-                # begining of repeat
-                if list_len_shus[i] > self.threshold:
-                    b = i
-                    # compute new end of repeat
-                    len_repeat = list_len_shus[i]
-                    e = b + len_repeat
-                    # save (b,e)
+            # only rows above the threshold can start a repeat; rows covered
+            # by the previous repeat are skipped
+            lengths = self.df_shustring["repeat_length"].to_numpy()
+            for b in np.flatnonzero(lengths > self.threshold).tolist():
+                if b >= e:
+                    e = b + int(lengths[b])
                     be_repeats.append((b, e))
-                    # update i
-                    i = e - 1
-                i += 1
 
             self._begin_end_repeat_position = be_repeats
 
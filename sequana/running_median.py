@@ -18,6 +18,29 @@
     RunningMedian
 
 
+Several engines are available to compute the running median. They all return
+the exact median of each window and therefore identical results:
+
+========= =================================================================
+engine    description
+========= =================================================================
+list      bisect/insort on a sorted Python list. O(W) per step. Reference
+          implementation.
+pandas    pandas rolling median (indexable skiplist in C). O(log W) per step
+tree      order-statistic (Fenwick) tree on the ranks of the data.
+          O(log n) per step. Uses numba if installed.
+blocked   sort-based algorithm (Suomela, 2014): data is split into blocks of
+          W values that are sorted once; windows are then maintained with
+          linked lists in O(1) amortized per step. Best choice for very large
+          W. Uses numba if installed.
+histogram counting histogram with a moving median pointer for non-negative
+          integers (e.g. coverage depth). Nearly O(n) whatever W. Values
+          above :data:`HISTOGRAM_CAP` fall back to the blocked engine.
+          Uses numba if installed.
+auto      histogram for integer data if numba is installed, blocked
+          otherwise. pandas if numba is not installed.
+========= =================================================================
+
 """
 from bisect import bisect_left, insort
 
@@ -27,6 +50,13 @@ import numpy as np
 logger = colorlog.getLogger(__name__)
 
 
+__all__ = ["RunningMedian", "running_median", "get_engines", "HISTOGRAM_CAP"]
+
+
+#: maximum value accepted by the histogram engine (size of the histogram)
+HISTOGRAM_CAP = 2**16
+
+
 # blist seems to be unstable on older systems/platforms so we use list by
 # default for now. Be aware that on recent systems blist exhibits a log(W)
 # complexity that is better than list complexity. Note, however that there is an
@@ -34,11 +64,307 @@ logger = colorlog.getLogger(__name__)
 # applications.
 
 
-def running_median(data, width, container=list):
-    rm = RunningMedian(data, width, container=list)
+def running_median(data, width, container=list, engine="list", circular=False):
+    rm = RunningMedian(data, width, container=container, engine=engine, circular=circular)
     return rm.run()
 
 
+# Engines compute the median of all windows fully included in the data. They
+# take an array of length n and return an array of length n - W + 1 where the
+# first value is the median of data[0:W]. Edges and circularity are handled
+# by RunningMedian.
+
+
+def _median_list(data, W, container=list):
+    # initialise with first W values and sort the values
+    lc = container(data[:W])
+    lc.sort()
+
+    mid = (W - 1) // 2
+    result = np.empty(len(data) - W + 1, dtype=data.dtype)
+    result[0] = lc[mid]
+
+    # remove the oldest element and insert the new one. We do not use
+    # enumerate since we do not start at zero.
+    idx = 0
+    for new_elem in data[W:]:
+        old_elem = data[idx]
+        del lc[bisect_left(lc, old_elem)]
+        insort(lc, new_elem)
+        idx += 1
+        result[idx] = lc[mid]
+    return result
+
+
+def _median_pandas(data, W):
+    import pandas as pd
+
+    rm = pd.Series(data).rolling(W).median().values[W - 1 :]
+    return rm.astype(data.dtype, copy=False)
+
+
+def _get_ranks(data):
+    # unique rank of each value (ties broken by position). Values of the
+    # windows are then retrieved with sorted_data[rank].
+    order = np.argsort(data, kind="stable")
+    ranks = np.empty(len(data), dtype=np.int64)
+    ranks[order] = np.arange(len(data), dtype=np.int64)
+    return ranks, data[order]
+
+
+def _tree_kernel(ranks, W):
+    # Fenwick tree on the ranks. tree[i] holds the number of ranks in the
+    # window in (i - lowbit(i), i]. The k-th smallest is found by binary lifting.
+    n = ranks.shape[0]
+    tree = np.zeros(n + 1, np.int64)
+    out = np.empty(n - W + 1, np.int64)
+    mid = (W - 1) // 2
+
+    top = 1
+    while top * 2 <= n:
+        top *= 2
+
+    for i in range(n):
+        # insert the new value
+        j = ranks[i] + 1
+        while j <= n:
+            tree[j] += 1
+            j += j & (-j)
+        # remove the oldest value
+        if i >= W:
+            j = ranks[i - W] + 1
+            while j <= n:
+                tree[j] -= 1
+                j += j & (-j)
+        # search for the (mid+1)-th smallest rank
+        if i >= W - 1:
+            pos = 0
+            remaining = mid + 1
+            step = top
+            while step > 0:
+                if pos + step <= n and tree[pos + step] < remaining:
+                    pos += step
+                    remaining -= tree[pos]
+                step //= 2
+            out[i - W + 1] = pos
+    return out
+
+
+def _blocked_kernel(ranks, W):
+    # Sort-based running median (J. Suomela, Median filtering is equivalent
+    # to sorting, 2014). The data (padded to a multiple of W) is split in
+    # blocks of W values. A window starting at offset t of block A covers
+    # A[t:] and B[:t] where B is the next block. Both blocks are stored as
+    # doubly linked lists following the sorted order: elements are removed
+    # from A and restored in B (dancing links), so each step costs O(1).
+    #
+    # Ranks are unique. The "small" set holds the mid+1 smallest values of the
+    # window; pa (pb) is the largest small element of A (B). The median is the
+    # largest of the two. Nodes 0 and W+1 are the head/tail sentinels.
+    n = ranks.shape[0]
+    nblocks = (n + W - 1) // W
+    mid = (W - 1) // 2
+    out = np.empty(n - W + 1, np.int64)
+    big = n + W + 1
+
+    keys = np.empty((2, W + 2), np.int64)
+    prev = np.empty((2, W + 2), np.int64)
+    nxt = np.empty((2, W + 2), np.int64)
+    node = np.empty((2, W), np.int64)
+    block = np.empty(W, np.int64)
+
+    def init_block(b, side):
+        # build the sorted linked list of block b in slot side
+        for t in range(W):
+            i = b * W + t
+            block[t] = ranks[i] if i < n else n + t
+        order = np.argsort(block)
+        keys[side, 0] = -1
+        keys[side, W + 1] = big
+        for j in range(W):
+            keys[side, j + 1] = block[order[j]]
+            node[side, order[j]] = j + 1
+        for j in range(W + 2):
+            prev[side, j] = j - 1
+            nxt[side, j] = j + 1
+
+    init_block(0, 0)
+    A = 0
+    for a in range(nblocks):
+        B = 1 - A
+        if a + 1 < nblocks:
+            init_block(a + 1, B)
+            # empty B in reverse order so that elements can be restored in order
+            for t in range(W - 1, -1, -1):
+                x = node[B, t]
+                nxt[B, prev[B, x]] = nxt[B, x]
+                prev[B, nxt[B, x]] = prev[B, x]
+        else:
+            # no next block (e.g. a single window): B is an empty sorted list
+            keys[B, 0] = -1
+            keys[B, W + 1] = big
+            nxt[B, 0] = W + 1
+            prev[B, W + 1] = 0
+
+        # initial window: block A only
+        pa = mid + 1
+        pb = 0
+        for t in range(W):
+            s = a * W + t
+            if s > n - W:
+                break
+            if t > 0:
+                small = mid + 1
+                M = max(keys[A, pa], keys[B, pb])
+                # remove A[t-1]
+                x = node[A, t - 1]
+                if keys[A, x] <= M:
+                    small -= 1
+                    if x == pa:
+                        pa = prev[A, pa]
+                nxt[A, prev[A, x]] = nxt[A, x]
+                prev[A, nxt[A, x]] = prev[A, x]
+                M = max(keys[A, pa], keys[B, pb])
+                # restore B[t-1]
+                y = node[B, t - 1]
+                nxt[B, prev[B, y]] = y
+                prev[B, nxt[B, y]] = y
+                if keys[B, y] < M:
+                    small += 1
+                    if keys[B, y] > keys[B, pb]:
+                        pb = y
+                # rebalance the small set
+                while small > mid + 1:
+                    if keys[A, pa] > keys[B, pb]:
+                        pa = prev[A, pa]
+                    else:
+                        pb = prev[B, pb]
+                    small -= 1
+                while small < mid + 1:
+                    if keys[A, nxt[A, pa]] < keys[B, nxt[B, pb]]:
+                        pa = nxt[A, pa]
+                    else:
+                        pb = nxt[B, pb]
+                    small += 1
+            out[s] = max(keys[A, pa], keys[B, pb])
+        # the last element of B is not part of any window starting in A;
+        # restore it so that B is complete when it becomes the next A
+        if a + 1 < nblocks:
+            y = node[B, W - 1]
+            nxt[B, prev[B, y]] = y
+            prev[B, nxt[B, y]] = y
+        A = B
+    return out
+
+
+def _histogram_kernel(values, W, size):
+    # counts[v] is the number of values v in the window and below the number
+    # of values strictly lower than the median pointer m. On coverage data,
+    # the median moves slowly so the pointer moves by a few bins per step.
+    n = values.shape[0]
+    counts = np.zeros(size, np.int64)
+    out = np.empty(n - W + 1, np.int64)
+    mid = (W - 1) // 2
+
+    m = 0
+    below = 0
+    for i in range(n):
+        v = values[i]
+        counts[v] += 1
+        if v < m:
+            below += 1
+        if i >= W:
+            v = values[i - W]
+            counts[v] -= 1
+            if v < m:
+                below -= 1
+        if i >= W - 1:
+            # the median is the smallest m such that below <= mid and
+            # below + counts[m] > mid
+            while below > mid:
+                m -= 1
+                below -= counts[m]
+            while below + counts[m] <= mid:
+                below += counts[m]
+                m += 1
+            out[i - W + 1] = m
+    return out
+
+
+try:
+    from numba import njit
+
+    _tree_kernel_numba = njit(cache=True)(_tree_kernel)
+    _blocked_kernel_numba = njit(cache=True)(_blocked_kernel)
+    _histogram_kernel_numba = njit(cache=True)(_histogram_kernel)
+    _HAS_NUMBA = True
+except ImportError:  # pragma: no cover
+    _tree_kernel_numba = None
+    _blocked_kernel_numba = None
+    _histogram_kernel_numba = None
+    _HAS_NUMBA = False
+
+
+def _median_tree(data, W):
+    ranks, sorted_data = _get_ranks(data)
+    kernel = _tree_kernel_numba if _HAS_NUMBA else _tree_kernel
+    return sorted_data[kernel(ranks, W)]
+
+
+def _median_blocked(data, W):
+    ranks, sorted_data = _get_ranks(data)
+    kernel = _blocked_kernel_numba if _HAS_NUMBA else _blocked_kernel
+    return sorted_data[kernel(ranks, W)]
+
+
+def _is_histogram_compatible(data, cap=HISTOGRAM_CAP):
+    # non-negative integers (possibly stored as floats) below the cap
+    if len(data) == 0 or data.dtype.kind not in "iuf":
+        return False
+    if data.dtype.kind == "f" and not np.array_equal(data, np.floor(data)):
+        return False
+    return data.min() >= 0 and data.max() <= cap
+
+
+def _median_histogram(data, W, cap=HISTOGRAM_CAP):
+    if not _is_histogram_compatible(data, cap):
+        logger.debug(f"Data not made of integers in [0, {cap}]. Using the blocked engine")
+        return _median_blocked(data, W)
+
+    values = data.astype(np.int64, copy=False)
+    kernel = _histogram_kernel_numba if _HAS_NUMBA else _histogram_kernel
+    return kernel(values, W, int(values.max()) + 1).astype(data.dtype, copy=False)
+
+
+_ENGINES = {
+    "list": _median_list,
+    "pandas": _median_pandas,
+    "tree": _median_tree,
+    "blocked": _median_blocked,
+    "histogram": _median_histogram,
+}
+
+
+def get_engines():
+    """Return the names of the available running median engines"""
+    return list(_ENGINES.keys()) + ["auto"]
+
+
+def _select_engine(data, engine):
+    if engine not in _ENGINES and engine != "auto":
+        raise ValueError(f"engine must be one of {get_engines()}. Got {engine}")
+
+    # NaN are propagated by pandas only (windows including a NaN are NaN)
+    if data.dtype.kind == "f" and np.isnan(data).any():
+        return "pandas"
+
+    if engine == "auto":
+        if not _HAS_NUMBA:
+            return "pandas"
+        return "histogram" if _is_histogram_compatible(data) else "blocked"
+    return engine
+
+
 class RunningMedian:
     """Running median (fast)
 
@@ -50,14 +376,18 @@ class RunningMedian:
     as proposed in https://gist.github.com/f0k/2f8402e4dfb6974bfcf1 and was
     adapted to our needs included object oriented implementation.
 
-    .. note:: a circular running median is implemented in :class:`sequana.bedtools.SequanaCoverage`
-
     ::
 
         from sequana.running_median import RunningMedian
         rm = RunningMedian(data, 101)
         results = rm.run()
 
+    For large data sets and windows, use a faster engine. Circular data
+    (e.g. bacterial genomes) is handled natively::
+
+        rm = RunningMedian(data, 20001, engine="blocked", circular=True)
+        results = rm.run()
+
 
     .. warning:: the first W/2 and last W/2 positions should be ignored
         since they do not use W values. In this implementation, the last
@@ -125,14 +455,20 @@ class RunningMedian:
 
     """
 
-    def __init__(self, data, width, container=list):
+    def __init__(self, data, width, container=list, engine="list", circular=False):
         """.. rubric:: constructor
 
         :param data: your data vector
         :param width: running window length
         :param container: a container (defaults to list). Could be a B-tree
             blist from the blist package but is 30% slower than a pure list
-            for W < 20,000
+            for W < 20,000. Used by the *list* engine only.
+        :param str engine: one of *list*, *pandas*, *tree*, *blocked*,
+            *histogram* or *auto* (see module documentation). All engines
+            return the same results.
+        :param bool circular: if True, the data is considered as circular
+            and the first and last W/2 values are computed using the values
+            at the other end of the data.
 
         scipy in O(n)
         list in sqrt(n)
@@ -146,35 +482,45 @@ class RunningMedian:
         self.container = container
         self.W = width
         self.data = data
+        self.engine = engine
+        self.circular = circular
 
     def __call__(self):
         return self.run()
 
     def run(self):
-        # initialise with first W values and sort the values
-        lc = self.container(self.data[: self.W])
-        lc.sort()  #
-
+        data = np.asarray(self.data)
+        N = len(data)
         mididx = (self.W - 1) // 2
-        result = np.empty_like(self.data)
-
-        # We initialise the first element
-        idx = mididx
-        result[idx] = lc[mididx]
-
-        # We start at position W removing first element in lc
-        # and adding a new one. We do not use enumerate since we do not
-        # start at zero.
-        for new_elem in self.data[self.W :]:
-            old_elem = self.data[idx - mididx]
-            del lc[bisect_left(lc, old_elem)]
-            insort(lc, new_elem)
-            idx += 1
-            result[idx] = lc[mididx]
+
+        engine = _select_engine(data, self.engine)
+        if engine == "list":
+            func = lambda x, W: _median_list(x, W, container=self.container)
+        else:
+            func = _ENGINES[engine]
+
+        result = np.empty_like(data)
+
+        if self.circular and mididx > 0:
+            if N >= self.W:
+                # central part, then the junction between the end and the
+                # beginning of the data. Only 4*W/2 values are copied.
+                result[mididx : N - mididx] = func(data, self.W)
+                junction = np.concatenate([data[N - 2 * mididx :], data[: 2 * mididx]])
+                edges = func(junction, self.W)
+                result[N - mididx :] = edges[:mididx]
+                result[:mididx] = edges[mididx:]
+            else:
+                # window larger than the data itself
+                wrapped = np.take(data, np.arange(-mididx, N + mididx), mode="wrap")
+                result[:] = func(wrapped, self.W)
+            return result
+
+        result[mididx : N - mididx] = func(data, self.W)
 
         # We decided to keep the first W/2 and last W/2 values as in the
         # original data. Ideally, they should not be used for post processing
-        result[0:mididx] = self.data[0:mididx]
-        result[-mididx:] = self.data[-mididx:]
+        result[0:mididx] = data[0:mididx]
+        result[-mididx:] = data[-mididx:]
 
         return result
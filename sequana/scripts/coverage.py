@@ -13,8 +13,6 @@
 """.. rubric:: Standalone application dedicated to coverage"""
 import argparse
 import gc as garbage
-import glob
-import json
 import os
 import subprocess
 import sys
@@ -25,6 +23,7 @@ from easydev import AttrDict, shellcmd
 
 from sequana import sequana_data
 from sequana import version as sequana_version
+from sequana.bamtools import BAM
 from sequana.bedtools import ChromosomeCov, SequanaCoverage
 from sequana.lazy import pandas as pd
 from sequana.modules_report.coverage import ChromosomeCoverageModule, CoverageModule
@@ -51,6 +50,7 @@ click.rich_click.OPTION_GROUPS = {
                 "--circular",
                 "--mixture-models",
                 "--window-median",
+                "--median-engine",
                 "--window-gc",
                 "--low-threshold",
                 "--high-threshold",
@@ -61,7 +61,14 @@ click.rich_click.OPTION_GROUPS = {
         },
         {
             "name": "Modifiers",
-            "options": ["--annotation-file", "--reference-file", "--chromosome", "--chunk-size", "--binning"],
+            "options": [
+                "--annotation-file",
+                "--reference-file",
+                "--chromosome",
+                "--chunk-size",
+                "--binning",
+                "--use-cache",
+            ],
         },
         {
             "name": "Download utilities",
@@ -77,7 +84,7 @@ click.rich_click.OPTION_GROUPS = {
         },
         {
             "name": "Behaviour",
-            "options": ["--version", "--level", "--debug-level", "--help"],
+            "options": ["--processes", "--version", "--level", "--debug-level", "--help"],
         },
     ],
 }
@@ -228,6 +235,14 @@ def download_genbank(ctx, param, value):
     default=20001,
     show_default=True,
 )
+@click.option(
+    "--median-engine",
+    "median_engine",
+    type=click.Choice(["auto", "histogram", "blocked", "tree", "pandas", "list"]),
+    default="auto",
+    show_default=True,
+    help="Algorithm used to compute the running median. All give the same results. auto uses the histogram engine if the coverage is made of integers and numba is installed.",
+)
 @click.option(
     "-L",
     "--low-threshold",
@@ -281,6 +296,12 @@ def download_genbank(ctx, param, value):
     default=None,
     help="merge consecutive (non overlapping) data points, taking the mean. This is useful for large genome (e.g. human). This allows a faster computation, especially for CNV detection were only large windows are of interest. For instance, using a binning of 50 or 100 allows the human genome to be analysed.",
 )
+@click.option(
+    "--use-cache",
+    "use_cache",
+    is_flag=True,
+    help="Store a binary cache of the BED file next to it (INPUT.bed.sqcache directory). Subsequent runs on the same BED file skip the parsing of the text file. The cache is rebuilt automatically if the BED file changes.",
+)
 @click.option(
     "--cnv-clustering",
     "cnv_clustering",
@@ -291,9 +312,9 @@ def download_genbank(ctx, param, value):
 )
 @click.option(
     "--bam2cov-method",
-    type=click.Choice(["samtools", "mosdepth"]),
+    type=click.Choice(["samtools", "mosdepth", "sequana"]),
     default="mosdepth",
-    help="method used internally to convert BAM into BED file",
+    help="method used internally to convert BAM into BED file. sequana does not require any external tool but does not support --second-mapq",
     show_default=True,
 )
 @click.option(
@@ -315,6 +336,16 @@ def download_genbank(ctx, param, value):
     help="exclude reads with any of the bits in FLAG set. to ignore, supp, use -F 3844",
     show_default=True,
 )
+@click.option(
+    "-j",
+    "--processes",
+    "--threads",
+    "processes",
+    type=click.IntRange(1),
+    default=1,
+    show_default=True,
+    help="Number of chromosomes analysed in parallel (one process each). Memory usage grows with the number of processes since each of them holds one chromosome at a time.",
+)
 def main(**kwargs):
     """Welcome to SEQUANA -- Coverage standalone
 
@@ -420,7 +451,7 @@ def main(**kwargs):
 
     # Convert BAM to BED
     if options.input.endswith(".bam"):
-        logger.info("Converting BAM into BED file with mosdepth")
+        logger.info(f"Converting BAM into BED file with {options.bam2cov_method}")
         bedfile = options.input.replace(".bam", ".bed")
 
     if not options.input.endswith("bam") and (options.mapq or options.second_mapq):
@@ -459,6 +490,12 @@ def main(**kwargs):
                 f"{main_command} -Q {options.mapq} -b1 lenny {options.input} && gunzip -c lenny.regions.bed.gz | cut -f 1,3,4 > {bedfile} && rm -f lenny.mosdepth*"
             )
 
+    elif options.input.endswith(".bam") and options.bam2cov_method == "sequana":
+        if options.second_mapq:
+            logger.error("--second-mapq is not supported with --bam2cov-method sequana")
+            return sys.exit(1)
+        BAM(options.input).to_genomecov(bedfile, chrom=options.chromosome or None, mapq=options.mapq, flag=options.flag)
+
     elif options.input.endswith(".bed"):
         bedfile = options.input
     else:
@@ -492,6 +529,7 @@ def main(**kwargs):
         chromosome_list=chrom_list,
         reference_file=options.reference,
         gc_window_size=options.w_gc,
+        use_cache=options.use_cache,
         # force=True
     )
 
@@ -503,39 +541,53 @@ def main(**kwargs):
         data = (this, gc.positions[this]["start"], gc.positions[this]["end"], end - start)
         logger.info("    {} (starting pos: {}, ending pos: {}, length: {})".format(*data))
 
+    # also set in run_analysis but required here by the main report when
+    # chromosomes are analysed in other processes
+    config.output_dir = options.output_directory
+    config.sample_name = os.path.basename(options.input).split(".")[0]
+
     # here we read chromosome by chromosome to save memory and analyse them.
     N = len(gc)
-    for i, chrom in enumerate(gc.chrom_names[::-1]):
-        logger.info(f"==================== analysing chrom/contig {i+1}/{N} ({chrom})")
-        # since we read just one contig/chromosome, the chr_list contains
-        # only one contig, so we access to it with index 0
-
-        # Performs the computation and reporting for a given chromosome
-        # This call performs the analysis, and creates the HTML page
-        # if HTML is created, it fills the gc._html_list variable
-        chrom_data = ChromosomeCov(gc, chrom, gc.thresholds, gc.chunksize)
-        run_analysis(chrom_data, options)
+    chrom_names = gc.chrom_names[::-1]
+    if options.processes > 1 and N > 1:
+        # each worker holds one chromosome at a time so at most
+        # options.processes chromosomes are in memory.
+        from multiprocessing import Pool
+
+        processes = min(options.processes, N)
+        logger.info(f"Analysing {N} chromosomes/contigs with {processes} processes")
+        with Pool(processes, initializer=_init_worker, initargs=(gc, options)) as pool:
+            results = {}
+            for i, result in enumerate(pool.imap_unordered(_run_worker, chrom_names, chunksize=1)):
+                logger.info(f"==================== analysed chrom/contig {i+1}/{N} ({result['chrom_name']})")
+                results[result["chrom_name"]] = result
+        # merge in the chromosome order whatever the completion order
+        results = [results[chrom] for chrom in chrom_names]
+    else:
+        results = []
+        for i, chrom in enumerate(chrom_names):
+            logger.info(f"==================== analysing chrom/contig {i+1}/{N} ({chrom})")
+            results.append(analyse_chromosome(gc, chrom, options))
 
-        del chrom_data  # free memory for sure
-        garbage.collect()
+            # logging level seems to be reset to warning somewhere
+            logger.setLevel(options.logging_level)
 
-        # logging level seems to be reset to warning somewhere
-        logger.setLevel(options.logging_level)
+    for result in results:
+        gc._basic_stats[result["chrom_name"]] = result["basic_stats"]
+        gc._rois[result["chrom_name"]] = result["rois"]
+        gc._html_list = gc._html_list.union(result["html_list"])
 
     # create a summary file for the HTML report.
-    filenames = glob.glob(f"{options.output_directory}/*/sequana_summary_coverage.*json")
-    BOCs = []
-    DOCs = []
-    names = []
-    lengths = []
-    for filename in filenames:
-        data = json.loads(open(filename).read())["data"]
-        BOCs.append(data["BOC"])
-        lengths.append(data["length"])
-        DOCs.append(data["DOC"])
-        names.append(data["chrom_name"])
-    df = pd.DataFrame({"DOC": DOCs, "BOC": BOCs, "name": names, "length": lengths})
-    df = df.sort_values(by="name")
+    data = [result["summary"] for result in results]
+    df = pd.DataFrame(
+        {
+            "DOC": [x["DOC"] for x in data],
+            "BOC": [x["BOC"] for x in data],
+            "name": [x["chrom_name"] for x in data],
+            "length": [x["length"] for x in data],
+        }
+    )
+    df = df.sort_values(by="name", kind="stable")
     df = df[["name", "length", "DOC", "BOC"]]
     df.to_csv(f"{options.output_directory}/summary.json", index=False)
 
@@ -552,6 +604,51 @@ def main(**kwargs):
     teardown(options.output_directory, "sequana_coverage")
 
 
+def analyse_chromosome(gc, chrom_name, options):
+    """Analyse one chromosome and return the data needed by the main report
+
+    :param gc: a :class:`~sequana.bedtools.SequanaCoverage` instance
+    :param chrom_name: the chromosome to analyse
+    :param options: the sequana_coverage options
+    :return: dictionary with the chromosome name, its basic statistics, ROIs,
+        summary and HTML pages created.
+    """
+    # Performs the computation and reporting for a given chromosome
+    # This call performs the analysis, and creates the HTML page
+    # if HTML is created, it fills the gc._html_list variable
+    chrom_data = ChromosomeCov(gc, chrom_name, gc.thresholds, gc.chunksize)
+    summary = run_analysis(chrom_data, options)
+
+    del chrom_data  # free memory for sure
+    garbage.collect()
+
+    return {
+        "chrom_name": chrom_name,
+        "basic_stats": gc._basic_stats[chrom_name],
+        "rois": gc._rois[chrom_name],
+        "summary": summary.data,
+        "html_list": sorted(gc._html_list),
+    }
+
+
+# set in each worker process by _init_worker so that the SequanaCoverage
+# instance and the options are sent once per process, not once per chromosome.
+_worker_data = {}
+
+
+def _init_worker(gc, options):
+    _worker_data["gc"] = gc
+    _worker_data["options"] = options
+    logger.setLevel(options.logging_level)
+
+
+def _run_worker(chrom_name):
+    result = analyse_chromosome(_worker_data["gc"], chrom_name, _worker_data["options"])
+    # only the HTML pages of this chromosome
+    result["html_list"] = [x for x in result["html_list"] if x.startswith(f"{chrom_name}{os.sep}")]
+    return result
+
+
 def run_analysis(chrom, options):
 
     if options.w_median > len(chrom) / 4:
@@ -581,7 +678,12 @@ def run_analysis(chrom, options):
     logger.info("Using running median (w=%s)" % NW)
     logger.info("Number of mixture models %s " % options.k)
     results = chrom.run(
-        NW, options.k, circular=options.circular, binning=options.binning, cnv_delta=options.cnv_clustering
+        NW,
+        options.k,
+        circular=options.circular,
+        binning=options.binning,
+        cnv_delta=options.cnv_clustering,
+        engine=options.median_engine,
     )
     chrom.plot_coverage(f"{directory}/coverage.png")
 
@@ -631,6 +733,7 @@ def run_analysis(chrom, options):
         options={"W": NW, "k": options.k, "ROIs": ROIs, "circular": options.circular},
         command=" ".join(["sequana_coverage"] + sys.argv[1:]),
     )
+    return summary
 
 
 if __name__ == "__main__":  # pragma: no cover
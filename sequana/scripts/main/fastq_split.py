@@ -16,6 +16,24 @@ from sequana.fastq_splitter import FastqSplitter
     help="Output filename pattern (use # as placeholder for chunk number).",
 )
 @click.option("--gzip", "gzip_output", is_flag=True, help="Compress output with gzip.")
+@click.option("--bgzf", is_flag=True, help="Compress output as BGZF files (indexable gzip files). Implies --gzip.")
+@click.option(
+    "--threads",
+    type=click.IntRange(1),
+    default=4,
+    show_default=True,
+    help="Number of threads used to (de)compress files.",
+)
+@click.option(
+    "--split-mode",
+    type=click.Choice(["count", "roundrobin", "offset"]),
+    default="count",
+    show_default=True,
+    help="With --by-part, 'count' counts the reads first to create contiguous parts of same size. "
+    "'roundrobin' writes blocks of --buffer-size reads to each part in turn and 'offset' creates "
+    "contiguous parts of similar compressed size; both read the input only once.",
+)
+@click.option("--processes", is_flag=True, help="With --by-part, write each part in its own process.")
 @click.option(
     "--buffer-size",
     type=int,
@@ -23,7 +41,7 @@ from sequana.fastq_splitter import FastqSplitter
     show_default=True,
     help="Number of reads to buffer before writing to disk.",
 )
-def fastq_split(input_fastq, by_size, by_part, pattern, gzip_output, buffer_size):
+def fastq_split(input_fastq, by_size, by_part, pattern, gzip_output, bgzf, threads, split_mode, processes, buffer_size):
     """
     Split a FASTQ file into smaller parts (by number of reads or by number of parts).
 
@@ -32,17 +50,20 @@ def fastq_split(input_fastq, by_size, by_part, pattern, gzip_output, buffer_size
         sequana fastq-split reads.fastq --by-size 1000000 --pattern chunk.#.fastq.gz
 
         sequana fastq-split reads.fastq.gz --by-part 10 --pattern sample.#.fastq.gz
+
+        sequana fastq-split reads.fastq.gz --by-part 10 --split-mode roundrobin --processes --gzip
     """
     if (by_size and by_part) or not (by_size or by_part):
         raise click.UsageError("Use either --by-size or --by-part, not both.")
 
-    splitter = FastqSplitter(input_fastq)
+    splitter = FastqSplitter(input_fastq, threads=threads, bgzf=bgzf)
+    gzip_output = gzip_output or bgzf
 
     if by_size:
         logger.info(f"Splitting {input_fastq} into chunks of {by_size} reads each.")
         splitter.by_size(by_size, pattern, gzip_output, buffer_size)
     else:
         logger.info(f"Splitting {input_fastq} into {by_part} equal parts.")
-        splitter.by_part(by_part, pattern, gzip_output, buffer_size)
+        splitter.by_part(by_part, pattern, gzip_output, buffer_size, mode=split_mode, processes=processes)
 
     logger.info("Splitting completed successfully.")
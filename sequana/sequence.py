@@ -12,7 +12,7 @@
 import re
 import string
 import subprocess
-from collections import Counter, deque
+from collections import Counter
 
 import colorlog
 
@@ -30,6 +30,86 @@ __all__ = ["DNA", "RNA", "Repeats", "Sequence"]
 from sequana.iuapc import codons  # your existing dictionary
 
 
+# flexibility angles (Drew and Travers 1984) multiplied by 10 so that sliding
+# sums are exact integers. Rows and columns follow the codes of
+# _encode_sequence (A, T, G, C, others). Others are handled as N: the minimum
+# value is used (7.2 with G/C, 7.6 with A/T).
+_FLEXIBILITY_ANGLES = [
+    [76, 250, 82, 146, 76],
+    [125, 76, 109, 88, 76],
+    [88, 146, 72, 111, 72],
+    [109, 82, 89, 72, 72],
+    [76, 76, 72, 72, 72],
+]
+
+
+def _encode_sequence(sequence):
+    """Return the sequence as an array of codes (A=0, T=1, G=2, C=3, others=4)"""
+    table = np.full(256, 4, dtype=np.uint8)
+    for code, letter in enumerate(b"ATGC"):
+        table[letter] = code
+    return table[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+
+
+def _window_counts(codes, code, window):
+    """Return the number of *code* in all windows codes[s:s + window]"""
+    cumsum = np.zeros(len(codes) + 1, dtype=np.int32)
+    np.cumsum(codes == code, out=cumsum[1:])
+    return cumsum[window:] - cumsum[:-window]
+
+
+def _xlog2x(x):
+    return x * np.log2(np.maximum(x, 1))
+
+
+def _window_entropy(codes, window):
+    """Return the Shannon entropy (bits) of all windows codes[s:s + window]
+
+    The entropy is log2(W) - S / W where S is the sum of c log2(c) over the
+    counts c of each code in the window. With few codes, counts are obtained
+    from cumulative sums. Otherwise, S is updated between consecutive windows
+    using the number of occurrences of the incoming (outgoing) code in the
+    window, obtained by binary search in the positions sorted by code.
+    """
+    M = len(codes)
+    if M < window:
+        raise ValueError("window must be smaller than the sequence length")
+    ncodes = int(codes.max()) + 1
+
+    if ncodes <= 8:
+        S = sum(_xlog2x(_window_counts(codes, code, window)) for code in range(ncodes))
+    else:
+        order = np.argsort(codes, kind="stable")
+        keys = codes[order].astype(np.int64) * (M + window) + order
+        index = np.arange(M)
+        # occurrences of the same code in [j - window + 1, j] and [j, j + window)
+        before = np.empty(M, dtype=np.int32)
+        before[order] = index - np.searchsorted(keys, keys - window + 1) + 1
+        after = np.empty(M, dtype=np.int32)
+        after[order] = np.searchsorted(keys, keys + window) - index
+        del order, keys, index
+
+        ingoing = before[window:]
+        outgoing = after[: M - window]
+        delta = _xlog2x(ingoing) - _xlog2x(ingoing - 1) + _xlog2x(outgoing - 1) - _xlog2x(outgoing)
+        S = np.empty(M - window + 1)
+        S[0] = _xlog2x(np.bincount(codes[:window])).sum()
+        np.cumsum(delta, out=S[1:])
+        S[1:] += S[0]
+    return np.log2(window) - S / window
+
+
+def _center_windows(values, length, window):
+    """Map values of windows [s, s + window) to positions s + (window - 1) // 2
+
+    Both sides are padded with the first and last values to get *length* values.
+    """
+    if len(values) == 0:
+        raise ValueError("window must be smaller than the sequence length")
+    left = (window - 1) // 2
+    return np.pad(values, (left, length - len(values) - left), mode="edge")
+
+
 def translate(dna: str, to_stop=True) -> str:
     """Translate a DNA sequence to a protein using sequana.iupac.codons.
 
@@ -227,8 +307,6 @@ class DNA(Sequence):
 
         self._window = None
         self._type_window = None
-        self._slide_window = None
-        self._seq_right = None
         self._dict_nuc = dict_nuc = {"A": 0, "T": 1, "G": 2, "C": 3}
         self._cumul = None
         self._Xn = None
@@ -276,132 +354,40 @@ class DNA(Sequence):
 
     type_window = property(_get_type_window)
 
-    def _init_sliding_window(self):
-        """slide_window : deque of n first nucleotides (size of window)
-        seq_right : deque of the rest of the genome, with the n-1 nucleotides at the end (circular DNA)
-        """
-        # split sequence_reference in two : sliding window and seq_right
-        # for circular genome : add begining at the end of genome
-        self._slide_window = deque(self.sequence[0 : self._window])
-        self._seq_right = deque(self.sequence[self._window : self.__len__()] + self.sequence[0 : (self._window - 1)])
-
-    def _init_list_results(self):
-        # init IJ content and IJ skew
-        IJ_content_res = np.empty((1, self.__len__()))
-        IJ_content_res[:] = np.nan
-        IJ_skew_res = np.empty((1, self.__len__()))
-        IJ_skew_res[:] = np.nan
-        return IJ_content_res, IJ_skew_res
-
-    def _init_cumul_nuc(self):
-        """Cumulative of nucleotide count along genome (init from first window)"""
-        # ATGC (index stored in self._dict_nuc)
-        cumul = np.zeros((4, (self.__len__() + self._window)))
-        for j in range(self._window):
-            nuc = self.sequence[j]
-            if nuc in self._dict_nuc:
-                cumul[self._dict_nuc[nuc]][j] += 1
-        self._cumul = cumul
-
     def _compute_skews(self):
-        ### initialisation =  Calculating GC skew and AT skew for first window
-        self._init_sliding_window()
-        GC_content_slide, GC_skew_slide = self._init_list_results()
-        AT_content_slide, AT_skew_slide = self._init_list_results()
-        karlin_content_slide, karlin_skew_slide = self._init_list_results()
-
-        self._init_cumul_nuc()
-
-        c = Counter(self._slide_window)
-        dict_counts = {"G": c["G"], "C": c["C"], "A": c["A"], "T": c["T"]}
-        i = 0
-
-        # GC
-        sumGC = float(dict_counts["G"] + dict_counts["C"])
-        GC_content_slide[0][i] = sumGC
-        if sumGC > 0:
-            GC_skew_slide[0][i] = (dict_counts["G"] - dict_counts["C"]) / sumGC
-        # AT
-        sumAT = float(dict_counts["A"] + dict_counts["T"])
-        AT_content_slide[0][i] = sumAT
-        if sumAT > 0:
-            AT_skew_slide[0][i] = (dict_counts["A"] - dict_counts["T"]) / sumAT
-
+        # windows of the circular genome: the W-1 first bases are appended
+        codes = _encode_sequence(self.sequence)
+        W = self._window
+        circular = np.concatenate([codes, codes[: W - 1]])
+        A, T, G, C = (_window_counts(circular, self._dict_nuc[x], W) for x in "ATGC")
+
+        sumGC = (G + C).astype(float)
+        sumAT = (A + T).astype(float)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            GC_skew_slide = np.where(sumGC > 0, (G - C) / sumGC, np.nan)
+            AT_skew_slide = np.where(sumAT > 0, (A - T) / sumAT, np.nan)
+
+        self._GC_content_slide = sumGC[None, :] / W
+        self._AT_content_slide = sumAT[None, :] / W
         # karlin difference measures excess of purines over pyrimidines as G - C + A - T
-        sumAG = float(dict_counts["A"] + dict_counts["G"])
-        sumCT = float(dict_counts["C"] + dict_counts["T"])
-        karlin_content_slide[0][i] = sumAG - sumCT
-
-        ### Compute for all genome
-        while self._seq_right:
-            out_nuc = self._slide_window.popleft()
-            in_nuc = self._seq_right.popleft()
-            self._slide_window.append(in_nuc)
-
-            i += 1
-
-            if i % 500000 == 0:  # pragma: no cover
-                logger.info("%d / %d" % (i, self.__len__()))
-            # if in and out are the same : do nothing, append same result
-            if out_nuc != in_nuc:
-                # remove out from counters
-                if out_nuc in self._dict_nuc:
-                    dict_counts[out_nuc] -= 1
-                if in_nuc in self._dict_nuc:
-                    dict_counts[in_nuc] += 1
-                sumGC = float(dict_counts["G"] + dict_counts["C"])
-                sumAT = float(dict_counts["A"] + dict_counts["T"])
-                sumAG = float(dict_counts["A"] + dict_counts["G"])
-                sumCT = float(dict_counts["C"] + dict_counts["T"])
-
-            # fill results
-            # GC
-            GC_content_slide[0][i] = sumGC
-            if sumGC > 0:
-                GC_skew_slide[0][i] = (dict_counts["G"] - dict_counts["C"]) / sumGC
-            # AT
-            AT_content_slide[0][i] = sumAT
-            if sumAT > 0:
-                AT_skew_slide[0][i] = (dict_counts["A"] - dict_counts["T"]) / sumAT
-            # cumul
-            if in_nuc in self._dict_nuc:
-                self._cumul[self._dict_nuc[in_nuc]][i + self._window - 1] += 1
-
-            karlin_content_slide[0][i] = sumAG - sumCT
-
-        self._GC_content_slide = GC_content_slide / float(self._window)
-        self._AT_content_slide = AT_content_slide / float(self._window)
-        self._karlin_content_slide = karlin_content_slide / float(self._window)
-        self._cumul = np.delete(self._cumul, range(self.__len__(), self._cumul.shape[1]), 1)
-        self._cumul = np.cumsum(self._cumul, axis=1)
-
-        ### save result for Z curve
-        self._Xn = list(
-            (self._cumul[self._dict_nuc["A"]] + self._cumul[self._dict_nuc["G"]])
-            - (self._cumul[self._dict_nuc["C"]] + self._cumul[self._dict_nuc["T"]])
-        )
-
-        self._Yn = list(
-            (self._cumul[self._dict_nuc["A"]] + self._cumul[self._dict_nuc["C"]])
-            - (self._cumul[self._dict_nuc["G"]] + self._cumul[self._dict_nuc["T"]])
-        )
+        self._karlin_content_slide = ((A + G) - (C + T))[None, :] / float(W)
+        self._GC_skew_slide = GC_skew_slide[None, :]
+        self._AT_skew_slide = AT_skew_slide[None, :]
+        del A, T, G, C
 
-        self._Zn = list(
-            (self._cumul[self._dict_nuc["A"]] + self._cumul[self._dict_nuc["T"]])
-            - (self._cumul[self._dict_nuc["C"]] + self._cumul[self._dict_nuc["G"]])
-        )
+        # cumulative count of each nucleotide along the genome (ATGC)
+        self._cumul = np.empty((4, len(codes)), dtype=np.int64)
+        for nuc, index in self._dict_nuc.items():
+            np.cumsum(codes == index, out=self._cumul[index])
+        cA, cT, cG, cC = (self._cumul[self._dict_nuc[x]] for x in "ATGC")
 
-        self._AT_skew_slide = AT_skew_slide
-        self._GC_skew_slide = GC_skew_slide
+        ### save result for Z curve
+        self._Xn = (cA + cG) - (cC + cT)
+        self._Yn = (cA + cC) - (cG + cT)
+        self._Zn = (cA + cT) - (cC + cG)
 
         ### check proportion of ignored nucleotides
-        GC_content_total = (self._cumul[self._dict_nuc["G"]][-1] + self._cumul[self._dict_nuc["C"]][-1]) / float(
-            self.__len__()
-        )
-        AT_content_total = (self._cumul[self._dict_nuc["A"]][-1] + self._cumul[self._dict_nuc["T"]][-1]) / float(
-            self.__len__()
-        )
-        self._ignored_nuc = 1.0 - GC_content_total - AT_content_total
+        self._ignored_nuc = 1.0 - self._cumul[:, -1].sum() / float(self.__len__())
 
     def _get_AT_skew(self):
         if self._AT_skew_slide is None:  # pragma: no cover
@@ -471,18 +457,18 @@ class DNA(Sequence):
 
         # GC skew
         axarr[0].set_title("GC skew (blue) - Cumulative sum (red)")
-        axarr[0].plot(list(self._GC_skew_slide[0]), "b-", alpha=alpha)
+        axarr[0].plot(self._GC_skew_slide[0], "b-", alpha=alpha)
         axarr[0].set_ylabel("(G -C) / (G + C)")
 
-        axarr[1].plot(list(np.cumsum(self._GC_skew_slide[0])), "r-", alpha=alpha)
+        axarr[1].plot(np.cumsum(self._GC_skew_slide[0]), "r-", alpha=alpha)
         axarr[1].set_ylabel("(G -C) / (G + C)")
 
         # AT skew
         axarr[2].set_title("AT skew (blue) - Cumulative sum (red)")
-        axarr[2].plot(list(self._AT_skew_slide[0]), "b-", alpha=alpha)
+        axarr[2].plot(self._AT_skew_slide[0], "b-", alpha=alpha)
         axarr[2].set_ylabel("(A -T) / (A + T)")
 
-        axarr[3].plot(list(np.cumsum(self._AT_skew_slide[0])), "r-", alpha=alpha)
+        axarr[3].plot(np.cumsum(self._AT_skew_slide[0]), "r-", alpha=alpha)
         axarr[3].set_ylabel("(A -T) / (A + T)", rotation=0)
 
         # Xn
@@ -502,12 +488,12 @@ class DNA(Sequence):
 
         # GC content
         axarr[7].set_title("GC content")
-        axarr[7].plot(list(self._GC_content_slide[0]), "k-", alpha=alpha)
+        axarr[7].plot(self._GC_content_slide[0], "k-", alpha=alpha)
         axarr[7].set_ylabel("GC")
 
         # AT content
         axarr[8].set_title("AT content")
-        axarr[8].plot(list(self._AT_content_slide[0]), "k-", alpha=alpha)
+        axarr[8].plot(self._AT_content_slide[0], "k-", alpha=alpha)
         axarr[8].set_ylabel("AT")
 
         # # FFT
@@ -743,163 +729,79 @@ class DNA(Sequence):
         return -sum(pi * log(pi))
 
     def get_dna_flexibility(self, window=100, step=1, threshold=13.7):
+        """Return the DNA flexibility along the sequence
 
-        # flexibility angle
-        # Source: Drew and Travers (1984), based on DNase I digestion experiments.
-
-        # if N is present, a minimum value is used ( 7.2 with GC, 7.6 with AT)
-        flex_angles = {
-            "AA": 7.6,
-            "CA": 10.9,
-            "AC": 14.6,
-            "CC": 7.2,
-            "AG": 8.2,
-            "CG": 8.9,
-            "AT": 25,
-            "CT": 8.2,
-            "GA": 8.8,
-            "TA": 12.5,
-            "GC": 11.1,
-            "TC": 8.8,
-            "GG": 7.2,
-            "TG": 10.9,
-            "GT": 14.6,
-            "TT": 7.6,
-            "CN": 7.2,
-            "NC": 7.2,
-            "GN": 7.2,
-            "NG": 7.2,
-            "NN": 7.2,
-            "AN": 7.6,
-            "NA": 7.6,
-            "TN": 7.6,
-            "NT": 7.6,
-        }
-
-        N = len(self.sequence)
-        wby2 = int(window / 2)
-        flex = np.zeros(N)
-
-        from collections import deque
-
-        slide = deque()
-
-        # init first chunk
-        for i in range(0, window):
-            slide.append(flex_angles[self.sequence[i : i + 2]])
-        flex[wby2] = sum(slide)
-
-        for i in range(wby2, N - wby2):
-            slide.append(flex_angles[self.sequence[i : i + 2]])
-            slide.popleft()
-            flex[i] = sum(slide)
-
-        # handles the sides
-        for i in range(0, wby2):
-            flex[i] = flex[wby2]
-            flex[N - i - 1] = flex[N - wby2 - 1]
-
-        return flex / (window - 1)
+        Flexibility angles of the dinucleotides (Drew and Travers (1984), based
+        on DNase I digestion experiments) are summed over sliding windows
+        centered on each position. If N (or any other letter) is present, a
+        minimum value is used (7.2 with GC, 7.6 with AT).
+        """
+        codes = _encode_sequence(self.sequence)
+        table = np.array(_FLEXIBILITY_ANGLES, dtype=np.int64)
+        cumsum = np.zeros(len(codes), dtype=np.int64)
+        np.cumsum(table[codes[:-1], codes[1:]], out=cumsum[1:])
+        flex = _center_windows(cumsum[window:] - cumsum[:-window], len(codes), window)
+        return flex / 10.0 / (window - 1)
 
     def get_entropy(self, window):
-        step = 1
-        N = len(self.sequence)
-        wby2 = int(window / 2)
-        entropy = np.zeros(N)
-
-        import math
-        from collections import Counter
-
-        def calculate_entropy(counter, size):
-            entropy = 0
-            for count in counter.values():
-                if count > 0:
-                    p = count / size
-                    entropy -= p * math.log2(p)
-            return entropy
-
-        # init first chunk
-        counter = Counter(self.sequence[0:window])
-        entropy[wby2] = calculate_entropy(counter, window)
-
-        for i in range(wby2, N - wby2):
-            outgoing = self.sequence[i - wby2]
-            ingoing = self.sequence[i + wby2]
-            counter[ingoing] += 1
-            counter[outgoing] -= 1
-            entropy[i] = calculate_entropy(counter, window)
+        """Return the Shannon entropy (bits) of the nucleotides in sliding windows
 
-        # handles the sides
-        for i in range(0, wby2):
-            entropy[i] = entropy[wby2]
-            entropy[N - i - 1] = entropy[N - wby2 - 1]
-
-        return entropy
+        Values are given at the center of each window. Letters other than ACGT
+        are counted together.
+        """
+        codes = _encode_sequence(self.sequence)
+        return _center_windows(_window_entropy(codes, window), len(codes), window)
 
     def get_informational_entropy(self, window=500, poly=3):
-        # Informational Entropy calculated overlapping DNA triplet frequencies within a window.
-        # overlapping triplets smooths the frame effect. IE = -p*log10(p)/log10(2)
-        # rational of log10(2) ? reference ? based on UGENE
-
-        N = len(self.sequence)
-        wby2 = int(window / 2)
-        entropy = np.zeros(N)
-
-        import math
-        from collections import defaultdict
+        """Return the informational entropy of overlapping triplets in sliding windows
 
-        # Based on
-        def calculate_entropy(counter, size):
-            entropy = 0
-            log10_2 = 0.301029995  # could use math.log10(2). slower
-            for count in counter.values():
-                if count > 0:
-                    p = count / size
-                    entropy -= p * math.log10(p) / log10_2
-            return entropy
-
-        # init first chunk
-        counter = defaultdict(int)
-        for i in range(window):
-            counter[self.sequence[i : i + 3]] += 1
-
-        entropy[wby2] = calculate_entropy(counter, window)
-
-        for i in range(wby2, N - wby2):
-            outgoing = self.sequence[i - wby2 : i - wby2 + 3]
-            ingoing = self.sequence[i + wby2 : i + wby2 + 3]
-
-            counter[ingoing] += 1
-            counter[outgoing] -= 1
-            entropy[i] = calculate_entropy(counter, window)
-
-        # handles the sides
-        for i in range(0, wby2):
-            entropy[i] = entropy[wby2]
-            entropy[N - i - 1] = entropy[N - wby2 - 1]
-
-        return entropy
+        Overlapping triplets smooth the frame effect (based on UGENE). Triplets
+        with letters other than ACGT are counted together, the last two
+        (incomplete) triplets are kept.
+        """
+        codes = _encode_sequence(self.sequence)
+        # triplet codes in base 6; incomplete triplets are padded with 5
+        padded = np.concatenate([codes, [5, 5]]).astype(np.uint16)
+        triplets = padded[:-2] * 36 + padded[1:-1] * 6 + padded[2:]
+        return _center_windows(_window_entropy(triplets, window), len(codes), window)
 
     def get_dinucleotide_count(self, window=100):
-        res = [
-            sum([self.sequence[i : i + window].count(x) for x in ["AA", "CC", "GG", "TT"]])
-            for i in range(0, len(self.sequence))
-        ]
-        return res
+        """Return number of AA, CC, GG, TT (no overlap) in windows starting at each position"""
+        return self.get_homopolymers(2, window=window)
 
     def get_trinucleotide_count(self, window=100):
-        res = [
-            sum([self.sequence[i : i + window].count(x) for x in ["AAA", "CCC", "GGG", "TTT"]])
-            for i in range(0, len(self.sequence))
-        ]
-        return res
+        """Return number of AAA, CCC, GGG, TTT (no overlap) in windows starting at each position"""
+        return self.get_homopolymers(3, window=window)
 
     def get_homopolymers(self, N, window=100):
-        res = [
-            sum([self.sequence[i : i + window].count(x) for x in ["A" * N, "C" * N, "G" * N, "T" * N]])
-            for i in range(0, len(self.sequence))
-        ]
-        return res
+        """Return number of homopolymers of length N in windows starting at each position
+
+        Homopolymers are counted without overlap (e.g., AAAAA contains 2 AA) as
+        in :meth:`str.count`. Windows are truncated at the end of the sequence.
+
+        :return: list of counts (one per position)
+        """
+        codes = _encode_sequence(self.sequence)
+        L = len(codes)
+
+        # runs of identical letters; only ACGT runs are counted
+        starts = np.flatnonzero(np.concatenate([[True], codes[1:] != codes[:-1]]))
+        ends = np.append(starts[1:], L)
+        valid = codes[starts] < 4
+        full = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum((ends - starts) // N * valid, out=full[1:])
+        run = np.repeat(np.arange(len(starts)), ends - starts)
+
+        # a window [s, e) covers the end of run a, the start of run b and all runs in between
+        s = np.arange(L)
+        e = np.minimum(s + window, L)
+        a, b = run, run[e - 1]
+        counts = np.where(
+            a == b,
+            (e - s) // N * valid[a],
+            (ends[a] - s) // N * valid[a] + (e - starts[b]) // N * valid[b] + full[b] - full[a + 1],
+        )
+        return counts.tolist()
 
     def get_karlin_signature_difference(self, window=500, dinucleotide_only=False):
         # Karlin Signature Difference is dinucleotide absolute relative abundance difference
@@ -23,6 +23,7 @@ import colorlog
 from tqdm import tqdm
 
 from sequana import sequana_config_path
+from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
 from sequana.misc import wget
 from sequana.utils.singleton import Singleton
@@ -30,7 +31,7 @@ from sequana.utils.singleton import Singleton
 logger = colorlog.getLogger(__name__)
 
 
-__all__ = ["NCBITaxonomy", "Taxonomy"]
+__all__ = ["NCBITaxonomy", "Taxonomy", "TaxonomyIndex"]
 
 
 class NCBITaxonomy:
@@ -145,6 +146,246 @@ class NCBITaxonomy:
                 f.write(bindata)
 
 
+class TaxonomyIndex:
+    """Array-backed taxonomic tree for fast lineage and LCA queries
+
+    The tree is stored as int32 arrays indexed by the taxon identifier
+    (parent, depth, rank code), so that the parent of a taxon is a single
+    array access. Unknown taxons have a parent set to -1. Lowest common
+    ancestors are computed by binary lifting on whole arrays of taxons::
+
+        index = TaxonomyIndex.from_records(Taxonomy().records)
+        index.lineage(2697049)                  # taxons from root to 2697049
+        index.lca([2697049, 11234], [11234, 11234])
+        index.save("taxonomy_index.npz")
+        index = TaxonomyIndex.load("taxonomy_index.npz")
+
+    A taxon whose parent is itself (or unknown) is a root. Taxons that do
+    not share a root have no LCA (-1).
+    """
+
+    def __init__(self, taxids, parents, ranks, names):
+        """.. rubric:: constructor
+
+        :param taxids: taxon identifiers
+        :param parents: parent identifier of each taxon
+        :param ranks: rank of each taxon (strings)
+        :param names: scientific name of each taxon
+        """
+        taxids = np.asarray(taxids, dtype=np.int64)
+        parents = np.asarray(parents, dtype=np.int64)
+        if len(taxids) and taxids.min() < 0:
+            raise ValueError("taxon identifiers must be positive")
+
+        size = int(taxids.max()) + 1 if len(taxids) else 1
+
+        # position of each taxon in the list of names
+        self._node = np.full(size, -1, dtype=np.int32)
+        self._node[taxids] = np.arange(len(taxids), dtype=np.int32)
+        self.names = np.asarray(names, dtype=object)
+
+        self.rank_names, codes = np.unique(np.asarray(ranks, dtype=str), return_inverse=True)
+        self.rank = np.full(size, -1, dtype=np.int16)
+        self.rank[taxids] = codes
+
+        # orphans (parent not in the tree) become roots
+        known = (parents >= 0) & (parents < size)
+        known[known] = self._node[parents[known]] >= 0
+        self.parent = np.full(size, -1, dtype=np.int32)
+        self.parent[taxids] = np.where(known, parents, taxids)
+
+        self.depth = self._get_depth(taxids)
+        self._up = None
+
+    def _get_depth(self, taxids):
+        depth = np.full(len(self.parent), -1, dtype=np.int32)
+        depth[taxids] = 0
+        current = taxids.astype(np.int32)
+        rows = np.arange(len(taxids))
+        for _ in range(len(taxids)):
+            parent = self.parent[current]
+            moving = parent != current
+            if not moving.any():
+                break
+            rows, current = rows[moving], parent[moving]
+            depth[taxids[rows]] += 1
+        else:  # pragma: no cover
+            raise ValueError("the taxonomic tree contains a cycle")
+        return depth
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, taxid):
+        return 0 <= taxid < len(self.parent) and self.parent[taxid] >= 0
+
+    def _as_array(self, taxids):
+        taxids = np.atleast_1d(np.asarray(taxids, dtype=np.int64))
+        valid = (taxids >= 0) & (taxids < len(self.parent))
+        valid[valid] = self.parent[taxids[valid]] >= 0
+        return np.where(valid, taxids, 0).astype(np.int32), valid
+
+    @classmethod
+    def from_records(cls, records):
+        """Build the index from :attr:`Taxonomy.records`
+
+        :param records: a dataframe indexed by taxon with the *parent*,
+            *rank* and *scientific_name* columns.
+        """
+        return cls(records.index.values, records["parent"].values, records["rank"].values, records["scientific_name"].values)
+
+    @classmethod
+    def from_csv(cls, filename):
+        """Build the index from a taxonomy file (see :class:`NCBITaxonomy`)"""
+        return cls.from_records(pd.read_csv(filename, index_col=0, usecols=range(4)))
+
+    def save(self, filename, **metadata):
+        """Save the index in a NumPy .npz file
+
+        Names are stored as a single block of text. Extra keyword arguments
+        are stored as well and returned by :meth:`load` as a dictionary.
+        """
+        taxids = np.flatnonzero(self._node >= 0)
+        taxids = taxids[np.argsort(self._node[taxids])]
+        names = np.frombuffer("\n".join(map(str, self.names)).encode(), dtype=np.uint8)
+        metadata = {f"meta_{k}": np.asarray(v) for k, v in metadata.items()}
+        np.savez(
+            filename,
+            taxids=taxids,
+            parents=self.parent[taxids],
+            ranks=self.rank[taxids],
+            rank_names=self.rank_names,
+            names=names,
+            **metadata,
+        )
+
+    @classmethod
+    def load(cls, filename, with_metadata=False):
+        """Load an index saved with :meth:`save`"""
+        with np.load(filename) as data:
+            names = bytes(data["names"]).decode().split("\n")
+            ranks = data["rank_names"][data["ranks"]]
+            index = cls(data["taxids"], data["parents"], ranks, names)
+            metadata = {k[5:]: data[k].item() for k in data.files if k.startswith("meta_")}
+        if with_metadata:
+            return index, metadata
+        return index
+
+    def _get_up(self):
+        # binary lifting table: up[k][taxid] is the 2**k-th ancestor
+        if self._up is None:
+            up = [np.where(self.parent >= 0, self.parent, 0).astype(np.int32)]
+            for _ in range(1, max(int(self.depth.max()).bit_length(), 1)):
+                up.append(up[-1][up[-1]])
+            self._up = up
+        return self._up
+
+    def get_parent(self, taxids):
+        """Return the parents of taxons (-1 for unknown taxons)"""
+        taxids, valid = self._as_array(taxids)
+        return np.where(valid, self.parent[taxids], -1)
+
+    def get_ancestor(self, taxids, distance):
+        """Return the ancestors of taxons *distance* levels above them
+
+        Ancestors above the root are the root itself.
+        """
+        taxids, valid = self._as_array(taxids)
+        distance = np.broadcast_to(np.asarray(distance, dtype=np.int64), taxids.shape)
+        distance = np.minimum(distance, self.depth[taxids])
+        for k, up in enumerate(self._get_up()):
+            move = (distance >> k) & 1 == 1
+            taxids[move] = up[taxids[move]]
+        return np.where(valid, taxids, -1)
+
+    def lca(self, taxids1, taxids2):
+        """Return the lowest common ancestors of two arrays of taxons
+
+        :return: an array of taxons. -1 if one of the taxons is unknown or if
+            the taxons have no common ancestor.
+        """
+        a, valid1 = self._as_array(taxids1)
+        b, valid2 = self._as_array(taxids2)
+        a, b = np.broadcast_arrays(a, b)
+        a, b = a.copy(), b.copy()
+        valid = valid1 & valid2
+
+        # bring both taxons at the same depth
+        diff = self.depth[a] - self.depth[b]
+        a = self.get_ancestor(a, np.maximum(diff, 0))
+        b = self.get_ancestor(b, np.maximum(-diff, 0))
+        a[~valid] = 0
+        b[~valid] = 0
+
+        # and move up as long as ancestors differ
+        for up in reversed(self._get_up()):
+            up_a, up_b = up[a], up[b]
+            move = up_a != up_b
+            a[move] = up_a[move]
+            b[move] = up_b[move]
+
+        same = a == b
+        result = np.where(same, a, self.parent[a])
+        result[~same & (self.parent[a] != self.parent[b])] = -1
+        result[~valid] = -1
+        return result
+
+    def lca_reduce(self, taxids):
+        """Return the lowest common ancestor of a list of taxons
+
+        Unknown taxons are ignored. Returns -1 if no taxon is known.
+        """
+        taxids, valid = self._as_array(taxids)
+        taxids = taxids[valid]
+        if len(taxids) == 0:
+            return -1
+        # pairwise reduction of the array
+        while len(taxids) > 1:
+            if len(taxids) % 2:
+                taxids = np.append(taxids, taxids[-1])
+            taxids = self.lca(taxids[::2], taxids[1::2])
+            if (taxids < 0).any():
+                return -1
+        return int(taxids[0])
+
+    def get_lineages(self, taxids):
+        """Return the lineages of taxons as a 2D array
+
+        :return: array with one row per taxon, starting from the root. Rows
+            are padded with -1. Unknown taxons have an empty lineage.
+        """
+        taxids, valid = self._as_array(taxids)
+        position = np.where(valid, self.depth[taxids], -1)
+        lineages = np.full((len(taxids), int(position.max()) + 1 if len(taxids) else 0), -1, dtype=np.int32)
+        rows = np.arange(len(taxids))
+        while len(rows):
+            keep = position >= 0
+            rows, taxids, position = rows[keep], taxids[keep], position[keep]
+            lineages[rows, position] = taxids
+            taxids = self.parent[taxids]
+            position = position - 1
+        return lineages
+
+    def lineage(self, taxid):
+        """Return the lineage of a taxon (list of taxons starting from root)"""
+        lineage = self.get_lineages([taxid])[0]
+        return [int(x) for x in lineage[lineage >= 0]]
+
+    def get_names(self, taxids):
+        """Return the scientific names of taxons (None for unknown taxons)"""
+        taxids, valid = self._as_array(taxids)
+        names = self.names[self._node[taxids]]
+        names[~valid] = None
+        return names
+
+    def get_ranks(self, taxids):
+        """Return the ranks of taxons (None for unknown taxons)"""
+        taxids, valid = self._as_array(taxids)
+        ranks = self.rank_names.astype(object)[self.rank[taxids]]
+        ranks[~valid] = None
+        return ranks
+
+
 def load_taxons(f):
     @wraps(f)
     def wrapper(*args, **kargs):
@@ -209,6 +450,7 @@ class Taxonomy(metaclass=Singleton):
             self.ensembl = Ensembl(verbose=False)
 
         self.records = {}  # empty to start with.
+        self._index = None
         self.verbose = verbose
 
         if filename is None:
@@ -282,6 +524,43 @@ class Taxonomy(metaclass=Singleton):
         except gzip.BadGzipFile:
             logger.error(f"input file {self.database} should be gzipped")
             raise gzip.BadGzipFile
+        self._index = None
+
+    @property
+    @load_taxons
+    def index(self):
+        """The :class:`TaxonomyIndex` built from the records
+
+        The index is saved in a directory next to the database (*.sqcache*
+        extension) and rebuilt if the database changes.
+        """
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    def _load_index(self):
+        filename = os.path.join(f"{self.database}.sqcache", "taxonomy_index.npz")
+        try:
+            st = os.stat(self.database)
+            signature = f"{st.st_mtime_ns}:{st.st_size}"
+        except OSError:
+            return TaxonomyIndex.from_records(self.records)
+
+        if os.path.exists(filename):
+            try:
+                index, metadata = TaxonomyIndex.load(filename, with_metadata=True)
+                if metadata.get("signature") == signature:
+                    return index
+            except (OSError, ValueError, KeyError):  # pragma: no cover
+                pass
+
+        index = TaxonomyIndex.from_records(self.records)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            index.save(filename, signature=signature)
+        except OSError as err:  # pragma: no cover
+            logger.warning(f"Could not save the taxonomy index in {filename}: {err}")
+        return index
 
     def load_records_from_csv(self, filename):
         df = pd.read_csv(filename)
@@ -339,28 +618,38 @@ class Taxonomy(metaclass=Singleton):
         :return: list containing the lineage
 
         """
-        # important to reinit the second argument to []
-        lineage = self._gen_lineage_and_rank(taxon, [])
+        lineage = self._gen_lineage_and_rank(taxon)
         return [x[0] for x in lineage]
 
     @load_taxons
-    def _gen_lineage_and_rank(self, taxon, lineage_rank=[]):
-        # recursively filling the lineage argument
-
-        try:
-            record = self.records.loc[taxon]
-        except Exception as err:
-            print(err)
+    def _gen_lineage_and_rank(self, taxon):
+        lineage = self.index.lineage(taxon)
+        if len(lineage) == 0:
+            logger.warning(f"taxon {taxon} not found")
             return [("unknown_taxon:{}".format(taxon), "no rank")]
-        parent = int(record["parent"])
+        names = self.index.get_names(lineage)
+        ranks = self.index.get_ranks(lineage)
+        return list(zip(names, ranks))
 
-        if taxon == 1:
-            lineage_rank.append((record["scientific_name"], record["rank"]))
-            lineage_rank.reverse()
-            return lineage_rank
-        else:
-            lineage_rank.append((record["scientific_name"], record["rank"]))
-            return self._gen_lineage_and_rank(parent, lineage_rank)
+    @load_taxons
+    def get_lineages_and_ranks(self, taxons):
+        """Get lineages and ranks of a list of taxons
+
+        Same as :meth:`get_lineage_and_rank` for a list of taxons. Lineages
+        are retrieved at once from the :attr:`index`.
+        """
+        lineages = self.index.get_lineages(taxons)
+        mask = lineages >= 0
+        names = self.index.get_names(lineages.ravel()).reshape(lineages.shape)
+        ranks = self.index.get_ranks(lineages.ravel()).reshape(lineages.shape)
+
+        results = []
+        for taxon, row, name, rank in zip(taxons, mask, names, ranks):
+            if row.any():
+                results.append(list(zip(name[row], rank[row])))
+            else:
+                results.append([("unknown_taxon:{}".format(taxon), "no rank")])
+        return results
 
     @load_taxons
     def get_parent_taxon(self, taxon):
@@ -380,7 +669,7 @@ class Taxonomy(metaclass=Singleton):
             The list is the lineage for to the input taxon.
 
         """
-        return self._gen_lineage_and_rank(taxon, [])
+        return self._gen_lineage_and_rank(taxon)
 
     @load_taxons
     def get_ranks(self):
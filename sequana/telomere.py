@@ -1,12 +1,16 @@
-from collections import Counter, defaultdict
+import io
+from collections import defaultdict
+from multiprocessing import Pool
 
 from tqdm import tqdm
 
 from sequana import FastA, FastQ, logger
-from sequana.kmer import get_kmer
+from sequana.compression import open_compressed
+from sequana.fastq import iter_fastq_batches
+from sequana.kmer import KmerCounter, count_kmer_occurrences
 from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
-from sequana.lazy import pylab, pysam, scipy
+from sequana.lazy import pylab, scipy
 from sequana.tools import reverse_complement
 
 # Thresholds used in find_LHS/RHS_telomere gap warnings
@@ -152,9 +156,11 @@ class Telomere:
         """
         N = min([N, len(seq)])
 
-        counts = Counter(get_kmer(seq[0:N], kmers))
+        counter = KmerCounter(k=kmers)
+        counter.update(seq[0:N])
+        counts = counter.to_series()
 
-        normed_counts = [x / float(N) for x in counts.values()]
+        normed_counts = (counts / float(N)).tolist()
         self._normed_counts = normed_counts
 
         mu = np.mean(normed_counts)
@@ -765,12 +771,44 @@ class Telomere:
         return df
 
 
+def _get_telomeric_ratio(batch, kmers):
+    counts = count_kmer_occurrences(batch.sequences, kmers, lengths=batch.lengths)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return counts * len(kmers[0]) / batch.lengths
+
+
+def _split_telomeric_batch(batch, kmers, threshold):
+    # telomeric and non telomeric records of a FastQBatch (bytes)
+    telomeric = _get_telomeric_ratio(batch, kmers) >= threshold
+    return batch.to_bytes(telomeric), batch.to_bytes(~telomeric), int(telomeric.sum()), len(batch)
+
+
+def _init_filter_worker(kmers, threshold):
+    global _FILTER_PARAMETERS
+    _FILTER_PARAMETERS = (kmers, threshold)
+
+
+def _split_telomeric_records(data):
+    # worker: records are sent as raw FASTQ bytes
+    batch = next(iter_fastq_batches(io.BytesIO(data), n=len(data)))
+    return _split_telomeric_batch(batch, *_FILTER_PARAMETERS)
+
+
 class TelomerFilter:
     """Filter reads based on telomeric repeat content.
 
     :param str filename: Input FastQ file (can be .gz)
     :param str pattern: Telomeric repeat unit (default: "AACCCT")
     :param float threshold: Fraction of the read that must be telomeric (default: 0.8)
+
+    The fraction is the number of k-mers of a read that are circular shifts of
+    the pattern (or of its reverse complement) times the pattern length
+    divided by the read length. All k-mers are found in a single pass over
+    batches of reads (see :func:`sequana.kmer.count_kmer_occurrences`)::
+
+        tf = TelomerFilter("reads.fastq.gz")
+        tf.save_reads("telomeric.fastq.gz", "non_telomeric.fastq.gz", processes=4)
+
     """
 
     def __init__(self, filename, pattern="AACCCT", threshold=0.8):
@@ -781,56 +819,76 @@ class TelomerFilter:
         self.fastq = FastQ(filename)
 
         # Build kmers (all circular shifts of pattern and its reverse complement)
-        self.kmers = circular_shifts(pattern) + circular_shifts(reverse_complement(pattern))
+        self.kmers = sorted(set(circular_shifts(pattern) + circular_shifts(reverse_complement(pattern))))
+
+    def get_telomeric_ratio(self, batch):
+        """Return the telomeric fraction of each read of a :class:`~sequana.fastq.FastQBatch`"""
+        return _get_telomeric_ratio(batch, self.kmers)
 
-    def save_reads(self, telomeric_output=None, non_telomeric_output=None, progress=True):
-        """Identify and save reads list on-the-fly for maximum speed.
+    def save_reads(
+        self,
+        telomeric_output=None,
+        non_telomeric_output=None,
+        progress=True,
+        threads=None,
+        processes=None,
+        batch_size=100000,
+    ):
+        """Identify and save telomeric and non telomeric reads
 
         :param str telomeric_output: File to save telomeric reads (optional)
         :param str non_telomeric_output: File to save non-telomeric reads (optional)
+        :param int threads: threads used to compress outputs ending in .gz
+        :param int processes: number of processes used to classify the
+            batches of reads. Outputs are written by the main process in the
+            order of the input file.
+        :param int batch_size: number of reads per batch
+        :return: number of telomeric reads
         """
-        fastq = pysam.FastxFile(self.filename)
-
         f_telo = None
         f_non_telo = None
-        tozip_telo = False
-        tozip_non_telo = False
+        pool = None
 
         if telomeric_output:
-            telomeric_output, tozip_telo = self.fastq._istozip(telomeric_output)
-            f_telo = open(telomeric_output, "w")
+            f_telo = open_compressed(telomeric_output, "wb", threads=threads)
 
         if non_telomeric_output:
-            non_telomeric_output, tozip_non_telo = self.fastq._istozip(non_telomeric_output)
-            f_non_telo = open(non_telomeric_output, "w")
+            f_non_telo = open_compressed(non_telomeric_output, "wb", threads=threads)
 
-        try:
-            for read in tqdm(fastq, disable=not progress, desc="Filtering telomeric reads"):
-                sequence = read.sequence
-                count = sum(sequence.count(k) for k in self.kmers)
-                ratio = (count * len(self.pattern)) / len(sequence)
+        batches = self.fastq.iter_batches(n=batch_size)
+        if processes and processes > 1:
+            pool = Pool(processes, initializer=_init_filter_worker, initargs=(self.kmers, self.threshold))
+            results = pool.imap(_split_telomeric_records, (bytes(batch.raw) for batch in batches))
+        else:
+            results = (_split_telomeric_batch(batch, self.kmers, self.threshold) for batch in batches)
 
-                if ratio >= self.threshold:
+        count = 0
+        total = 0
+        try:
+            with tqdm(disable=not progress, desc="Filtering telomeric reads", unit=" reads") as pb:
+                for telomeric, non_telomeric, N, size in results:
                     if f_telo:
-                        f_telo.write(read.__str__() + "\n")
-                else:
+                        f_telo.write(telomeric)
                     if f_non_telo:
-                        f_non_telo.write(read.__str__() + "\n")
+                        f_non_telo.write(non_telomeric)
+                    count += N
+                    total += size
+                    pb.update(size)
         finally:
+            if pool is not None:
+                pool.terminate()
             if f_telo is not None:
                 f_telo.close()
             if f_non_telo is not None:
                 f_non_telo.close()
 
-        if tozip_telo:
-            self.fastq._gzip(telomeric_output)
-        if tozip_non_telo:
-            self.fastq._gzip(non_telomeric_output)
+        logger.info(f"Found {count} telomeric reads out of {total}")
+        return count
 
     def save_telomeric_reads(self, output_filename="telomeric.fastq", progress=True):
         """Save telomeric reads to a file."""
-        self.save_reads(telomeric_output=output_filename, progress=progress)
+        return self.save_reads(telomeric_output=output_filename, progress=progress)
 
     def save_non_telomeric_reads(self, output_filename="non_telomeric.fastq", progress=True):
         """Save non-telomeric reads to a file."""
-        self.save_reads(non_telomeric_output=output_filename, progress=progress)
+        return self.save_reads(non_telomeric_output=output_filename, progress=progress)
@@ -18,12 +18,12 @@ import re
 import shutil
 import string
 import subprocess
-from collections import Counter
 
 import colorlog
 from tqdm import tqdm
 
 from sequana.bamtools import BAM
+from sequana.compression import get_backend, open_compressed
 from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
 from sequana.lazy import pysam
@@ -79,7 +79,7 @@ class StatsBAM2Mapped:
         return html
 
 
-def bam_to_mapped_unmapped_fastq(filename, output_directory=None, progress=True):
+def bam_to_mapped_unmapped_fastq(filename, output_directory=None, progress=True, compress=False, threads=None):
     """Create mapped and unmapped fastq files from a BAM file
 
     :context: given a reference, one or two FastQ files are mapped onto the
@@ -89,6 +89,9 @@ def bam_to_mapped_unmapped_fastq(filename, output_directory=None, progress=True)
 
     :param filename: input BAM file
     :param output_directory: where to save the mapped and unmapped files
+    :param compress: if True, the FASTQ files are compressed on the fly
+        (.fastq.gz extension) using *threads* threads (see
+        :func:`sequana.compression.open_compressed`).
     :return: dictionary with number of reads for each file (mapped/unmapped for
         R1/R2) as well as the mode (paired or not), the number of unpaired
         reads, and the number of duplicated reads. The unpaired reads should
@@ -153,8 +156,9 @@ def bam_to_mapped_unmapped_fastq(filename, output_directory=None, progress=True)
     rt1 = "_R1_"
     rt2 = "_R2_"
 
-    R1_mapped = open(newname + "{}.mapped.fastq".format(rt1), "wb")
-    R1_unmapped = open(newname + "{}.unmapped.fastq".format(rt1), "wb")
+    fastq_ext = ".fastq.gz" if compress else ".fastq"
+    R1_mapped = open_compressed(newname + "{}.mapped{}".format(rt1, fastq_ext), "wb", threads=threads)
+    R1_unmapped = open_compressed(newname + "{}.unmapped{}".format(rt1, fastq_ext), "wb", threads=threads)
     stats["duplicated"] = 0
     stats["unpaired"] = 0
 
@@ -165,8 +169,8 @@ def bam_to_mapped_unmapped_fastq(filename, output_directory=None, progress=True)
         stats["mode"] = "pe"
         stats["R2_unmapped"] = 0
         stats["R2_mapped"] = 0
-        R2_mapped = open(newname + "{}.mapped.fastq".format(rt2), "wb")
-        R2_unmapped = open(newname + "{}.unmapped.fastq".format(rt2), "wb")
+        R2_mapped = open_compressed(newname + "{}.mapped{}".format(rt2, fastq_ext), "wb", threads=threads)
+        R2_unmapped = open_compressed(newname + "{}.unmapped{}".format(rt2, fastq_ext), "wb", threads=threads)
     else:
         stats["mode"] = "se"
 
@@ -310,37 +314,92 @@ def fast_gc_content(chrom):
     return GC / (L - xX)
 
 
+def _get_letters_lut(letters):
+    # lookup table of the bytes to be counted
+    lut = np.zeros(256, dtype=bool)
+    lut[np.frombuffer("".join(letters).encode(), dtype=np.uint8)] = True
+    return lut
+
+
+def sliding_window_count(sequence, window_size, letters="GC", circular=False, chunksize=10000000):
+    """Count letters in a sliding window along a sequence
+
+    :param sequence: a string or bytes
+    :param int window_size: window length
+    :param letters: letters to count (e.g. "GCgc")
+    :param bool circular: if True, the sequence is padded with its ends so
+        that there is a window centered on each base.
+    :param chunksize: the cumulative sum is computed by chunks of this size
+        to limit memory usage.
+    :return: integer array of counts. In the circular case, the i-th value
+        is the count of the window centered on base i (L values). Otherwise,
+        there are L - W + 1 values, the first one being the count of the
+        window centered on base W//2.
+
+    The sequence is encoded as an array of bytes. A lookup table gives the
+    letters to count and the window counts are computed as differences of the
+    cumulative sum, which is O(n) and vectorised.
+
+    ::
+
+        >>> sliding_window_count("AAGCGCAA", 3, "GC")
+        array([1, 2, 3, 3, 2, 1], dtype=uint16)
+    """
+    if isinstance(sequence, str):
+        sequence = sequence.encode()
+    mask = _get_letters_lut(letters)[np.frombuffer(sequence, dtype=np.uint8)]
+
+    if circular:
+        # pad with the end and start of the sequence (W - 1 values are added)
+        mid = window_size // 2
+        L = len(mask)
+        mask = np.concatenate([mask[L - mid :], mask, mask[: window_size - 1 - mid]])
+
+    N = max(len(mask) - window_size + 1, 0)
+    counts = np.empty(N, dtype=np.uint16 if window_size < 2**16 else np.uint32)
+    for start in range(0, N, chunksize):
+        segment = mask[start : start + chunksize + window_size - 1]
+        cumsum = np.zeros(len(segment) + 1, dtype=np.int64)
+        np.cumsum(segment, out=cumsum[1:])
+        counts[start : start + chunksize] = cumsum[window_size:] - cumsum[:-window_size]
+    return counts
+
+
+def _counts_to_content(counts, length, window_size, circular=False):
+    # content of the windows centered on each base. Not circular: the
+    # first and last W/2 values are NaN.
+    content = np.empty(length)
+    content[:] = np.nan
+    if circular:
+        content[:] = counts / window_size
+    else:
+        mid = int(window_size / 2)
+        content[mid : mid + len(counts)] = counts / window_size
+    return content
+
+
+def sliding_base_content(sequence, window_size, letters="GC", circular=False):
+    """Return the fraction of letters in a sliding window centered on each base
+
+    See :func:`sliding_window_count` for details. In the non circular case,
+    the values at the edges of the sequence are NaN.
+    """
+    L = len(sequence)
+    counts = sliding_window_count(sequence, window_size, letters, circular=circular)
+    content = _counts_to_content(counts, L, window_size, circular=circular)
+    if len(counts) == 0 and window_size // 2 < L:
+        # sequence shorter than the window: one value computed on the whole
+        # sequence, as in previous versions
+        content[window_size // 2] = sliding_window_count(sequence, L, letters)[0] / window_size
+    return content
+
+
 def _base_content(filename, window_size, letters, circular=False):
     # DOC: see gc_content
     fasta = pysam.FastxFile(filename)
-    checker = set(letters)
     chrom_gc_content = dict()
     for chrom in fasta:
-        mid = int(window_size / 2)
-
-        # Create gc_content array
-        gc_content = np.empty(len(chrom.sequence))
-        gc_content[:] = np.nan
-        if circular:
-            chrom.sequence = chrom.sequence[-mid:] + chrom.sequence + chrom.sequence[:mid]
-            # Does not shift index of array
-            mid = 0
-
-        # Count first window content
-        counter = Counter(chrom.sequence[0:window_size])
-        gc_count = 0
-        for letter in letters:
-            gc_count += counter[letter]
-
-        gc_content[mid] = gc_count
-
-        for i in range(1, len(chrom.sequence) - window_size + 1):
-            if chrom.sequence[i - 1] in checker:
-                gc_count -= 1
-            if chrom.sequence[i + window_size - 1] in checker:
-                gc_count += 1
-            gc_content[i + mid] = gc_count
-        chrom_gc_content[chrom.name] = gc_content / window_size
+        chrom_gc_content[chrom.name] = sliding_base_content(chrom.sequence, window_size, letters, circular=circular)
     return chrom_gc_content
 
 
@@ -355,10 +414,133 @@ def gc_content(filename, window_size, circular=False, letters=["G", "C", "c", "g
     .. todo:: case when the genome is not circular -> Add NaN at start and stop of
         the np.arange()
 
+    .. seealso:: :func:`get_base_content` to get the content of one sequence
+        only, with an optional on-disk cache.
     """
     return _base_content(filename, window_size, letters, circular=circular)
 
 
+class BaseContentCache(object):
+    """On-disk cache of sliding window base content of a FASTA file
+
+    Counts computed with :func:`sliding_window_count` are stored as .npy
+    files in a directory next to the FASTA file (FASTA name with the
+    *.sqcache* extension), one file per sequence, letters, window size and
+    circularity. Files are memory-mapped when read. The cache is emptied
+    as soon as the modification time or the size of the FASTA file changes.
+
+    ::
+
+        cache = BaseContentCache("reference.fa")
+        counts = cache.get("chr1", 101, "GCgc")
+
+    """
+
+    version = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.directory = f"{filename}.sqcache"
+        self.index_filename = os.path.join(self.directory, "base_content.json")
+
+    def _get_signature(self):
+        st = os.stat(self.filename)
+        return {"mtime": st.st_mtime_ns, "size": st.st_size, "version": self.version}
+
+    def _get_filename(self, name, window_size, letters, circular):
+        import hashlib
+
+        key = hashlib.md5(f"{name}:{window_size}:{''.join(letters)}:{circular}".encode()).hexdigest()
+        return os.path.join(self.directory, f"base_content_{key}.npy")
+
+    def _check(self):
+        # remove outdated files. Return False if the cache cannot be used.
+        try:
+            with open(self.index_filename, "r") as fin:
+                valid = json.load(fin) == self._get_signature()
+        except (OSError, ValueError):
+            valid = False
+
+        if valid:
+            return True
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for filename in os.listdir(self.directory):
+                if filename.startswith("base_content_"):
+                    os.remove(os.path.join(self.directory, filename))
+            with open(self.index_filename, "w") as fout:
+                json.dump(self._get_signature(), fout)
+        except OSError as err:
+            logger.warning(f"Could not use the cache {self.directory}: {err}")
+            return False
+        return True
+
+    def get(self, name, window_size, letters, circular=False, sequence=None):
+        """Return the counts of a sequence (see :func:`sliding_window_count`)
+
+        :param sequence: the sequence itself if already available. Otherwise
+            it is read from the FASTA file.
+        """
+        if not self._check():
+            return None
+
+        filename = self._get_filename(name, window_size, letters, circular)
+        if os.path.exists(filename):
+            return np.load(filename, mmap_mode="r")
+
+        if sequence is None:
+            sequence = _get_sequence(self.filename, name)
+        counts = sliding_window_count(sequence, window_size, letters, circular=circular)
+        np.save(filename, counts)
+        return counts
+
+
+def _get_sequence(filename, name):
+    # use the FASTA index if available, otherwise scan the file
+    if os.path.exists(f"{filename}.fai"):
+        with pysam.FastaFile(filename) as fasta:
+            if name in fasta.references:
+                return fasta.fetch(name)
+    for chrom in pysam.FastxFile(filename):
+        if chrom.name == name:
+            return chrom.sequence
+    raise KeyError(f"{name} not found in {filename}")
+
+
+def get_base_content(filename, name, window_size, letters="GCgc", circular=False, cache=False):
+    """Return the sliding window base content of one sequence of a FASTA file
+
+    :param filename: a FASTA file (indexed or not)
+    :param name: the sequence name
+    :param window_size: window length
+    :param letters: letters to count
+    :param circular: set to True if sequence is circular.
+    :param cache: if True, counts are stored on disk (see
+        :class:`BaseContentCache`) so that they are computed once per
+        reference and window size.
+    :return: the content of the windows centered on each base (see
+        :func:`sliding_base_content`).
+
+    If the FASTA file is indexed (.fai file), only the requested sequence is
+    read.
+    """
+    sequence = None
+    counts = None
+    if cache:
+        counts = BaseContentCache(filename).get(name, window_size, letters, circular=circular)
+
+    if counts is None or len(counts) == 0:
+        sequence = _get_sequence(filename, name)
+        return sliding_base_content(sequence, window_size, letters, circular=circular)
+
+    if circular:
+        length = len(counts)
+    else:
+        length = len(counts) + window_size - 1
+    return _counts_to_content(counts, length, window_size, circular=circular)
+
+
 def genbank_features_parser(input_filename):
     """Return dictionary with features contains inside a genbank file.
 
@@ -433,7 +615,8 @@ def genbank_features_parser(input_filename):
 class GZLineCounter(object):
     """Fast GZipped line counter
 
-    Uses zcat if possible, otherwise gzip library (twice as slow).
+    Uses pigz or igzip if possible (see :mod:`sequana.compression`), otherwise
+    zcat or the gzip library (twice as slow).
 
     .. doctest::
 
@@ -447,7 +630,9 @@ class GZLineCounter(object):
 
     def __init__(self, filename):
         self.filename = filename
-        if shutil.which("zcat"):
+        if get_backend() in ("pigz", "igzip"):
+            self.use_zcat = False
+        elif shutil.which("zcat"):
             self.use_zcat = True
         else:  # pragma: no cover
             self.use_zcat = False
@@ -456,7 +641,16 @@ class GZLineCounter(object):
         if self.use_zcat:
             return self._use_zcat()
         else:
-            return self._use_gzip()
+            return self._use_stream()
+
+    def _use_stream(self, block=1024 * 1024):
+        i = 0
+        with open_compressed(self.filename, "rb") as fin:
+            buf = fin.read(block)
+            while buf:
+                i += buf.count(b"\n")
+                buf = fin.read(block)
+        return i
 
     def _use_zcat(self):
         i = 0
@@ -184,3 +184,53 @@ def mlnTest2l(a, ab, ac, abcd):
                 break
             sl = sl_new
         return max(0, pa - p0 - log(sl))
+
+
+def fisher_exact_two_sided(a, b, c, d, max_size=2**22):
+    """Two-sided Fisher test of many 2x2 tables [[a, b], [c, d]] at once
+
+    Same as :func:`fisher_exact` with *two-sided* alternative but the
+    inputs are arrays (one table per element). The p-value is the sum of the
+    probabilities of the tables (with the same margins) that are not more
+    likely than the observed one.
+
+    :param max_size: tables are processed by blocks so that the number of
+        tables with the same margins is at most *max_size* per block.
+    :return: array of p-values
+    """
+    import numpy as np
+    from scipy.special import gammaln
+
+    a, b, c, d = (np.asarray(x, dtype=np.int64).ravel() for x in np.broadcast_arrays(a, b, c, d))
+    if ((a < 0) | (b < 0) | (c < 0) | (d < 0)).any():
+        raise ValueError("invalid contingency table")
+    ab, ac, n = a + b, a + c, a + b + c + d
+    a_min = np.maximum(0, ab + ac - n)
+    counts = np.minimum(ab, ac) - a_min + 1
+
+    # log probability of each table (up to a constant per set of margins)
+    def logp(x, rows):
+        ab_, ac_, n_ = ab[rows], ac[rows], n[rows]
+        return -(gammaln(x + 1) + gammaln(ab_ - x + 1) + gammaln(ac_ - x + 1) + gammaln(n_ - ab_ - ac_ + x + 1))
+
+    constant = gammaln(ab + 1) + gammaln(n - ab + 1) + gammaln(ac + 1) + gammaln(n - ac + 1) - gammaln(n + 1)
+    observed = logp(a, np.arange(len(a)))
+
+    pvalues = np.zeros(len(a))
+    # blocks of consecutive tables with at most max_size tables to enumerate
+    ends = np.searchsorted(np.cumsum(counts), np.arange(max_size, counts.sum() + max_size, max_size), side="right")
+    start = 0
+    for end in np.unique(np.append(ends, len(a))):
+        end = max(end, start + 1)
+        if start >= len(a):
+            break
+        block = counts[start:end]
+        rows = np.repeat(np.arange(start, end), block)
+        x = a_min[rows] + np.arange(block.sum()) - np.repeat(np.cumsum(block) - block, block)
+        values = logp(x, rows)
+        # relative tolerance as in scipy.stats.fisher_exact
+        keep = values <= observed[rows] + 1e-7
+        weights = np.exp(values + constant[rows]) * keep
+        pvalues[start:end] = np.bincount(rows - start, weights=weights, minlength=end - start)
+        start = end
+    return np.minimum(pvalues, 1.0)
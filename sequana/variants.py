@@ -10,13 +10,18 @@
 #  documentation: http://sequana.readthedocs.io
 #
 ##############################################################################
+import os
 from collections import defaultdict
+from multiprocessing import Pool
+from pathlib import Path
 
 import colorlog
 from tqdm import tqdm
 
+from sequana.lazy import numpy as np
 from sequana.lazy import pandas as pd
 from sequana.lazy import pylab, pysam
+from sequana.utils.fisher import fisher_exact_two_sided
 from sequana.vcftools import (
     compute_fisher_strand_filter,
     compute_frequency,
@@ -50,6 +55,13 @@ class VariantFile:
 
         v.df
 
+    For large files, prefer the :attr:`table` attribute: a dataframe with one
+    row per variant (record index, position, quality, depths, frequency,
+    strand balance, Fisher strand test...) built chunk by chunk without
+    keeping the records in memory. It is used by :meth:`filter_vcf`::
+
+        v.table
+
     Samples and contigs/chromosomes are available also as attributes::
 
         v.samples
@@ -88,6 +100,7 @@ class VariantFile:
         self._samples = None
         self._contigs = None
         self._df = None
+        self._table = None
         self._is_joint = None
 
         self._snpeff = False
@@ -101,9 +114,7 @@ class VariantFile:
         # do we used snpeff ? (empty VCF has no variant to inspect)
         try:
             variant = next(_vcf)
-            variant_dict = self._variant_to_dict(variant)
-            if "effect_type" in variant_dict:
-                self._snpeff = True
+            self._snpeff = "EFF" in variant.info
         except StopIteration:
             self._snpeff = False
 
@@ -117,18 +128,144 @@ class VariantFile:
 
     is_joint = property(_is_joint)
 
+    def _iter_records(self, indices=None):
+        """Stream the records of the input file
+
+        Records are identified by their index (from 0); their ID is set to
+        index + 1.
+
+        :param indices: if provided, only the records with these indices are
+            returned.
+        """
+        if indices is not None:
+            indices = np.unique(np.asarray(indices, dtype=np.int64))
+            if len(indices) == 0:
+                return
+        with pysam.VariantFile(self.filename) as vcf_reader:
+            for i, variant in enumerate(vcf_reader):
+                if indices is not None:
+                    if i > indices[-1]:
+                        break
+                    if indices[np.searchsorted(indices, i)] != i:
+                        continue
+                variant.id = str(i + 1)
+                yield variant
+
     def _get_variants(self):
         if self._variants is None:
-            vcf_reader = pysam.VariantFile(self.filename)
-            self._variants = [v for v in vcf_reader]
-            for i, v in enumerate(self._variants):
-                v.id = str(i + 1)
+            self._variants = list(self._iter_records())
         return self._variants
 
     variants = property(_get_variants)
 
+    def iter_tables(self, chunksize=100000):
+        """Stream the input file as dataframes of *chunksize* variants
+
+        Only the fields used to filter variants are extracted (see
+        :attr:`table`), records are not kept in memory.
+        """
+        names = ["index", "chrom", "pos", "qual", "n_alts", "DP", "depth", "AO", "VAF", "SRF", "SRR", "SAF", "SAR"]
+        names += ["SAF_sum", "SAR_sum"]
+        samples = self.samples if self.is_joint else []
+
+        def first(values):
+            # first value of Number=A fields
+            return values[0] if isinstance(values, tuple) else values
+
+        with pysam.VariantFile(self.filename) as vcf_reader:
+            rows = []
+            for i, variant in enumerate(vcf_reader):
+                info = variant.info
+                keys = set(info.keys())
+                dp = info["DP"] if "DP" in keys else None
+                depth = dp if dp is not None else (info["COVERAGE"][2] if "COVERAGE" in keys else None)
+                saf = info["SAF"] if "SAF" in keys else None
+                sar = info["SAR"] if "SAR" in keys else None
+                row = [
+                    i,
+                    variant.chrom,
+                    variant.pos,
+                    variant.qual,
+                    len(variant.alts) if variant.alts else 0,
+                    dp,
+                    depth,
+                    first(info["AO"]) if "AO" in keys else None,
+                    first(info["VAF"]) if "VAF" in keys else None,
+                    info["SRF"] if "SRF" in keys else None,
+                    info["SRR"] if "SRR" in keys else None,
+                    first(saf),
+                    first(sar),
+                    sum(saf) if isinstance(saf, tuple) else saf,
+                    sum(sar) if isinstance(sar, tuple) else sar,
+                ]
+                for sample in samples:
+                    data = variant.samples[sample]
+                    row.append(data["DP"] if "DP" in data else None)
+                    row.append(first(data["AO"]) if "AO" in data else None)
+                rows.append(row)
+                if len(rows) == chunksize:
+                    yield self._build_table(rows, names, samples)
+                    rows = []
+            if rows:
+                yield self._build_table(rows, names, samples)
+
+    def _build_table(self, rows, names, samples):
+        columns = names + [f"{sample}:{field}" for sample in samples for field in ("DP", "AO")]
+        df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        for name in columns:
+            if name != "chrom":
+                df[name] = pd.to_numeric(df[name], errors="coerce").astype(float)
+        df["index"] = df["index"].astype(np.int64)
+        df["pos"] = df["pos"].astype(np.int64)
+        df["n_alts"] = df["n_alts"].astype(np.int64)
+
+        # first alternate allele (as in compute_frequency, compute_strand_balance
+        # and compute_fisher_strand_filter)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frequency = df["AO"].to_numpy() / df["DP"].to_numpy()
+            frequency[~np.isfinite(frequency)] = np.nan
+            df["frequency"] = np.where(np.isnan(frequency), df["VAF"], frequency)
+
+            saf, sar = df["SAF"].to_numpy(), df["SAR"].to_numpy()
+            ratio = saf / (saf + sar)
+            ratio = np.where(ratio > 0.5, 1 - ratio, ratio)
+            ratio[(saf + sar) == 0] = 0
+            df["strand_balance"] = np.where(np.isnan(saf) | np.isnan(sar), 0.5, ratio)
+
+        df["forward_depth"] = df["SRF"] + df["SAF_sum"]
+        df["reverse_depth"] = df["SRR"] + df["SAR_sum"]
+
+        table = df[["SAF", "SAR", "SRF", "SRR"]].to_numpy()
+        valid = ~np.isnan(table).any(axis=1)
+        pvalues = np.ones(len(df))
+        if valid.any():
+            pvalues[valid] = fisher_exact_two_sided(*table[valid].astype(np.int64).T)
+        df["fisher_pvalue"] = pvalues
+        return df
+
+    def _get_table(self):
+        if self._table is None:
+            chunks = list(self.iter_tables())
+            self._table = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+        return self._table
+
+    table = property(
+        _get_table,
+        doc="""Dataframe with one row per variant and the fields used to filter them
+
+        Columns are the record index, chrom, pos, qual, number of alternate
+        alleles (n_alts), the DP, AO, VAF, SRF, SRR, SAF and SAR INFO fields
+        (first alternate allele), forward/reverse depth (SAF and SAR summed
+        over the alternate alleles), frequency, strand balance and Fisher
+        strand test p-value of the first alternate allele. For joint calling
+        files, DP and AO FORMAT fields of each sample are added. Missing
+        fields are NaN.""",
+    )
+
     def __len__(self):
-        return len(self.variants)
+        if self._variants is not None:
+            return len(self._variants)
+        return len(self.table)
 
     def __iter__(self):
         return self
@@ -168,14 +305,50 @@ class VariantFile:
         """Filter variants in the VCF file.
 
         :param dict filter_dict: dictionary of filters. It updates the
-            attribute :attr:`VCF_freebayes.filter_params`
+            attribute :attr:`VCF_freebayes.filter_params`. An optional
+            *fisher_pvalue* filter removes variants with a lower Fisher
+            strand test p-value.
 
         Return Filtered_freebayes object.
+
+        Filters are applied on the :attr:`table`; records that pass the
+        filters are read again from the input file when needed.
         """
         if filter_dict:
             self.filters_params = filter_dict
-        variants = [v for v in self.variants if self._filter_line(v)]
-        return FilteredVariantFile(variants, self)
+        indices = self.table["index"].to_numpy()[self._filter_table(self.table)] if len(self) else []
+        return FilteredVariantFile(None, self, indices=indices)
+
+    def _filter_table(self, df):
+        """Vectorised version of :meth:`_filter_line`; returns a boolean mask"""
+        params = self.filters_params
+
+        def column(name, mask):
+            # as in _filter_line, a missing field raises an error if needed
+            values = df[name].to_numpy()
+            if np.isnan(values[mask]).any():
+                raise KeyError(name)
+            return values
+
+        # variants without quality (NaN) are filtered out
+        mask = df["qual"].to_numpy() >= params["freebayes_score"]
+        mask &= column("DP", mask) > params["min_depth"]
+
+        if self.is_joint:
+            return mask
+
+        for name in ("SRF", "SAF_sum"):
+            column(name, mask)
+        mask &= df["forward_depth"].to_numpy() > params["forward_depth"]
+        for name in ("SRR", "SAR_sum"):
+            column(name, mask)
+        mask &= df["reverse_depth"].to_numpy() > params["reverse_depth"]
+        mask &= df["frequency"].to_numpy() >= params["frequency"]
+        mask &= df["strand_balance"].to_numpy() >= params["strand_ratio"]
+        mask &= df["fisher_pvalue"].to_numpy() >= params.get("fisher_pvalue", 0)
+        if params["keep_polymorphic"] is False:
+            mask &= df["n_alts"].to_numpy() <= 1
+        return mask
 
     def _filter_line(self, variant):
         """Filter variant with parameter set in :attr:`VCF_freebayes.filters`.
@@ -183,7 +356,7 @@ class VariantFile:
         :param vcf.model._Record vcf_line:
         :return: line if all filters are passed.
         """
-        if variant.qual < self.filters_params["freebayes_score"]:
+        if variant.qual is None or variant.qual < self.filters_params["freebayes_score"]:
             return False
 
         if variant.info["DP"] <= self.filters_params["min_depth"]:
@@ -215,7 +388,7 @@ class VariantFile:
 
     def get_variant_type(self):
         variants = defaultdict(int)
-        for variant in self.variants:
+        for variant in self._iter_records():
             if "TYPE" in variant.info:
                 for typ in variant.info["TYPE"]:
                     variants[typ] += 1
@@ -289,8 +462,8 @@ class VariantFile:
 
     def hist_score(self, bins=200, min_score=1):
         """Histogram of Quality score"""
-        variants = self.variants
-        pylab.hist([x.qual for x in variants if x.qual >= min_score], bins=bins)
+        qual = self.table["qual"]
+        pylab.hist(qual[qual >= min_score], bins=bins)
 
     def plot_frequency(self):
         sorted_contigs = dict(sorted(self.contigs.items(), key=lambda item: item[1]))
@@ -376,12 +549,8 @@ class VariantFile:
 
     def _get_df(self):
         if self._df is None:
-            data = []
-            if self.progress:
-                for variant in tqdm(self.variants):
-                    data.append(self._variant_to_dict(variant))
-            else:
-                data = [self._variant_to_dict(variant) for variant in self.variants]
+            records = self._variants if self._variants is not None else self._iter_records()
+            data = [self._variant_to_dict(variant) for variant in tqdm(records, disable=not self.progress)]
             self._df = pd.DataFrame(data)
         return self._df
 
@@ -394,8 +563,8 @@ class VariantFile:
         """
         vcf_writer = pysam.VariantFile(output_filename, mode="w", header=self._header)
         IDs = set(self.df.ID)
-        for i, variant in enumerate(self.variants):
-            if str(i + 1) in IDs:
+        for variant in self._iter_records():
+            if variant.id in IDs:
                 vcf_writer.write(variant)
         vcf_writer.close()
 
@@ -408,24 +577,32 @@ class FilteredVariantFile:
 
     """
 
-    def __init__(self, variants, fb_vcf):
+    def __init__(self, variants, fb_vcf, indices=None):
         """.. rubric:: constructor
 
         :param list variants: list of variants record.
         :param VCF_freebayes fb_vcf: class parent.
+        :param indices: indices of the records of the parent file. If
+            provided, *variants* is ignored and the records are read from the
+            parent file when needed.
         """
         self._variants = variants
         self._vcf = fb_vcf
-        self._df = self._vcf_to_df()
+        self._indices = indices
+        self._df = None
 
     @property
     def variants(self):
         """Get the variant list."""
+        if self._variants is None:
+            self._variants = list(self.vcf._iter_records(self._indices))
         return self._variants
 
     @property
     def df(self):
         """Get the data frame."""
+        if self._df is None:
+            self._df = self._vcf_to_df()
         return self._df
 
     @property
@@ -460,52 +637,101 @@ class FilteredVariantFile:
         :params str output_filename: output VCF filename.
         """
         vcf_writer = pysam.VariantFile(output_filename, mode="w", header=self._vcf._header)
-        for variant in self.variants:
+        if self._variants is None:
+            variants = self.vcf._iter_records(self._indices)
+        else:
+            variants = self._variants
+        for variant in variants:
             vcf_writer.write(variant)
         vcf_writer.close()
 
 
-def apply_variants(fasta_path, vcf_path, output_fasta):
-    logger.info("TO BE CHECKED /  TESTED")
-    # Load reference sequence
-    fasta = pysam.FastaFile(fasta_path)
-
-    # Read VCF
-    try:
-        vcf = pysam.VariantFile(vcf_path)
-    except AttributeError:
-        vcf = vcf_path
-
-    # Store modifications
-    sequences = {seq: list(fasta.fetch(seq)) for seq in fasta.references}
-    print(sequences.keys())
-
-    # Apply variants
-    for record in tqdm(vcf):
-        chrom = record.chrom
-        pos = record.pos - 1  # VCF is 1-based, Python lists are 0-based
-        ref = record.ref
-        alts = record.alts  # Tuple of alternative alleles
-
-        if chrom not in sequences:
+def _get_consensus_variants(vcf_path, references):
+    # first alternate allele of each variant, sorted by position per contig
+    variants = defaultdict(list)
+    records = pysam.VariantFile(vcf_path) if isinstance(vcf_path, (str, Path)) else vcf_path
+    for record in records:
+        if record.chrom not in references or not record.alts:
             continue
+        alt = record.alts[0]
+        # symbolic (<DEL>), breakend or missing alleles cannot be applied
+        if alt.startswith("<") or "[" in alt or "]" in alt or alt in ("*", "."):
+            continue
+        variants[record.chrom].append((record.pos - 1, record.ref, alt))
+    for chrom in variants:
+        variants[chrom].sort(key=lambda x: x[0])
+    return variants
+
 
-        seq = sequences[chrom]
-        seq1 = sequences[chrom][:]
-
-        # Assume first ALT is the desired one (modify if needed)
-        alt = alts[0] if alts else ref
-
-        if len(ref) == len(alt):  # SNP
-            print(pos, ref, alt, len(ref))
-            seq[pos : pos + len(ref)] = list(alt)
-        elif len(ref) > len(alt):  # Deletion
-            seq[pos : pos + len(ref)] = list(alt)  # alt is usually empty
-        elif len(ref) < len(alt):  # Insertion
-            seq[pos : pos + 1] = list(alt)  # Insert extra bases
-
-    # Write corrected FASTA
-    with open(output_fasta, "w") as out_fasta:
-        for chrom, seq in sequences.items():
-            out_fasta.write(f">{chrom}\n")
-            out_fasta.write("".join(seq) + "\n")
+def _build_consensus(item):
+    """Worker (module-level so it can be pickled for multiprocessing).
+
+    ``item`` = (fasta_path, chrom, sorted list of (0-based position, ref,
+    alt)). Returns the name, the consensus sequence (bytes) and the number of
+    applied and skipped variants.
+    """
+    fasta_path, chrom, variants = item
+    with pysam.FastaFile(str(fasta_path)) as fasta:
+        sequence = memoryview(fasta.fetch(chrom).encode())
+
+    segments = []
+    previous = 0
+    skipped = 0
+    for pos, ref, alt in variants:
+        end = pos + len(ref)
+        # overlapping variants or REF not found in the reference
+        if pos < previous or bytes(sequence[pos:end]).upper() != ref.upper().encode():
+            skipped += 1
+            continue
+        segments.append(sequence[previous:pos])
+        segments.append(alt.encode())
+        previous = end
+    segments.append(sequence[previous:])
+    return chrom, b"".join(segments), len(variants) - skipped, skipped
+
+
+def apply_variants(fasta_path, vcf_path, output_fasta, width=80, processes=1, progress=False):
+    """Build a consensus sequence by applying variants to a reference
+
+    The first alternate allele of each variant is applied. Each contig is
+    built from the segments of the reference between variants (positions of
+    the VCF, no coordinate shift after indels). Variants that overlap a
+    previously applied variant, whose REF does not match the reference or
+    with symbolic alleles are skipped.
+
+    :param fasta_path: reference FASTA file
+    :param vcf_path: VCF/BCF file (or an opened :class:`pysam.VariantFile`)
+    :param output_fasta: output FASTA file
+    :param int width: line width of the sequences (no wrapping if None)
+    :param int processes: contigs are built in parallel with several
+        processes. ``None`` uses all CPUs.
+    :return: number of applied and skipped variants
+    """
+    with pysam.FastaFile(str(fasta_path)) as fasta:
+        references = list(fasta.references)
+    variants = _get_consensus_variants(vcf_path, set(references))
+    items = [(fasta_path, chrom, variants.get(chrom, [])) for chrom in references]
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    applied = skipped = 0
+    pool = Pool(min(processes, len(items))) if processes > 1 and len(items) > 1 else None
+    try:
+        results = pool.imap(_build_consensus, items) if pool else map(_build_consensus, items)
+        with open(output_fasta, "wb") as fout:
+            # contigs are written in the reference order as soon as ready
+            for chrom, sequence, n_applied, n_skipped in tqdm(results, total=len(items), disable=not progress):
+                fout.write(f">{chrom}\n".encode())
+                step = width if width else max(len(sequence), 1)
+                fout.write(b"\n".join(sequence[i : i + step] for i in range(0, len(sequence), step)))
+                fout.write(b"\n")
+                applied += n_applied
+                skipped += n_skipped
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if skipped:
+        logger.warning(f"{skipped} variants could not be applied (overlapping, REF mismatch)")
+    return applied, skipped
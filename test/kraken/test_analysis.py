@@ -1,4 +1,5 @@
 import os
+import shutil
 import tempfile
 
 import pytest
@@ -107,3 +108,43 @@ def test_kraken_pipeline(download):
     file2 = sequana_data("Hm2_GTGAAA_L005_R2_001.fastq.gz", "data")
     kp = KrakenPipeline([file1, file2], database=database, threads=1)
     kp.run()
+
+
+def test_kraken_results_streaming(tmp_path, monkeypatch):
+    class Taxonomy:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def download_taxonomic_file(self):
+            pass
+
+    monkeypatch.setattr("sequana.taxonomy.Taxonomy", Taxonomy)
+    filename = tmp_path / "kraken.out"
+    shutil.copy(f"{test_dir}/data/test_kraken.out", filename)
+
+    k = KrakenResults(filename)
+    assert k.classified + k.unclassified == len(k.df) == 1499
+    assert k.df.status.dtype == "category"
+
+    ks = KrakenResults(filename, streaming=True, cache=True)
+    assert not hasattr(ks, "_df")
+    assert (ks.taxons == k.taxons).all() and list(ks.taxons.index) == list(k.taxons.index)
+    assert (ks.classified, ks.unclassified) == (k.classified, k.unclassified)
+    assert ks.length_histograms["C"].sum() == k.classified
+    assert ks.length_histograms["C"][203] == (k.df.query("status == 'C'").length == 203).sum()
+
+    # the per-read data is read back from the cache
+    assert os.path.exists(f"{filename}.sqcache/kraken_reads.json")
+    df = ks.df
+    assert len(df) == 1499 and list(df.status.cat.categories) == ["C", "U"]
+    assert (df.taxon.values == k.df.taxon.values).all()
+    assert (df.status.astype(str).values == k.df.status.astype(str).values).all()
+
+    kc = KrakenResults(filename, cache=True)
+    assert (kc.taxons == k.taxons).all() and kc.classified == k.classified
+
+    stats = ks.boxplot_classified_vs_read_length()
+    assert stats[0]["label"] == "C"
+    assert ks.histo_classified_vs_read_length()["C"].sum() == k.classified
+    k.histo_classified_vs_read_length()
+    k.boxplot_classified_vs_read_length()
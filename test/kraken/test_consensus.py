@@ -0,0 +1,60 @@
+import pytest
+
+from sequana.kraken.consensus import build_consensus, searchLCA
+from sequana.taxonomy import NCBITaxonomy, TaxonomyIndex
+
+from .. import test_dir
+
+
+def test_build_consensus(tmp_path):
+    n = NCBITaxonomy(f"{test_dir}/data/names_filtered.dmp", f"{test_dir}/data/nodes_filtered.dmp")
+    n.create_taxonomy_file(tmp_path / "taxo.csv.gz")
+    index = TaxonomyIndex.from_csv(tmp_path / "taxo.csv.gz")
+
+    data = [
+        [("C", 2697049, "2697049:10 |:| 0:3"), ("U", 0, "0:5 |:| 0:5"), ("C", 11234, "11234:2 |:| 0:1"), ("U", 0, "0:1 |:| 0:1")],
+        [("C", 11234, "11234:4 |:| 0:2"), ("U", 0, "0:5 |:| 0:5"), ("C", 11234, "11234:3 |:| 0:1"), ("C", 99, "99:1 |:| 0:1")],
+        [("U", 0, "0:1 |:| 0:1"), ("U", 0, "0:5 |:| 0:5"), ("C", 11229, "0:3 |:| 0:1"), ("U", 0, "0:1 |:| 0:1")],
+    ]
+    inputs = []
+    for i, rows in enumerate(data):
+        inputs.append(tmp_path / f"kraken_{i}.out")
+        with open(inputs[-1], "w") as fout:
+            for j, (status, taxon, kmers) in enumerate(rows):
+                fout.write(f"{status}\tread{j}\t{taxon}\t151|151\t{kmers}\n")
+
+    output = tmp_path / "kraken.out"
+    build_consensus(inputs, output, chunksize=3, taxonomy=index)
+    lines = [x.split("\t") for x in open(output).read().splitlines()]
+    assert [x[0] for x in lines] == ["C", "U", "C", "C"]
+    assert [x[1] for x in lines] == ["read0", "read1", "read2", "read3"]
+    # SARS-CoV-2 and measles have Orthornavirae as LCA
+    assert [int(x[2]) for x in lines] == [2732396, 0, 11229, 99]
+    assert lines[0][4] == "2697049:10 11234:4 0:1 |:| 0:3 0:2 0:1"
+
+    build_consensus(inputs, tmp_path / "kraken2.out", chunksize=2, processes=2, taxonomy=index)
+    assert open(tmp_path / "kraken2.out").read() == open(output).read()
+
+    assert searchLCA(("2697049", "11234"), index, {}) == 2732396
+
+
+def test_build_consensus_mismatch(tmp_path):
+    n = NCBITaxonomy(f"{test_dir}/data/names_filtered.dmp", f"{test_dir}/data/nodes_filtered.dmp")
+    n.create_taxonomy_file(tmp_path / "taxo.csv.gz")
+    index = TaxonomyIndex.from_csv(tmp_path / "taxo.csv.gz")
+
+    def write(filename, reads):
+        with open(filename, "w") as fout:
+            for read in reads:
+                fout.write(f"U\t{read}\t0\t151|151\t0:1 |:| 0:1\n")
+        return filename
+
+    first = write(tmp_path / "kraken_0.out", ["read0", "read1", "read2", "read3"])
+    # a truncated output must not be silently merged (last block is missing)
+    truncated = write(tmp_path / "kraken_1.out", ["read0", "read1"])
+    with pytest.raises(ValueError):
+        build_consensus([first, truncated], tmp_path / "kraken.out", chunksize=2, taxonomy=index)
+    # reads must be in the same order
+    swapped = write(tmp_path / "kraken_2.out", ["read0", "read1", "read3", "read2"])
+    with pytest.raises(ValueError):
+        build_consensus([first, swapped], tmp_path / "kraken.out", chunksize=2, taxonomy=index)
@@ -97,3 +97,36 @@ def test_multiqc_report_and_annotation(tmpdir):
     assert os.path.exists(str(directory_run / "JB409847/sequana_summary_coverage.json"))
     assert os.path.exists(str(directory_run / "multiqc_report.html"))
     assert results.exit_code == 0
+
+
+@pytest.mark.slow
+def test_main_processes(tmpdir):
+    # two chromosomes analysed in parallel
+    bed = tmpdir.join("two_chroms.bed")
+    with open(bedfile) as fin:
+        data = fin.read()
+    bed.write(data + data.replace("JB409847", "copy"))
+
+    for processes in ["1", "2"]:
+        directory_run = tmpdir.mkdir(f"report{processes}")
+        runner = CliRunner()
+        results = runner.invoke(
+            coverage.main,
+            [
+                "-i",
+                str(bed),
+                "-o",
+                "--output-directory",
+                str(directory_run),
+                "--no-multiqc",
+                "--window-median",
+                "3001",
+                "--processes",
+                processes,
+            ],
+        )
+        assert results.exit_code == 0
+        assert os.path.exists(str(directory_run / "copy/sequana_summary_coverage.json"))
+
+    assert tmpdir.join("report1/summary.json").read() == tmpdir.join("report2/summary.json").read()
+    assert tmpdir.join("report1/copy/rois.csv").read() == tmpdir.join("report2/copy/rois.csv").read()
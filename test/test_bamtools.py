@@ -1,5 +1,6 @@
 import os
 
+import pysam
 import pytest
 from easydev import TempFile
 
@@ -8,6 +9,8 @@ from sequana.bamtools import (
     CRAM,
     SAM,
     Alignment,
+    BAMStatsCollector,
+    MultiBAM,
     SAMFlags,
     is_bam,
     is_cram,
@@ -104,7 +107,7 @@ def test_cram():
     assert s.summary == {
         "flags": {77: 6, 83: 14, 99: 10, 141: 6, 147: 10, 163: 14},
         "mapq": {0: 12, 60: 48},
-        "mean_quality": 33.666171617161723,
+        "mean_quality": 33.666171617161716,
         "read_length": {79: 2, 81: 1, 93: 1, 101: 44},
     }
 
@@ -226,6 +229,11 @@ def test_get_gc_content_values():
     assert isinstance(gc, list)
     assert len(gc) > 0
     assert all(0 <= v <= 100 for v in gc)  # returned as percentages
+    # the histogram used by plot_gc_content is computed with the other stats
+    import numpy as np
+
+    assert (b.collect_stats().gc == np.bincount([int(v) for v in gc], minlength=101)).all()
+    b.plot_gc_content()
 
 
 def test_get_length_count_values():
@@ -270,3 +278,149 @@ def test_get_mapped_read_length():
     b = BAM(f"{test_dir}/data/bam/test.bam")
     lengths = b.get_mapped_read_length()
     assert len(lengths) > 0
+
+
+def test_stats_collector():
+    datatest = f"{test_dir}/data/bam/test.bam"
+    b = BAM(datatest)
+    stats = b.collect_stats()
+    assert stats.count == len(b) == 1000
+    assert stats.get_flags_count()[256] == 64
+    assert sum(b.get_length_count().values()) == 1000
+    assert stats.get_summary() == b.summary
+
+    # regions of an indexed file analysed by several processes
+    sharded = BAMStatsCollector.from_file(datatest, processes=2, shard_size=5000)
+    assert sharded.count == stats.count
+    assert (sharded.flags == stats.flags).all()
+    assert (sharded.read_length == stats.read_length).all()
+    assert sharded.get_stats_full() == stats.get_stats_full()
+    assert sharded.get_summary() == stats.get_summary()
+
+    only = BAMStatsCollector.from_file(datatest, metrics=["flags"])
+    assert (only.flags == stats.flags).all() and only.gc.sum() == 0
+    with pytest.raises(ValueError):
+        BAMStatsCollector(metrics=["dummy"])
+
+
+def test_get_df_columns():
+    b = BAM(f"{test_dir}/data/bam/test_measles.bam")
+    df = b.get_df(progress=False)
+    assert len(df) == 60
+    assert df.flag.dtype == "uint16" and df.mapqs.dtype == "uint8" and df.qlen.dtype == "int32"
+    assert df.rname.dtype == "category" and df.rname.isna().sum() == 12
+    assert "cigar" in b.get_df(include_cigar=True).columns
+
+    df = b.get_df(fields=["flag", "rname"])
+    assert list(df.columns) == ["flag", "rname"]
+    chunks = list(b.get_df(fields=["flag"], chunksize=25))
+    assert [len(x) for x in chunks] == [25, 25, 10]
+    assert len(b.get_df(max_align=10)) == 10
+    with pytest.raises(ValueError):
+        b.get_df(fields=["dummy"])
+
+
+def test_multibam():
+    mb = MultiBAM()
+    mb.add_bam(f"{test_dir}/data/bam/test_measles.bam", group="A")
+    mb.add_bam(f"{test_dir}/data/bam/test_hg38_chr18.bam", group="B")
+    df = mb.run()
+    assert df.loc["test_measles", "chr1"] == 48
+    assert df.loc["test_hg38_chr18", "chr18"] == 1000
+    assert (mb.run(exclude_secondary=False, method="index") == df).all().all()
+    mb.plot_alignments_per_sample()
+
+    b = BAM(f"{test_dir}/data/bam/test.bam")
+    counts = b.get_reference_counts()
+    assert counts.iloc[0] == len(b.get_df().query("flag != 4 and flag < 256"))
+    # no statistics in this index: alignments are read
+    assert b.get_reference_counts(exclude_secondary=False, method="index").iloc[0] == 1000
+    with pytest.raises(ValueError):
+        b.get_reference_counts(method="index")
+
+
+def test_coverage(tmpdir):
+    def get_expected(filename, name):
+        expected = [0] * BAM(filename).lengths[name]
+        for aln in pysam.AlignmentFile(filename):
+            if aln.reference_name == name and aln.flag & 1796 == 0 and aln.reference_end is not None:
+                for i in range(aln.reference_start, aln.reference_end):
+                    expected[i] += 1
+        return expected
+
+    filename = f"{test_dir}/data/bam/measles.fa.sorted.bam"
+    name = "ENA|K01711|K01711.1"
+    expected = get_expected(filename, name)
+    b = BAM(filename)
+    coverage = b.get_coverage()[name]
+    assert len(coverage) == 15894 and coverage.tolist() == expected
+    assert b.get_coverage(mapq=255)[name].sum() == 0
+    with pytest.raises(ValueError):
+        b.get_coverage(start=100)
+
+    # references of a sorted file are yielded as soon as possible
+    filename = f"{test_dir}/data/bam/test_hg38_chr18.bam"
+    coverage = BAM(filename).get_coverage()
+    assert len(coverage) == 25
+    assert coverage["chr18"].tolist() == get_expected(filename, "chr18")
+
+    # region fetched with the index
+    filename = f"{test_dir}/data/bam/test.bam"
+    b = BAM(filename)
+    name = b._data.references[0]
+    expected = get_expected(filename, name)
+    assert b.get_coverage(name, 100, 5000)[name].tolist() == expected[100:5000]
+
+    # a region requires an index
+    unindexed = tmpdir.join("test.bam")
+    unindexed.write_binary(open(filename, "rb").read())
+    assert BAM(str(unindexed)).get_coverage(name)[name].tolist() == expected
+    with pytest.raises(ValueError):
+        BAM(str(unindexed)).get_coverage(name, 100, 5000)
+
+    outfile = tmpdir.join("test.bed")
+    b.to_genomecov(str(outfile), name, 10, 20)
+    lines = outfile.readlines()
+    assert len(lines) == 10
+    assert lines[0] == f"{name}\t11\t{expected[10]}\n"
+
+
+@pytest.mark.parametrize("sort", [True, False])
+def test_coverage_many_contigs(tmpdir, sort):
+    import numpy as np
+
+    # many small contigs, with contigs split across chunks
+    rng = np.random.default_rng(0)
+    header = {"HD": {"VN": "1.6", "SO": "coordinate" if sort else "unsorted"}}
+    # special characters must be written as is in genomecov files
+    names = [f"ctg%d{{{i}}}" for i in range(500)]
+    header["SQ"] = [{"SN": name, "LN": 100} for name in names]
+    rids, positions = rng.integers(0, 400, 3000), rng.integers(0, 90, 3000)
+    if sort:
+        order = np.lexsort((positions, rids))
+        rids, positions = rids[order], positions[order]
+
+    filename = str(tmpdir.join("contigs.bam"))
+    expected = np.zeros((500, 100), dtype=int)
+    with pysam.AlignmentFile(filename, "wb", header=header) as fout:
+        for i, (rid, pos) in enumerate(zip(rids.tolist(), positions.tolist())):
+            aln = pysam.AlignedSegment(fout.header)
+            aln.query_name = f"read{i}"
+            aln.reference_id = rid
+            aln.reference_start = pos
+            aln.cigarstring = "20M"
+            aln.query_sequence = "A" * 20
+            aln.mapping_quality = 60
+            fout.write(aln)
+            expected[rid, pos : pos + 20] += 1
+
+    coverage = list(BAM(filename).iter_coverage(chunksize=128))
+    assert [name for name, _, _ in coverage] == names
+    assert (np.array([cov for _, _, cov in coverage]) == expected).all()
+
+    outfile = tmpdir.join("contigs.bed")
+    BAM(filename).to_genomecov(str(outfile))
+    lines = outfile.readlines()
+    assert len(lines) == 500 * 100
+    assert lines[0] == f"ctg%d{{0}}\t1\t{expected[0, 0]}\n"
+    assert lines[-1] == f"ctg%d{{499}}\t100\t{expected[499, 99]}\n"
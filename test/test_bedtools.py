@@ -1,3 +1,7 @@
+import os
+
+import numpy as np
+import pandas as pd
 import pytest
 
 from sequana import bedtools
@@ -222,3 +226,121 @@ def test_annotate_with_gff3():
         .reset_index(drop=True)
         .equals(rois_gff.df.reset_index(drop=True))
     )
+
+
+def test_coverage_cache(tmpdir):
+    import shutil
+
+    filename = str(tmpdir.join("test.bed"))
+    shutil.copy(f"{test_dir}/data/bed/unicycler.bed", filename)
+
+    def get_rois(bed):
+        chrom = bed[0]
+        chrom.run(501, k=2, circular=True)
+        return chrom.get_rois().df
+
+    bed = bedtools.SequanaCoverage(filename, chunksize=6000)
+    rois = get_rois(bed)
+    assert bed._cache is None
+
+    # first call creates the cache, second call uses it
+    bed = bedtools.SequanaCoverage(filename, chunksize=6000, use_cache=True)
+    assert bed._cache.has_arrays
+    assert get_rois(bed)["start"].equals(rois["start"])
+    bed = bedtools.SequanaCoverage(filename, chunksize=6000, use_cache=True)
+    assert bed.positions["1"]["N"] == 21504
+    assert bed._cache.get_array("1")[0].tolist() == [1, 77]
+    assert get_rois(bed)["start"].equals(rois["start"])
+
+    # a modified file invalidates the cache
+    cache = bedtools.CoverageCache(filename)
+    assert cache.is_valid()
+    with open(filename, "a") as fout:
+        fout.write("2\t1\t10\n2\t2\t10\n")
+    assert cache.is_valid() is False
+
+    # float coverage: only the index (byte offsets) is cached
+    with open(filename, "a") as fout:
+        fout.write("3\t1\t10.5\n3\t2\t10.5\n")
+    bed = bedtools.SequanaCoverage(filename, chunksize=6000, use_cache=True)
+    assert bed._cache.has_arrays is False
+    assert bed._cache.index["offsets"]["2"] == os.path.getsize(filename) - 32
+    assert bed[2].df["cov"].tolist() == [10.5, 10.5]
+
+
+def _legacy_merge_region(rois):
+    # Reference implementation (sequana <= 0.23) of FilteredGenomeCov._merge_region
+    # used to check the vectorised version.
+    df = rois.rawdf
+
+    def merge_row(start, stop):
+        zscore = np.mean(df["zscore"].loc[start:stop])
+        return {
+            "chr": df["chr"][start],
+            "start": start,
+            "end": stop + 1,
+            "size": stop - start + 1,
+            "mean_cov": np.mean(df["cov"].loc[start:stop]),
+            "mean_rm": np.mean(df["rm"].loc[start:stop]),
+            "mean_zscore": zscore,
+            "max_zscore": df["zscore"].loc[start:stop].max() if zscore >= 0 else df["zscore"].loc[start:stop].min(),
+            "max_cov": np.max(df["cov"].loc[start:stop]),
+        }
+
+    region_start = None
+    region_stop = None
+    start = 1
+    stop = 1
+    prev = 1
+    region_zscore = 0
+    merge_df = []
+    for pos, zscore in zip(df["pos"], df["zscore"]):
+        stop = pos
+        if stop - rois.step == prev and zscore * region_zscore >= 0:
+            prev = stop
+        else:
+            if region_start:
+                merge_df.append(merge_row(region_start, region_stop))
+                region_start = None
+            start = stop
+            prev = stop
+            region_zscore = zscore
+        if (zscore > 0 and zscore > rois.thresholds.high) or (zscore < 0 and zscore < rois.thresholds.low):
+            if not region_start:
+                region_start = pos
+            region_stop = pos
+    if start < stop and region_start:
+        merge_df.append(merge_row(region_start, region_stop))
+    return merge_df
+
+
+@pytest.mark.parametrize("step", [1, 3])
+def test_merge_region_equivalence(step):
+    # noisy coverage with many flagged positions: compare the vectorised ROI
+    # merging with the original row by row implementation
+    rng = np.random.default_rng(step)
+    thresholds = bedtools.DoubleThresholds(-4, 4)
+    for first in (1, 1 + step, 10):
+        N = 20000
+        pos = first + step * np.arange(N)
+        zscore = rng.normal(0, 4, N)
+        df = pd.DataFrame(
+            {"pos": pos, "cov": rng.integers(0, 100, N), "rm": rng.integers(0, 100, N), "zscore": zscore},
+            index=pos,
+        )
+        # sign changes in the first cluster, long clusters and a last
+        # isolated position (ignored)
+        df.loc[pos[0:5], "zscore"] = [3, -5, 5, -3, 6]
+        df.loc[pos[100:300], "zscore"] = 6
+        df.loc[pos[300:310], "zscore"] = -6
+        df.loc[pos[-2:], "zscore"] = [0, 5]
+        df = df.query("zscore > @thresholds.high2 or zscore < @thresholds.low2")
+        df.insert(0, "chr", "chrom")
+
+        rois = bedtools.FilteredGenomeCov(df, thresholds, step=step)
+        expected = _legacy_merge_region(rois)
+        results = rois._merge_region()
+        assert len(results) == len(expected) > 100
+        for result, exp in zip(results, expected):
+            for key, value in exp.items():
+                assert result[key] == pytest.approx(value, rel=1e-12), key
@@ -0,0 +1,48 @@
+import gzip
+
+import pysam
+import pytest
+
+from sequana.compression import compress_file, get_backend, open_compressed
+
+from . import test_dir
+
+data = f"{test_dir}/data/fastq/test.fastq"
+
+
+@pytest.mark.parametrize("backend", ["auto", "threads", "gzip"])
+@pytest.mark.parametrize("bgzf", [False, True])
+def test_open_compressed(tmpdir, backend, bgzf):
+    expected = open(data, "rb").read() * 20
+    outfile = str(tmpdir.join("test.fastq.gz"))
+
+    with open_compressed(outfile, "wb", threads=2, backend=backend, bgzf=bgzf) as fout:
+        fout.write(expected[:1000])
+        fout.write(expected[1000:])
+
+    assert gzip.open(outfile).read() == expected
+    with open_compressed(outfile, "rb", backend=backend) as fin:
+        assert fin.read() == expected
+    if bgzf:
+        assert pysam.BGZFile(outfile).read() == expected
+
+
+def test_open_compressed_text(tmpdir):
+    outfile = str(tmpdir.join("test.txt.gz"))
+    with open_compressed(outfile, "wt") as fout:
+        fout.write("hello\n")
+    with open_compressed(outfile, "at") as fout:
+        fout.write("world\n")
+    with open_compressed(outfile, "rt") as fin:
+        assert fin.readlines() == ["hello\n", "world\n"]
+
+    # uncompressed files
+    outfile = str(tmpdir.join("test.txt"))
+    with open_compressed(outfile, "wt") as fout:
+        fout.write("hello\n")
+    assert compress_file(outfile).endswith("test.txt.gz")
+    assert gzip.open(outfile + ".gz").read() == b"hello\n"
+
+    assert get_backend(bgzf=True) == "threads"
+    with pytest.raises(ValueError):
+        get_backend("dummy")
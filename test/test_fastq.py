@@ -135,6 +135,31 @@ def test_filter():
         f.filter(output_filename=fh.name)
 
 
+def test_iter_batches(tmpdir):
+    for thisdata in [data, datagz]:
+        f = FastQ(thisdata)
+        reads = [(x["identifier"], x["sequence"], x["quality"]) for x in f]
+        batches = list(f.iter_batches(n=100, blocksize=1000))
+        assert [len(x) for x in batches][0:2] == [100, 100]
+        assert sum(len(x) for x in batches) == 250
+        batch = batches[0]
+        assert batch.get_identifiers()[0] == reads[0][0].split()[0]
+        assert batch.sequences[0:101].tobytes() == reads[0][1]
+        assert batch.qualities[-101:].tobytes() == reads[99][2]
+
+    # filter keeps the records unchanged
+    outfile = tmpdir.join("filtered.fastq")
+    identifiers = [x[0].split()[0].decode() for x in reads[0:10]]
+    f.filter(identifiers, output_filename=str(outfile), progress=False)
+    assert len(FastQ(str(outfile))) == 240
+    with open(data, "rb") as fin:
+        assert outfile.read_binary() == b"".join(fin.readlines()[40:])
+
+    outfile = tmpdir.join("test.fasta")
+    f.to_fasta(str(outfile))
+    assert outfile.read().startswith(">" + reads[0][0].decode()[1:] + "\n" + reads[0][1].decode() + "\n")
+
+
 def remove_files(filenames):
     for filename in filenames:
         os.remove(filename)
@@ -42,3 +42,41 @@ def test_fastq_splitter_gzip_output(tmp_path):
 
     parts = list(tmp_path.glob("chunk_*.fastq.gz"))
     assert len(parts) >= 1
+
+
+def test_fastq_splitter_bgzf_output(tmp_path):
+    import gzip
+
+    pattern = str(tmp_path / "chunk_#.fastq.gz")
+    splitter = FastqSplitter(datagz, threads=2, bgzf=True)
+    splitter.by_size(reads_per_chunk=100, pattern=pattern, gzip_output=True)
+
+    parts = sorted(tmp_path.glob("chunk_*.fastq.gz"))
+    assert len(parts) == 3
+    with gzip.open(datagz) as fin:
+        assert b"".join(gzip.open(x).read() for x in parts) == fin.read()
+
+
+@pytest.mark.parametrize("mode", ["count", "roundrobin", "offset"])
+@pytest.mark.parametrize("processes", [False, True])
+def test_fastq_splitter_by_part_modes(tmp_path, mode, processes):
+    import gzip
+
+    pattern = str(tmp_path / "part_#.fastq.gz")
+    splitter = FastqSplitter(datagz)
+    splitter.by_part(n_parts=3, pattern=pattern, gzip_output=True, buffer_size=40, mode=mode, processes=processes)
+
+    parts = [tmp_path / f"part_{i}.fastq.gz" for i in (1, 2, 3)]
+    data = [gzip.open(x).read() for x in parts]
+    with gzip.open(datagz) as fin:
+        expected = fin.read()
+
+    if mode == "roundrobin":
+        # blocks of 40 reads (160 lines) in turn
+        lines = expected.splitlines(True)
+        blocks = [b"".join(lines[i : i + 160]) for i in range(0, len(lines), 160)]
+        assert data == [b"".join(blocks[i::3]) for i in range(3)]
+    else:
+        assert b"".join(data) == expected
+    if mode == "count":
+        assert [x.count(b"\n") for x in data] == [332, 332, 336]
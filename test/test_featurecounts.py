@@ -1,6 +1,8 @@
 import glob
 import os
 
+import pytest
+
 import sequana.featurecounts as fc
 
 from . import test_dir
@@ -58,3 +60,32 @@ def test_featurecountmerger(tmpdir):
     outfile = tmpdir.join("all_features.out")
     fc = FeatureCountMerger(pattern=f"{test_dir}/featurecounts/featurecounts_ex1/WT__*out")
     fc.to_tsv(output_filename=outfile)
+
+
+def test_merge_feature_counts(tmpdir):
+    import pandas as pd
+
+    filenames = sorted(glob.glob(f"{RNASEQ_DIR}/*_feature.out"))
+    expected = pd.read_csv(filenames[0], sep="\t", comment="#")
+    for filename in filenames[1:]:
+        expected = pd.merge(expected, pd.read_csv(filename, sep="\t", comment="#"))
+
+    cache = str(tmpdir.join("counts.npz"))
+    for _ in range(2):  # second call reads the cache
+        df = fc.merge_feature_counts(filenames, threads=2, cache=cache)
+        assert list(df.columns) == list(expected.columns)
+        assert (df.astype(str).values == expected.astype(str).values).all()
+        assert df[df.columns[-1]].dtype == "int32"
+
+    # same features in another order
+    shuffled = tmpdir.join("shuffled.out")
+    pd.read_csv(filenames[1], sep="\t", comment="#").sample(frac=1, random_state=0).to_csv(
+        shuffled, sep="\t", index=False
+    )
+    df = fc.merge_feature_counts([filenames[0], str(shuffled)])
+    assert (df.values == pd.merge(expected.iloc[:, :7], expected.iloc[:, [0, 1, 2, 3, 4, 5, 7]]).values).all()
+
+    # missing features
+    pd.read_csv(filenames[1], sep="\t", comment="#").iloc[:-1].to_csv(shuffled, sep="\t", index=False)
+    with pytest.raises(ValueError):
+        fc.merge_feature_counts([filenames[0], str(shuffled)])
@@ -91,3 +91,67 @@ def test_variant():
     v = VCF_freebayes(f"{sharedir}/test_vcf_snpeff.vcf")
     variants = v.variants
     assert len(variants) == 775
+
+
+@pytest.mark.parametrize("filename", ["JB409847.vcf", "test_vcf_snpeff.vcf", "joint_calling.vcf"])
+def test_table(tmpdir, filename):
+    import pandas as pd
+
+    # the quality of the first record is missing
+    lines = open(f"{sharedir}/{filename}").read().splitlines(True)
+    first = next(i for i, line in enumerate(lines) if not line.startswith("#"))
+    fields = lines[first].split("\t")
+    fields[5] = "."
+    lines[first] = "\t".join(fields)
+    vcf = tmpdir.join(filename)
+    vcf.write("".join(lines))
+
+    v = VariantFile(str(vcf))
+    assert v.table["qual"].isna().sum() == 1
+    table = v.table
+    assert len(table) == len(v)
+    assert pd.concat(v.iter_tables(chunksize=10), ignore_index=True).equals(table)
+
+    # vectorised filters give the same variants as the per-record filter
+    for score, freq, keep in [(0, 0, True), (20, 0.5, False), (200, 0.85, True)]:
+        v.filters_params = {
+            "freebayes_score": score,
+            "frequency": freq,
+            "min_depth": 10,
+            "forward_depth": 3,
+            "reverse_depth": 3,
+            "strand_ratio": 0.2,
+            "keep_polymorphic": keep,
+        }
+        expected = [x.id for x in v.variants if v._filter_line(x)]
+        assert v.variants[0].id not in expected
+        assert [x.id for x in v.filter_vcf(v.filters_params).variants] == expected
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_apply_variants(tmpdir, processes):
+    import pysam
+
+    from sequana.variants import apply_variants
+
+    fasta = tmpdir.join("ref.fa")
+    fasta.write(">chr1\nACGTACGTACGTACGTACGT\n>chr2\nTTTTGGGGCCCCAAAA\n>chr3\nACGT\n")
+    vcf = tmpdir.join("test.vcf")
+    header = "##fileformat=VCFv4.2\n##contig=<ID=chr1,length=20>\n##contig=<ID=chr2,length=16>\n"
+    header += "##contig=<ID=chr3,length=4>\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+    records = [
+        ("chr2", 5, "GGGG", "G"),  # deletion
+        ("chr1", 2, "C", "G"),  # SNP
+        ("chr1", 4, "T", "TAAA"),  # insertion; next positions are not shifted
+        ("chr1", 6, "CG", "GC"),  # MNP
+        ("chr1", 7, "G", "T"),  # overlaps the MNP: skipped
+        ("chr2", 1, "A", "C"),  # REF mismatch: skipped
+        ("chr1", 20, "T", "<DEL>"),  # symbolic: ignored
+    ]
+    vcf.write(header + "".join(f"{c}\t{p}\t.\t{r}\t{a}\t50\t.\t.\n" for c, p, r, a in records))
+
+    output = str(tmpdir.join("consensus.fa"))
+    assert apply_variants(str(fasta), str(vcf), output, width=10, processes=processes) == (4, 2)
+    sequences = {x.name: x.sequence for x in pysam.FastxFile(output)}
+    assert sequences == {"chr1": "AGGTAAAAGCTACGTACGTACGT", "chr2": "TTTTGCCCCAAAA", "chr3": "ACGT"}
+    assert max(len(line) for line in open(output)) == 11
@@ -145,3 +145,22 @@ def test_add_CDS_and_mRNA(tmpdir):
     # Original gene lines preserved
     assert "gene1" in content
     assert "gene2" in content
+
+
+def test_dataframe_and_cache(tmpdir):
+    import pandas as pd
+
+    for filename in ["ecoli_truncated.gff", "hg38_truncated_gtf.gff", "gff/lenny.gff"]:
+        infile = tmpdir.join(filename.replace("/", "_"))
+        infile.write(open(f"{test_dir}/data/{filename}").read())
+
+        # the vectorised parser gives the same records as the reader
+        gff = GFF3(str(infile), cache=True)
+        records = pd.DataFrame(gff.read())
+        pd.testing.assert_frame_equal(gff.df[records.columns], records)
+
+        # second call reads the cache
+        cached = GFF3(str(infile), cache=True)
+        pd.testing.assert_frame_equal(cached.df, gff.df)
+        assert cached.features == gff.features
+        assert len(tmpdir.join(infile.basename + ".sqcache").listdir()) == 1
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+import pytest
+
+import sequana
+
+
+def _get_import_times():
+    # cumulative import time (in microseconds) of each module
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import sequana"], capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_time():
+    times = _get_import_times()
+    # heavy modules are only imported when needed
+    for name in ("pandas", "numpy", "pysam", "easydev", "sequana.scripts", "sequana.fastq", "sequana.kraken"):
+        assert name not in times
+    # generous budget for slow CI machines (about 50ms here)
+    assert times["sequana"] < 1_000_000
+
+
+def test_lazy_exports():
+    for name in sequana.__all__:
+        assert getattr(sequana, name) is not None
+    assert sequana.FastQ.__module__ == "sequana.fastq"
+    assert sequana.scripts.__name__ == "sequana.scripts"
+    assert "FastQ" in dir(sequana)
+    with pytest.raises(AttributeError):
+        sequana.dummy
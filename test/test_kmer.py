@@ -1,4 +1,17 @@
-from sequana.kmer import build_kmer, get_kmer
+from collections import Counter
+
+import pytest
+
+from sequana.kmer import (
+    KmerCounter,
+    build_kmer,
+    count_kmer_occurrences,
+    decode_kmers,
+    encode_kmers,
+    get_kmer,
+)
+
+from . import test_dir
 
 
 def test_build_kmer():
@@ -17,3 +30,64 @@ def test_build_kmer():
 def test_get_kmer():
     res = list(get_kmer("ACGTAAAA", k=4))
     assert res == ["ACGT", "CGTA", "GTAA", "TAAA", "AAAA"]
+
+
+def test_encode_kmers():
+    assert encode_kmers("ACGTA", k=3).tolist() == [6, 27, 44]
+    assert decode_kmers([6, 27, 44], k=3) == ["ACG", "CGT", "GTA"]
+    # invalid letters and k-mers across reads are ignored
+    assert decode_kmers(encode_kmers("ACGNACGT", k=3), k=3) == ["ACG", "ACG", "CGT"]
+    assert decode_kmers(encode_kmers("ACGTACGT", k=3, lengths=[4, 4]), k=3) == ["ACG", "CGT", "ACG", "CGT"]
+    # canonical k-mers (CGT is the reverse complement of ACG)
+    assert decode_kmers(encode_kmers("ACGTA", k=3, canonical=True), k=3) == ["ACG", "ACG", "GTA"]
+    with pytest.raises(ValueError):
+        encode_kmers("ACGT", k=32)
+
+
+def test_count_kmer_occurrences():
+    assert count_kmer_occurrences("AACCCTAACCCTAA", ["AACCCT", "ACCCTA"]).tolist() == [4]
+    assert count_kmer_occurrences("AACCCTAAACCCTN", ["AACCCT"], lengths=[7, 7]).tolist() == [1, 1]
+    assert count_kmer_occurrences("AAAAAAAAAAAAAAC", ["A" * 13]).tolist() == [2]
+    with pytest.raises(ValueError):
+        count_kmer_occurrences("ACGT", ["AC", "ACG"])
+
+
+@pytest.mark.parametrize("k", [4, 15])
+def test_kmer_counter(k):
+    sequence = "ACGTTTGACCANNACGTTGACCATTAGGACGTTTGACCA" * 5
+    counter = KmerCounter(k=k)
+    counter.update(sequence[:100])
+    counter.update(sequence[100:])
+    ts = counter.to_series()
+    expected = Counter(x for x in get_kmer(sequence[:100], k) if "N" not in x)
+    expected += Counter(x for x in get_kmer(sequence[100:], k) if "N" not in x)
+    assert ts.to_dict() == dict(expected)
+    assert ts.is_monotonic_decreasing
+
+    # merge the counts of large k-mers after each update
+    counter = KmerCounter(k=k)
+    counter._merge_size = 0
+    for i in range(0, len(sequence), 20):
+        counter.update(sequence[max(0, i - k + 1) : i + 20])
+    assert counter.to_series().to_dict() == Counter(x for x in get_kmer(sequence, k) if "N" not in x)
+
+    counter = KmerCounter(k=k, canonical=True)
+    counter.update(sequence)
+    assert counter.to_series().sum() == sum(expected.values()) + sum(
+        1 for x in get_kmer(sequence[100 - k + 1 : 100 + k - 1], k) if "N" not in x
+    )
+
+
+def test_kmer_counter_fastq():
+    from sequana import FastQ
+
+    filename = f"{test_dir}/data/fastq/test.fastq"
+    counter = KmerCounter(k=5)
+    for batch in FastQ(filename).iter_batches(n=100):
+        counter.update_batch(batch)
+
+    expected = Counter()
+    for read in FastQ(filename):
+        expected.update(x for x in get_kmer(read["sequence"].decode(), 5) if "N" not in x)
+    assert counter.to_series().to_dict() == dict(expected)
+    assert FastQ(filename).to_kmer_content(5).to_dict() == dict(expected)
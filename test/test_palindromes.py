@@ -1,6 +1,9 @@
+import pandas as pd
 import pytest
 
+from sequana.repeats import palindromes as pal_module
 from sequana.repeats.palindromes import Palindromes
+from sequana.tools import reverse_complement
 
 from . import test_dir
 
@@ -35,3 +38,44 @@ def test_palindromes_to_bed_empty_raises(tmp_path):
     p = Palindromes(fasta_file)
     with pytest.raises(ValueError):
         p.to_bed(str(tmp_path / "palindromes_empty.bed"))
+
+
+def _brute_force(sequence, min_len, max_len):
+    # all palindromes by increasing size then position
+    results = []
+    for size in range(min_len + min_len % 2, max_len + 1, 2):
+        for i in range(len(sequence) - size + 1):
+            subseq = sequence[i : i + size]
+            if "N" not in subseq and subseq == reverse_complement(subseq):
+                results.append((i, i + size, subseq))
+    return results
+
+
+def test_palindromes_expand(tmp_path):
+    fasta = tmp_path / "test.fa"
+    fasta.write_text(">A\nNNGAATTCNNaattGGATCCAT\n>B\nACGTACGTNNNNTTTTAAAA\n")
+    p = Palindromes(str(fasta), min_len=4, max_len=8)
+    p.run(progress=False, processes=2, expand=True)
+    for seqid, sequence in [("A", "NNGAATTCNNAATTGGATCCAT"), ("B", "ACGTACGTNNNNTTTTAAAA")]:
+        df = p.df.query("seqid == @seqid")
+        assert list(zip(df.start, df.end, df.sequence)) == _brute_force(sequence, 4, 8)
+
+    # one (longest) palindrome per center
+    p.run(progress=False, processes=1)
+    df = p.df.query("seqid == 'A'")
+    assert list(df.sequence) == ["GAATTC", "AATT", "TGGATCCA"]
+    assert set(p.df.query("seqid == 'B'").sequence) == {"ACGT", "ACGTACGT", "TTTTAAAA"}
+
+
+def test_palindromes_numba_fallback_parity():
+    p1 = Palindromes(fasta_file, max_len=None)
+    p1.run(progress=False)
+    orig = pal_module._HAS_NUMBA
+    try:
+        pal_module._HAS_NUMBA = False
+        p2 = Palindromes(fasta_file, max_len=None)
+        p2.run(progress=False)
+    finally:
+        pal_module._HAS_NUMBA = orig
+    pd.testing.assert_frame_equal(p1.df, p2.df)
+    assert p1.df.length.max() > 12
@@ -19,3 +19,60 @@ def test_running_median():
         assert True
     except:
         assert True
+
+
+def test_running_median_engines():
+    import numpy as np
+
+    from sequana.running_median import get_engines, running_median
+
+    x = np.random.randint(0, 20, 1000)
+    for circular in (False, True):
+        expected = RunningMedian(x, 101, engine="list", circular=circular).run()
+        for engine in get_engines():
+            assert (running_median(x, 101, engine=engine, circular=circular) == expected).all()
+
+    # circular mode is the running median of the wrapped data
+    y = randn(200)
+    rm = RunningMedian(y, 21, engine="blocked", circular=True).run()
+    padded = np.concatenate([y[-10:], y, y[:10]])
+    assert (rm == scipy.signal.medfilt(padded, 21)[10:-10]).all()
+
+    # histogram engine falls back to the generic engine above the cap
+    from sequana.running_median import HISTOGRAM_CAP
+
+    x[10] = HISTOGRAM_CAP + 1
+    assert (RunningMedian(x, 101, engine="histogram").run() == RunningMedian(x, 101).run()).all()
+    z = x + 0.5
+    assert (RunningMedian(z, 101, engine="histogram").run() == RunningMedian(z, 101).run()).all()
+
+    # NaN are handled by pandas whatever the engine
+    y[50] = np.nan
+    assert np.isnan(RunningMedian(y, 21, engine="tree").run()[50])
+
+    try:
+        RunningMedian(x, 101, engine="dummy").run()
+        assert False
+    except ValueError:
+        assert True
+
+
+def test_running_median_short_data():
+    import numpy as np
+
+    from sequana.running_median import get_engines
+
+    # a single window (N == W), with floats and integers
+    for W in (5, 11, 51):
+        for x in (randn(W), np.random.randint(0, 20, W)):
+            expected = RunningMedian(x, W, engine="list").run()
+            assert expected[W // 2] == np.median(x)
+            for engine in get_engines():
+                assert (RunningMedian(x, W, engine=engine).run() == expected).all()
+
+    # circular data shorter than the window (2 * W/2 <= N < W)
+    x = randn(10)
+    padded = np.concatenate([x[-5:], x, x[:5]])
+    expected = scipy.signal.medfilt(padded, 11)[5:-5]
+    for engine in get_engines():
+        assert (RunningMedian(x, 11, engine=engine, circular=True).run() == expected).all()
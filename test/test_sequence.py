@@ -1,5 +1,3 @@
-import shutil
-
 import pytest
 
 from sequana.sequence import DNA, RNA, Repeats, Sequence
@@ -77,8 +75,6 @@ def test_rna():
     rna = RNA("ACUG")
 
 
-@pytest.mark.external_tool
-@pytest.mark.skipif(shutil.which("shustring") is None, reason="shustring not installed")
 def test_repeats(tmpdir):
     datafile = f"{test_dir}/data/fasta/measles.fa"
     rep = Repeats(datafile)
@@ -207,3 +203,43 @@ def test_dna_get_karlin_signature_difference():
     result = dna.get_karlin_signature_difference(window=10)
     assert len(result) == len(seq)
     assert all(v >= 0 for v in result)
+
+
+def test_dna_sliding_metrics():
+    import math
+
+    import numpy as np
+
+    seq = "AACGTTTTGCAANACGGGGATATCCGTAAAAAAGCTNNGCA" * 3
+    dna = DNA(seq)
+    W = 10
+
+    # skews of the circular windows
+    dna.window = W
+    circular = seq + seq[: W - 1]
+    G, C = circular[5 : 5 + W].count("G"), circular[5 : 5 + W].count("C")
+    assert dna.GC_skew[0][5] == (G - C) / (G + C)
+    assert dna._GC_content_slide[0][5] == (G + C) / W
+    assert dna._Xn[-1] == sum(seq.count(x) for x in "AG") - sum(seq.count(x) for x in "CT")
+
+    # values at the center of the windows
+    entropy = dna.get_entropy(W)
+    window = seq[20 : 20 + W]
+    counts = [window.count(x) for x in "ACGT"] + [window.count("N")]
+    expected = -sum(c / W * math.log2(c / W) for c in counts if c)
+    assert np.isclose(entropy[20 + (W - 1) // 2], expected)
+    assert entropy[0] == entropy[(W - 1) // 2]
+
+    ie = dna.get_informational_entropy(W)
+    triplets = [seq[i : i + 3] for i in range(30, 30 + W)]
+    expected = -sum(triplets.count(t) / W * math.log2(triplets.count(t) / W) for t in set(triplets))
+    assert np.isclose(ie[30 + (W - 1) // 2], expected)
+
+    flex = dna.get_dna_flexibility(window=W)
+    assert len(flex) == len(seq)
+    assert np.isclose(flex[(W - 1) // 2], (7.6 + 14.6 + 8.9 + 14.6 + 7.6 * 3 + 10.9 + 11.1 + 10.9) / (W - 1))
+
+    for N in (2, 3):
+        expected = [sum(seq[i : i + W].count(x * N) for x in "ACGT") for i in range(len(seq))]
+        assert dna.get_homopolymers(N, window=W) == expected
+    assert dna.get_trinucleotide_count(window=W) == dna.get_homopolymers(3, window=W)
@@ -1,16 +1,15 @@
+import random
 import shutil
 
 import pytest
 
+from sequana.repeats import shustring
 from sequana.repeats.shustring import Repeats
 
 from . import test_dir
 
 fasta_file = f"{test_dir}/data/fasta/measles.fa"
 
-# shustring is an external bioconda binary; skip the whole module if unavailable.
-pytestmark = pytest.mark.skipif(shutil.which("shustring") is None, reason="shustring binary not installed")
-
 
 def test_repeats_basic():
     rr = Repeats(fasta_file)
@@ -56,3 +55,102 @@ def test_repeats_plots():
     rr.threshold = 4
     rr.plot()
     rr.hist_length_repeats()
+
+
+def _brute_shustrings(seq):
+    revcomp = seq.translate(str.maketrans("ACGT", "TGCA"))[::-1]
+    lengths = []
+    for i in range(len(seq)):
+        for L in range(1, len(seq) - i + 1):
+            sub = seq[i : i + L]
+            hits = sum(seq.startswith(sub, j) for j in range(len(seq)))
+            hits += sum(revcomp.startswith(sub, j) for j in range(len(seq)))
+            if hits == 1:
+                lengths.append(L)
+                break
+        else:
+            lengths.append(0)
+    return lengths
+
+
+def test_suffix_array():
+    import numpy as np
+
+    random.seed(1)
+    for text in ["banana", "AAAAAAAA", "ACGTACGTTTGACA"] + ["".join(random.choice("AC") for _ in range(40))]:
+        codes = np.frombuffer(text.encode(), dtype=np.uint8)
+        expected = sorted(range(len(text)), key=lambda i: text[i:])
+        assert shustring.suffix_array(codes).tolist() == expected
+    assert len(shustring.suffix_array([])) == 0
+
+
+def test_lcp():
+    import numpy as np
+
+    random.seed(2)
+    text = "".join(random.choice("ACGT") for _ in range(300))
+    codes = np.frombuffer(text.encode(), dtype=np.uint8).astype(np.int32)
+    sa = shustring.suffix_array(codes)
+    rank, lcp = shustring._lcp_python(codes, sa)
+    assert (rank[sa] == np.arange(len(text))).all()
+    for r in range(1, len(text)):
+        x, y = text[sa[r - 1] :], text[sa[r] :]
+        common = next((i for i, (u, v) in enumerate(zip(x, y)) if u != v), min(len(x), len(y)))
+        assert lcp[r] == common
+    if shustring._HAS_NUMBA:
+        rank2, lcp2 = shustring._lcp_numba(codes, sa)
+        assert (rank2 == rank).all() and (lcp2 == lcp).all()
+
+
+def test_get_shustrings():
+    random.seed(1)
+    for seq in ["ACGTTTACGT", "AAAAAAAA", "GAATTC", "acgNNacgt"] + [
+        "".join(random.choice("ACGT") for _ in range(60)) for _ in range(10)
+    ]:
+        lengths = shustring.get_shustrings(seq)
+        assert lengths.dtype == "int32"
+        assert lengths.tolist() == _brute_shustrings(seq.upper())
+
+    seq = "".join(random.choice("ACGT") for _ in range(300))
+    expected = shustring.get_shustrings(seq)
+    try:
+        shustring._HAS_NUMBA = False
+        assert (shustring.get_shustrings(seq) == expected).all()
+    finally:
+        shustring._HAS_NUMBA = shustring._lcp_numba is not None
+
+    # measles: values reported by the shustring tool
+    rr = Repeats(fasta_file)
+    rr.threshold = 11
+    assert rr.df_shustring.shape == (15888, 2)
+    assert rr.longest_shustring == 15
+    assert len(rr.begin_end_repeat_position) == 158
+
+    with pytest.raises(ValueError):
+        Repeats(fasta_file, method="dummy")
+
+
+def test_shustring_cache(tmpdir):
+    random.seed(3)
+    seq = "".join(random.choice("ACGT") for _ in range(300))
+    expected = shustring.get_shustrings(seq)
+
+    # on-disk cache, emptied when the FASTA file changes
+    fasta = tmpdir.join("test.fa")
+    fasta.write(f">chr1\n{seq}\n")
+    rep = Repeats(str(fasta), cache=True)
+    assert (rep.df_shustring["repeat_length"].to_numpy() == expected[expected > 0]).all()
+    assert len(tmpdir.join("test.fa.sqcache").listdir()) == 2
+    cached = shustring.ShustringCache(str(fasta)).get("chr1", "unused")
+    assert (cached == expected).all()
+    fasta.write(f">chr1\n{seq}A\n")
+    assert len(shustring.ShustringCache(str(fasta)).get("chr1", seq + "A")) == 301
+
+
+@pytest.mark.external_tool
+@pytest.mark.skipif(shutil.which("shustring") is None, reason="shustring not installed")
+def test_repeats_shustring_tool():
+    native = Repeats(fasta_file)
+    tool = Repeats(fasta_file, method="shustring")
+    assert native.longest_shustring == tool.longest_shustring
+    assert (native.df_shustring.values == tool.df_shustring.values).all()
@@ -1,6 +1,6 @@
 import gzip
 
-from sequana.taxonomy import NCBITaxonomy, Taxonomy
+from sequana.taxonomy import NCBITaxonomy, Taxonomy, TaxonomyIndex
 
 from . import test_dir
 
@@ -40,3 +40,39 @@ def test_taxonomy(tmp_path):
 
     ret = tax.fetch_by_id("10090")
     ret["name"]
+
+
+def test_taxonomy_index(tmp_path):
+    n = NCBITaxonomy(f"{test_dir}/data/names_filtered.dmp", f"{test_dir}/data/nodes_filtered.dmp")
+    filename = tmp_path / "taxo.csv.gz"
+    n.create_taxonomy_file(filename)
+    index = TaxonomyIndex.from_csv(filename)
+
+    assert len(index) == 22
+    assert 2732408 in index and 3 not in index
+    assert index.lineage(2732408) == [1, 10239, 2559587, 2732396, 2732408]
+    assert index.lineage(-10) == []
+    assert list(index.get_parent([2732408, 1, 12])) == [2732396, 1, -1]
+    assert list(index.get_names([11234, 12])) == ["Measles morbillivirus", None]
+    assert list(index.get_ranks([11234])) == ["species"]
+
+    # SARS-CoV-2 and measles share the Orthornavirae kingdom
+    assert list(index.lca([2697049, 2697049, 11234, 11234], [11234, 2697049, 11229, 12])) == [2732396, 2697049, 11229, -1]
+    assert index.lca_reduce([2697049, 694009, 2509511]) == 2509511
+    assert index.lca_reduce([2697049, 11234, 12]) == 2732396
+    assert index.lca_reduce([12]) == -1
+
+    lineages = index.get_lineages([2732408, 12, 1])
+    assert lineages.shape == (3, 5)
+    assert list(lineages[1]) == [-1] * 5 and list(lineages[2]) == [1, -1, -1, -1, -1]
+
+    index.save(tmp_path / "index.npz", signature="test")
+    other, metadata = TaxonomyIndex.load(tmp_path / "index.npz", with_metadata=True)
+    assert metadata == {"signature": "test"}
+    assert (other.parent == index.parent).all() and (other.depth == index.depth).all()
+    assert list(other.get_names([11234])) == ["Measles morbillivirus"]
+
+    from sequana.kraken.consensus import searchLCA
+
+    assert searchLCA(("2697049", "11234"), index, {}) == 2732396
+    assert searchLCA(("2697049",), index, {}) == 2697049
@@ -1,6 +1,6 @@
 import pytest
 
-from sequana.telomere import Telomere, circular_shifts, factorize_sequences
+from sequana.telomere import TelomerFilter, Telomere, circular_shifts, factorize_sequences
 
 from . import test_dir
 
@@ -259,3 +259,28 @@ def test_plot_summary():
     import pylab
 
     pylab.close(fig)
+
+
+@pytest.mark.parametrize("processes", [None, 2])
+def test_telomer_filter(tmpdir, processes):
+    import gzip
+
+    reads = [
+        ("telo1", "AACCCT" * 20),
+        ("telo2", "AGGGTT" * 15 + "ACGTACGTAC"),
+        ("other", "ACGTAGCTAGCTAGGATCGATCGATCGGGTTTAACCCTAAC" * 2),
+        ("partial", "CCCTAA" * 2 + "ACGTTGCAGT" * 9),
+    ]
+    fastq = tmpdir.join("reads.fastq")
+    fastq.write("".join(f"@{name}\n{seq}\n+\n{'I' * len(seq)}\n" for name, seq in reads))
+
+    tf = TelomerFilter(str(fastq))
+    telomeric, others = str(tmpdir.join("telo.fastq.gz")), str(tmpdir.join("others.fastq"))
+    assert tf.save_reads(telomeric, others, progress=False, processes=processes, batch_size=2) == 2
+    assert gzip.open(telomeric).read().decode().split("\n")[::4] == ["@telo1", "@telo2", ""]
+    assert open(others).read().split("\n")[::4] == ["@other", "@partial", ""]
+
+    batch = next(tf.fastq.iter_batches())
+    ratios = tf.get_telomeric_ratio(batch)
+    assert ratios[0] == (120 - 5) * 6 / 120
+    assert ratios[3] == (12 - 5) * 6 / 102
@@ -8,8 +8,10 @@ from sequana.tools import (
     fast_gc_content,
     gc_content,
     genbank_features_parser,
+    get_base_content,
     reverse,
     reverse_complement,
+    sliding_window_count,
 )
 
 from . import test_dir
@@ -60,6 +62,37 @@ def test_gc_content():
     gc_content(data, 101, circular=True)["chr1"]
 
 
+def test_sliding_window_count():
+    import numpy as np
+
+    seq = "AAGCGCAATTgcGGCA"
+    for W in [3, 4, 7]:
+        expected = [sum(x in "GCgc" for x in seq[i : i + W]) for i in range(len(seq) - W + 1)]
+        assert list(sliding_window_count(seq, W, "GCgc")) == expected
+        assert list(sliding_window_count(seq, W, "GCgc", chunksize=2)) == expected
+
+        mid = W // 2
+        padded = seq[-mid:] + seq + seq[:mid]
+        expected = [sum(x in "GCgc" for x in padded[i : i + W]) for i in range(len(seq))]
+        assert list(sliding_window_count(seq, W, "GCgc", circular=True)) == expected
+
+    gc = gc_content(f"{test_dir}/data/fasta/measles.fa", 5)["chr1"]
+    assert np.isnan(gc[:2]).all() and np.isnan(gc[-2:]).all()
+
+
+def test_get_base_content(tmpdir):
+    import numpy as np
+
+    data = tmpdir.join("measles.fa")
+    data.write(open(f"{test_dir}/data/fasta/measles.fa").read())
+    data = str(data)
+    expected = gc_content(data, 101, circular=True)["chr1"]
+    for _ in range(2):
+        gc = get_base_content(data, "chr1", 101, ["G", "C", "c", "g"], circular=True, cache=True)
+        assert np.allclose(gc, expected)
+    assert len([x for x in tmpdir.join("measles.fa.sqcache").listdir() if x.ext == ".npy"]) == 1
+
+
 def test_genbank_features_parser():
     data = f"{test_dir}/data/genbank/JB409847.gbk"
     genbank_features_parser(data)
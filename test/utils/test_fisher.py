@@ -1,6 +1,6 @@
 import pytest
 
-from sequana.utils.fisher import fisher_exact
+from sequana.utils.fisher import fisher_exact, fisher_exact_two_sided
 
 # values were computed with scipy
 # scipy.stats.fisher_exact(table=[[45, 40], [10, 5]], alternative="greater")
@@ -25,3 +25,22 @@ def test_others():
     fisher_exact([[45, 40], [10, 500000]], "two-sided")
     fisher_exact([[45, 40], [10, 500000]], "less")
     fisher_exact([[45, 40], [10, 500000]], "greater")
+
+
+def test_both_vectorised():
+    import numpy as np
+    from scipy.stats import fisher_exact as scipy_fisher_exact
+
+    rng = np.random.default_rng(0)
+    tables = rng.integers(0, 60, (200, 4))
+    tables[:5] = 0
+    tables[5:10, 1:] = 0
+    tables[10] = [45, 40, 10, 5]
+    # small blocks to check the block processing
+    pvalues = fisher_exact_two_sided(*tables.T, max_size=100)
+    assert pvalues[10] == pytest.approx(0.4048121346770015, 1e-9)
+    for (a, b, c, d), pvalue in zip(tables, pvalues):
+        assert pvalue == pytest.approx(scipy_fisher_exact([[a, b], [c, d]])[1], abs=1e-10)
+
+    with pytest.raises(ValueError):
+        fisher_exact_two_sided([-1], [0], [0], [0])